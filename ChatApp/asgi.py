@@ -14,3 +14,29 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ChatApp.settings')
 
 application = get_asgi_application()
+
+from django.conf import settings  # noqa: E402  (needs the settings configured above)
+
+if settings.CHAT_ASYNC_VIEWS:
+    from asgiref.wsgi import WsgiToAsgi
+    from whitenoise import WhiteNoise
+
+    def _not_found(environ, start_response):
+        start_response('404 Not Found', [('Content-Type', 'text/plain')])
+        return [b'Not Found']
+
+    # The WhiteNoise middleware is left out in this mode (see settings), so
+    # collected static files are answered here and never reach Django
+    static_prefix = '/' + settings.STATIC_URL.lstrip('/')
+    whitenoise = WhiteNoise(_not_found, root=settings.STATIC_ROOT, prefix=settings.STATIC_URL, autorefresh=settings.DEBUG)
+    if settings.DEBUG:
+        # Uncollected files too, as the middleware does with its finders
+        for directory in settings.STATICFILES_DIRS:
+            whitenoise.add_files(directory, prefix=settings.STATIC_URL)
+    static_files = WsgiToAsgi(whitenoise)
+    django_application = application
+
+    async def application(scope, receive, send):
+        if scope['type'] == 'http' and scope['path'].startswith(static_prefix):
+            return await static_files(scope, receive, send)
+        return await django_application(scope, receive, send)
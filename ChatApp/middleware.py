@@ -0,0 +1,89 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from . import routers
+
+REFRESH_KEY = '_expiry_refreshed_at'
+
+
+class SessionRefreshMiddleware:
+    """
+    Slide session expiry forward at most once per SESSION_REFRESH_INTERVAL.
+
+    SESSION_SAVE_EVERY_REQUEST rewrites the session on every request, which
+    for the chat polling endpoints means a write every couple of seconds
+    per open tab. Here an unmodified session is only marked for saving when
+    its last refresh is older than the interval; SessionMiddleware then
+    saves it with a fresh expiry as usual.
+    """
+
+    sync_capable = True
+    # Async too, so async views are not pushed into a thread on its account
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.get_response(request)
+        session = getattr(request, 'session', None)
+        if session is None or session.modified or session.is_empty():
+            return response
+        now = int(time.time())
+        if now - session.get(REFRESH_KEY, 0) >= settings.SESSION_REFRESH_INTERVAL:
+            session[REFRESH_KEY] = now
+        return response
+
+    async def __acall__(self, request):
+        response = await self.get_response(request)
+        session = getattr(request, 'session', None)
+        if session is None or session.modified or session.is_empty():
+            return response
+        now = int(time.time())
+        if now - await session.aget(REFRESH_KEY, 0) >= settings.SESSION_REFRESH_INTERVAL:
+            await session.aset(REFRESH_KEY, now)
+        return response
+
+
+class ReadReplicaMiddleware:
+    """
+    Per-request state for ``routers.ReadReplicaRouter``. A request that
+    wrote sets a short-lived cookie that keeps the client's reads on the
+    primary until the replica has caught up with the write.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with routers.routing(pinned=routers.PIN_COOKIE in request.COOKIES) as state:
+            response = self.get_response(request)
+        return self._pin(state, response)
+
+    async def __acall__(self, request):
+        with routers.routing(pinned=routers.PIN_COOKIE in request.COOKIES) as state:
+            response = await self.get_response(request)
+        return self._pin(state, response)
+
+    def _pin(self, state, response):
+        if state.wrote and routers.replica_alias() is not None:
+            response.set_cookie(
+                routers.PIN_COOKIE, '1',
+                max_age=settings.CHAT_REPLICA_PIN_SECONDS,
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
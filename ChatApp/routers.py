@@ -0,0 +1,101 @@
+"""
+Read replica routing.
+
+Everything reads from and writes to ``default`` unless a view is marked
+with ``@read_replica``; only then do its reads go to the
+``CHAT_READ_REPLICA`` alias, when one is configured. Views that compare
+the database against the cache versions (the update polls, sync, the
+change log) stay on the primary: a lagging replica would make them hand
+out a new version without the rows behind it, and the change would be
+skipped for good.
+
+Reads fall back to the primary:
+
+- inside a transaction, so locked reads and the writes after them agree;
+- for the rest of a request once it has written anything;
+- for ``CHAT_REPLICA_PIN_SECONDS`` after a request that wrote, through a
+  cookie set by ``ReadReplicaMiddleware``, so a sender reading the
+  conversation right after ``send_message`` sees their message.
+"""
+import contextvars
+from contextlib import contextmanager
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PIN_COOKIE = 'db_primary'
+
+_routing = contextvars.ContextVar('db_routing', default=None)
+
+
+class _Routing:
+    def __init__(self, pinned):
+        self.replica = False
+        self.pinned = pinned
+        self.wrote = False
+
+
+def replica_alias():
+    alias = settings.CHAT_READ_REPLICA
+    return alias if alias in settings.DATABASES else None
+
+
+@contextmanager
+def routing(pinned=False):
+    # Mutated in place, so writes made in sync_to_async threads are seen
+    state = _Routing(pinned)
+    token = _routing.set(state)
+    try:
+        yield state
+    finally:
+        _routing.reset(token)
+
+
+def _allow_replica():
+    state = _routing.get()
+    if state is not None:
+        state.replica = True
+
+
+def read_replica(view):
+    """Let the reads of ``view`` go to the replica, see the module docstring."""
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            _allow_replica()
+            return await view(request, *args, **kwargs)
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        _allow_replica()
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+class ReadReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _routing.get()
+        alias = replica_alias()
+        if (
+            alias is None
+            or state is None
+            or not state.replica
+            or state.pinned
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            # Explicit, or objects loaded from the replica would be saved back to it
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        state = _routing.get()
+        if state is not None:
+            state.pinned = state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases hold the same data
+        return True
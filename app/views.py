@@ -3,51 +3,38 @@ from django.contrib.auth.decorators import login_required
 from django.utils import timezone
 from django.db.models import Q
 from django.contrib.auth.models import User
-from chat.models import Message
-from django.db.models import Max, Count
-from django.db.models.functions import Greatest
+from chat.models import Message, UserStats
+from ChatApp.routers import read_replica
 
 
 # Create your views here.
 @login_required
+@read_replica
 def dashboard(request):
-    # Get unread message count
-    unread_count = Message.objects.filter(
-        recipient=request.user,
-        is_read=False
-    ).count()
-    
-    # Get active conversations (users with recent messages)
-    active_conversations = User.objects.filter(
-        Q(sent_messages__recipient=request.user) |
-        Q(received_messages__sender=request.user)
-    ).distinct().count()
-    
-    # Get total messages
-    total_messages = Message.objects.filter(
-        Q(sender=request.user) | Q(recipient=request.user)
-    ).count()
+    # Counters and recent contacts are kept in a single stats row
+    stats = UserStats.for_user(request.user)
     
     # Get recent messages (last 5)
     recent_messages = Message.objects.filter(
         Q(sender=request.user) | Q(recipient=request.user)
-    ).order_by('-timestamp')[:5]
+    ).select_related('sender', 'recipient', 'conversation').order_by('-timestamp')[:5]
     
-    # Get recent contacts (users with most recent messages)
-    recent_contacts = User.objects.filter(
-        Q(sent_messages__recipient=request.user) |
-        Q(received_messages__sender=request.user)
-    ).annotate(
-        last_interaction=Greatest(
-            Max('sent_messages__timestamp'),
-            Max('received_messages__timestamp')
+    # Read state comes from the conversation watermark
+    for message in recent_messages:
+        message.unread = (
+            message.recipient_id == request.user.id
+            and message.conversation is not None
+            and not message.conversation.is_read(message)
         )
-    ).distinct().order_by('-last_interaction')[:3]
+    
+    # Get recent contacts (peers of the most recently active conversations)
+    contacts = User.objects.in_bulk(stats.recent_contact_ids)
+    recent_contacts = [contacts[user_id] for user_id in stats.recent_contact_ids if user_id in contacts]
     
     context = {
-        'unread_count': unread_count,
-        'active_conversations': active_conversations,
-        'total_messages': total_messages,
+        'unread_count': stats.unread_count,
+        'active_conversations': stats.active_conversations,
+        'total_messages': stats.total_messages,
         'recent_messages': recent_messages,
         'recent_contacts': recent_contacts,
         'current_date': timezone.now(),
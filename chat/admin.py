@@ -1,5 +1,12 @@
 from django.contrib import admin
-from .models import Message
+from .models import Message, Conversation, GroupConversation, GroupMember, GroupMessage, Presence, UserStats, ChangeLog
 
 # Register your models here.
-admin.site.register(Message)
\ No newline at end of file
+admin.site.register(Message)
+admin.site.register(Conversation)
+admin.site.register(GroupConversation)
+admin.site.register(GroupMember)
+admin.site.register(GroupMessage)
+admin.site.register(Presence)
+admin.site.register(UserStats)
+admin.site.register(ChangeLog)
@@ -0,0 +1,199 @@
+"""
+Async variants of the chat endpoints polled most often, routed instead of
+the ones in ``views`` when ``CHAT_ASYNC_VIEWS`` is set.
+
+Reads use the async ORM and the async cache API, so a request only holds a
+thread while a query or cache call is actually running. Django has no
+async transactions, so the write paths run the shared sync helpers from
+``views`` through ``sync_to_async`` in a single hop.
+
+Responses are identical to the sync views.
+"""
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.contrib.auth.decorators import login_required
+from django.conf import settings
+from django.http import Http404, JsonResponse
+from django.shortcuts import aget_object_or_404
+from django.utils.cache import get_conditional_response
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import require_http_methods
+
+from ChatApp.routers import read_replica
+
+from . import ingest, typing_state, unread, versions
+from .events import notifier
+from .models import Conversation, Message
+from .serializers import astream_messages, message_rows, MessageSerializer
+from .views import (
+    INGEST_TIMEOUT_SECONDS, LONG_POLL_RECHECK_SECONDS, _conversation_etag, _create_message, _is_current,
+    _long_poll_seconds, _mark_read, _message_sent, _messages_page, _next_last_id, _page_params, _page_query,
+    _recipient_id, _set_validators, _updates_params, _updates_payload, _updates_query,
+)
+
+User = get_user_model()
+
+
+def _not_modified(request, etag, version):
+    # What @condition does for the sync views. It calls its callbacks
+    # synchronously, and they need request.user, which can't be loaded
+    # from async code.
+    return get_conditional_response(
+        request,
+        etag=etag,
+        last_modified=int(versions.last_modified(version).timestamp()),
+    )
+
+
+async def _updates_etag(user, peer_id, last_id):
+    version = await versions.aconversation_version(user, peer_id)
+    typing = await sync_to_async(typing_state.is_typing)(peer_id, user.id)
+    return _conversation_etag(user.id, peer_id, last_id, version, typing), version
+
+
+async def _wait_for_updates(request, user, peer_id, last_id, seconds):
+    # views._wait_for_updates, waiting on the event loop instead of a thread
+    loop = asyncio.get_running_loop()
+    key = notifier.key(user.id, peer_id)
+    event = notifier.listen(key, loop)
+    try:
+        etag, version = await _updates_etag(user, peer_id, last_id)
+        if not _is_current(request, etag):
+            return
+        deadline = loop.time() + seconds
+        while (remaining := deadline - loop.time()) > 0:
+            try:
+                await asyncio.wait_for(event.wait(), min(remaining, LONG_POLL_RECHECK_SECONDS))
+                return
+            except asyncio.TimeoutError:
+                if (await _updates_etag(user, peer_id, last_id))[0] != etag:
+                    return
+    finally:
+        notifier.unlisten(key, event)
+
+
+@login_required
+@cache_control(private=True, no_cache=True)
+async def get_unread_count(request):
+    user = await request.auser()
+    version = await versions.auser_version(user)
+    etag = versions.etag('u', user.id, version)
+    response = _not_modified(request, etag, version)
+    if response is None:
+        response = JsonResponse({'unread_count': await unread.aunread_total(user)})
+    _set_validators(response, etag, version)
+    return response
+
+
+@login_required
+@require_http_methods(["POST"])
+async def send_message(request):
+    user = await request.auser()
+    try:
+        try:
+            data = json.loads(request.body.decode('utf-8'))
+        except json.JSONDecodeError:
+            return JsonResponse({'status': 'error', 'message': 'Invalid JSON data'}, status=400)
+
+        if settings.CHAT_INGEST_GROUP_COMMIT:
+            # The recipient is checked by the writer, once per batch
+            recipient_id = _recipient_id(data)
+        else:
+            recipient = await aget_object_or_404(User, id=data.get('recipient_id'))
+        content = data.get('content', '').strip()
+
+        if not content:
+            return JsonResponse({'status': 'error', 'message': 'Message cannot be empty'}, status=400)
+
+        if settings.CHAT_INGEST_GROUP_COMMIT:
+            # Waits on the event loop, no thread is held for the commit
+            try:
+                message = await asyncio.wait_for(
+                    asyncio.wrap_future(ingest.submit(user, recipient_id, content)),
+                    INGEST_TIMEOUT_SECONDS,
+                )
+            except User.DoesNotExist:
+                raise Http404('No User matches the given query.')
+        else:
+            message = await sync_to_async(_create_message)(user, recipient, content)
+        return _message_sent(message, data)
+
+    except Exception as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
+
+
+@login_required
+@read_replica
+async def get_messages(request, user_id):
+    user = await request.auser()
+    try:
+        other_user = await User.objects.select_related('profile').aget(id=user_id)
+    except User.DoesNotExist:
+        return JsonResponse({
+            'error': 'User not found',
+            'status': 404
+        }, status=404)
+
+    try:
+        before_id, limit = _page_params(request)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid pagination parameters'}, status=400)
+
+    conversation = await Conversation.objects.between(user, other_user).afirst()
+    rows = []
+    if conversation:
+        # Opening the conversation moves the read watermark to its end
+        if before_id is None and conversation.unread_for(user):
+            await sync_to_async(_mark_read)(user, conversation)
+        rows = [row async for row in message_rows(_page_query(conversation, before_id, limit))]
+
+    return JsonResponse(_messages_page(user, other_user, conversation, rows, limit))
+
+
+@login_required
+@cache_control(private=True, no_cache=True)
+async def get_message_updates(request):
+    user = await request.auser()
+    try:
+        if not request.GET.get('user_id'):
+            return JsonResponse({'error': 'user_id parameter is required'}, status=400)
+        try:
+            peer_id, last_id = _updates_params(request)
+        except ValueError:
+            return JsonResponse({'error': 'Invalid last_id'}, status=400)
+
+        seconds = _long_poll_seconds(request)
+        if seconds:
+            await _wait_for_updates(request, user, peer_id, last_id, seconds)
+        etag, version = await _updates_etag(user, peer_id, last_id)
+        response = _not_modified(request, etag, version)
+        if response is not None:
+            return response
+
+        other_user = await User.objects.aget(id=peer_id)
+
+        conversation = await Conversation.objects.between(user, other_user).afirst()
+        messages = Message.objects.none()
+        if conversation:
+            if conversation.unread_for(user):
+                await sync_to_async(_mark_read)(user, conversation)
+            messages = _updates_query(conversation, last_id)
+
+        # Stream row by row, this may be the whole history
+        response = astream_messages(
+            messages,
+            MessageSerializer(user, conversation),
+            await sync_to_async(_updates_payload)(user, other_user, conversation),
+        )
+        # Validators for the state after marking read, so the next poll gets a 304
+        etag, version = await _updates_etag(user, peer_id, _next_last_id(conversation, last_id))
+        _set_validators(response, etag, version)
+        return response
+
+    except User.DoesNotExist:
+        return JsonResponse({'error': 'User not found'}, status=404)
+    except Exception as e:
+        return JsonResponse({'error': str(e)}, status=500)
@@ -0,0 +1,128 @@
+import asyncio
+import json
+import threading
+from collections import defaultdict
+
+from django.db import transaction
+
+
+# Maximum number of undelivered events kept per connection. A client that
+# falls this far behind is dropped back to polling instead of growing memory.
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+class EventBroker:
+    """
+    Process-local publish/subscribe hub for the chat push stream.
+
+    Subscribers are asyncio queues owned by the event loop serving the
+    stream; publishers may be sync views running in worker threads, so
+    delivery is always handed over with ``call_soon_threadsafe``.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def subscribe(self, user_id):
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers[user_id].add((loop, queue))
+        return queue
+
+    def unsubscribe(self, user_id, queue):
+        with self._lock:
+            subscribers = self._subscribers.get(user_id)
+            if not subscribers:
+                return
+            subscribers.difference_update({s for s in subscribers if s[1] is queue})
+            if not subscribers:
+                del self._subscribers[user_id]
+
+    def publish(self, user_id, event_type, data):
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+        event = {'type': event_type, 'data': data}
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(_offer, queue, event)
+            except RuntimeError:
+                # The loop serving this subscriber has already shut down
+                self.unsubscribe(user_id, queue)
+
+
+def _offer(queue, event):
+    try:
+        queue.put_nowait(event)
+    except asyncio.QueueFull:
+        pass
+
+
+broker = EventBroker()
+
+
+def publish_on_commit(user_id, event_type, data):
+    # Only announce state that other requests are able to read back
+    transaction.on_commit(lambda: broker.publish(user_id, event_type, data))
+
+
+class ConversationNotifier:
+    """
+    Wakes requests long-polling a conversation (see get_message_updates)
+    when it changes. In-process only: waiters also re-check the shared
+    cache versions now and then, to catch changes made by other workers.
+
+    A waiter is registered before the caller checks the database and only
+    then waited on, so a change landing in between is never missed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters = defaultdict(set)
+
+    @staticmethod
+    def key(user_a, user_b):
+        return tuple(sorted((user_a, user_b)))
+
+    def listen(self, key, loop=None):
+        """A threading.Event, or an asyncio.Event of ``loop``, set on the next notify."""
+        event = asyncio.Event() if loop is not None else threading.Event()
+        with self._lock:
+            self._waiters[key].add((loop, event))
+        return event
+
+    def unlisten(self, key, event):
+        with self._lock:
+            waiters = self._waiters.get(key)
+            if not waiters:
+                return
+            waiters.difference_update({w for w in waiters if w[1] is event})
+            if not waiters:
+                del self._waiters[key]
+
+    def notify(self, key):
+        with self._lock:
+            waiters = self._waiters.pop(key, ())
+        for loop, event in waiters:
+            if loop is None:
+                event.set()
+                continue
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # The loop of this waiter has already shut down
+                pass
+
+
+notifier = ConversationNotifier()
+
+
+def notify_on_commit(user_a, user_b):
+    key = notifier.key(user_a, user_b)
+    transaction.on_commit(lambda: notifier.notify(key))
+
+
+def format_sse(event):
+    payload = json.dumps(event['data'], ensure_ascii=False)
+    return f"event: {event['type']}\ndata: {payload}\n\n"
@@ -0,0 +1,178 @@
+"""
+Group conversations.
+
+A message sent to a group is one ``GroupMessage`` row and one update of
+the group, however many members it has. Members keep a read watermark
+(``GroupMember.last_read``) instead of per-message read flags, so their
+unread count is the number of messages past it, counted on the
+(group, id) index, and reading moves a single row.
+"""
+from django.db import transaction
+from django.db.models import Count, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from contacts import graph
+
+from .events import broker
+from .models import GroupConversation, GroupMember, GroupMessage, _pk
+
+# Every message is pushed to each member, this bounds that fan-out
+GROUP_MAX_MEMBERS = 500
+GROUP_NAME_MAX_LENGTH = 100
+
+GROUP_MESSAGE_FIELDS = ('id', 'group_id', 'sender_id', 'content', 'timestamp')
+
+
+def group_message_record(row):
+    """Same for every member, ``is_me`` is left to the client (``sender_id``)."""
+    if not isinstance(row, dict):
+        row = {field: getattr(row, field) for field in GROUP_MESSAGE_FIELDS}
+    return {
+        'id': row['id'],
+        'group_id': row['group_id'],
+        'sender_id': row['sender_id'],
+        'content': row['content'],
+        'timestamp': row['timestamp'].isoformat(),
+    }
+
+
+def group_record(member):
+    """``member`` comes from ``memberships``, with its group and unread count."""
+    group = member.group
+    return {
+        'id': group.id,
+        'name': group.name,
+        'owner_id': group.owner_id,
+        'member_count': group.member_count,
+        'last_activity': group.last_activity.isoformat(),
+        'last_message': group_message_record(group.last_message) if group.last_message else None,
+        'last_read': member.last_read,
+        'unread_count': member.unread_count,
+    }
+
+
+def _unread_count():
+    # One index range scan per group: (group, id) past the member's watermark
+    unread = GroupMessage.objects.filter(
+        group_id=OuterRef('group_id'), id__gt=OuterRef('last_read')
+    ).order_by().values('group_id').annotate(count=Count('id')).values('count')
+    return Coalesce(Subquery(unread), Value(0))
+
+
+def memberships(user):
+    """``user``'s memberships with their group and unread count, most recently active first."""
+    return GroupMember.objects.filter(user_id=_pk(user)).select_related(
+        'group__last_message'
+    ).annotate(unread_count=_unread_count()).order_by('-group__last_activity', '-group_id')
+
+
+def membership(user, group_id):
+    return memberships(user).filter(group_id=group_id).first()
+
+
+def _check_members(owner, user_ids, current=0):
+    if user_ids - graph.contact_ids(owner):
+        raise ValueError('Members must be your contacts')
+    if current + len(user_ids) > GROUP_MAX_MEMBERS:
+        raise ValueError(f'A group can have at most {GROUP_MAX_MEMBERS} members')
+
+
+def create(owner, name, member_ids):
+    """Create a group of ``owner`` and ``member_ids`` (their contacts). Raises ValueError on bad input."""
+    name = (name or '').strip()
+    if not name or len(name) > GROUP_NAME_MAX_LENGTH:
+        raise ValueError(f'Group name must be 1 to {GROUP_NAME_MAX_LENGTH} characters')
+    member_ids = set(member_ids) - {_pk(owner)}
+    _check_members(owner, member_ids, current=1)
+    with transaction.atomic():
+        group = GroupConversation.objects.create(name=name, owner_id=_pk(owner), member_count=len(member_ids) + 1)
+        GroupMember.objects.bulk_create(
+            [GroupMember(group=group, user_id=user_id) for user_id in [_pk(owner), *sorted(member_ids)]]
+        )
+    return group
+
+
+def add_members(group, user_ids):
+    """Add the owner's contacts ``user_ids``; they start with nothing unread. Returns the ids added."""
+    with transaction.atomic():
+        # Locked, so concurrent changes can't push member_count past the limit
+        group = GroupConversation.objects.select_for_update().get(pk=group.pk)
+        user_ids = set(user_ids) - set(
+            GroupMember.objects.filter(group=group, user_id__in=user_ids).values_list('user_id', flat=True)
+        )
+        if not user_ids:
+            return []
+        _check_members(group.owner_id, user_ids, current=group.member_count)
+        GroupMember.objects.bulk_create([
+            GroupMember(group=group, user_id=user_id, last_read=group.last_message_id or 0)
+            for user_id in sorted(user_ids)
+        ])
+        group.member_count += len(user_ids)
+        group.save(update_fields=['member_count'])
+    return sorted(user_ids)
+
+
+def leave(group, user):
+    """
+    Take ``user`` out of ``group``. The longest-standing member takes over
+    from an owner who leaves; the last one out deletes the group.
+    """
+    with transaction.atomic():
+        group = GroupConversation.objects.select_for_update().get(pk=group.pk)
+        if not GroupMember.objects.filter(group=group, user_id=_pk(user)).delete()[0]:
+            return
+        group.member_count -= 1
+        if not group.member_count:
+            group.delete()
+            return
+        if group.owner_id == _pk(user):
+            group.owner_id = GroupMember.objects.filter(group=group).order_by('joined_at', 'id').values_list(
+                'user_id', flat=True
+            )[0]
+        group.save(update_fields=['member_count', 'owner'])
+
+
+def send(group, sender, content):
+    """Store one message for the whole group and push it to every member."""
+    with transaction.atomic():
+        message = GroupMessage.objects.create(group=group, sender_id=_pk(sender), content=content)
+        # Guarded, so a slower concurrent send can't move them backwards
+        GroupConversation.objects.filter(pk=group.pk).filter(
+            Q(last_message__isnull=True) | Q(last_message_id__lt=message.id)
+        ).update(last_message=message, last_activity=message.timestamp)
+        # Writing to the group means having read it
+        GroupMember.objects.filter(group=group, user_id=_pk(sender), last_read__lt=message.id).update(
+            last_read=message.id
+        )
+        member_ids = list(GroupMember.objects.filter(group=group).values_list('user_id', flat=True))
+
+        # Serialized once and handed out in a single callback
+        data = group_message_record(message)
+
+        def publish():
+            for user_id in member_ids:
+                broker.publish(user_id, 'group_message', data)
+        transaction.on_commit(publish)
+    return message
+
+
+def mark_read(group, user, up_to=None):
+    """
+    Move ``user``'s watermark to ``up_to``, or to the group's latest
+    message, with one update. Returns whether it moved.
+    """
+    # Never past the latest message, or later ones would start out read
+    up_to = group.last_message_id if up_to is None else min(up_to, group.last_message_id or 0)
+    if not up_to:
+        return False
+    return bool(GroupMember.objects.filter(group=group, user_id=_pk(user), last_read__lt=up_to).update(
+        last_read=up_to
+    ))
+
+
+def page_query(group, before_id, limit):
+    # Keyset pagination, newest first, like the one-to-one history
+    messages = GroupMessage.objects.filter(group=group)
+    if before_id is not None:
+        messages = messages.filter(id__lt=before_id)
+    return messages.order_by('-id').values(*GROUP_MESSAGE_FIELDS)[:limit + 1]
@@ -0,0 +1,208 @@
+"""
+Message writes, one or many at a time.
+
+``create_messages`` stores any number of messages in one transaction with
+set-based statements: one insert for the messages and one for their search
+terms, one update per conversation, one locked pass over the
+participants' stats, whose locked rows then number the change log entries,
+and one change log insert. ``send_message`` uses it for a single message
+and ``send_messages`` for a batch.
+
+With ``CHAT_INGEST_GROUP_COMMIT`` set, ``send_message`` goes through
+``submit`` instead: messages are queued for a writer thread that commits
+whatever arrived within ``CHAT_INGEST_MAX_DELAY_MS`` (up to
+``CHAT_INGEST_MAX_BATCH`` messages) with a single ``create_messages``.
+The request waits for that commit, so a message is only acknowledged, with
+its id and timestamp, once it is stored; a burst costs a few milliseconds
+of latency instead of a transaction per message.
+"""
+import logging
+import queue
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import close_old_connections, connections, router, transaction
+from django.db.models import Max
+
+from . import unread, versions
+from .events import notify_on_commit, publish_on_commit
+from .models import ChangeLog, Conversation, Message, MessageSearchTerm, UserStats
+from .serializers import MessageSerializer
+
+logger = logging.getLogger(__name__)
+
+User = get_user_model()
+
+
+# What a read-back message is matched on, see _insert
+_READ_BACK_FIELDS = ('conversation_id', 'sender_id', 'recipient_id', 'timestamp', 'content')
+
+
+def _insert(messages):
+    if len(messages) == 1:
+        messages[0].save(force_insert=True)
+        return
+    returns_ids = connections[router.db_for_write(Message)].features.can_return_rows_from_bulk_insert
+    if not returns_ids:
+        # Highest id before the insert, for the read-back below
+        floor = Message.objects.aggregate(floor=Max('id'))['floor'] or 0
+    Message.objects.bulk_create(messages)
+    if returns_ids:
+        return
+    # MySQL doesn't return ids from a bulk insert. Read ours back from past
+    # the floor, matched on everything we wrote; one statement's rows get
+    # increasing ids, so identical messages are matched in insertion order.
+    pending = defaultdict(deque)
+    for message in messages:
+        pending[tuple(getattr(message, field) for field in _READ_BACK_FIELDS)].append(message)
+    rows = Message.objects.filter(
+        id__gt=floor,
+        conversation_id__in={message.conversation_id for message in messages},
+        sender_id__in={message.sender_id for message in messages},
+    ).order_by('id').values_list('id', *_READ_BACK_FIELDS)
+    for message_id, *fields in rows:
+        waiting = pending.get(tuple(fields))
+        if waiting:
+            waiting.popleft().id = message_id
+    if any(pending.values()):
+        raise RuntimeError('Could not read back the ids of inserted messages')
+
+
+def create_messages(messages):
+    """
+    Store unsaved ``messages`` (sender, recipient and content set), update
+    everything derived from them and push them out, all in one transaction.
+    Returns them with ids, timestamps and conversations filled in.
+    """
+    with transaction.atomic():
+        conversations = Conversation.for_pairs((message.sender_id, message.recipient_id) for message in messages)
+        new_conversation_ids = {
+            conversation.id for conversation in conversations.values() if conversation.last_message_id is None
+        }
+        for message in messages:
+            message.conversation = conversations[tuple(sorted((message.sender_id, message.recipient_id)))]
+        _insert(messages)
+
+        by_conversation = defaultdict(list)
+        for message in messages:
+            by_conversation[message.conversation_id].append(message)
+        # In id order so concurrent batches lock rows in the same order
+        for conversation_id in sorted(by_conversation):
+            conversation = by_conversation[conversation_id][0].conversation
+            conversation.record_messages(by_conversation[conversation_id])
+            versions.touch_conversation(conversation)
+        MessageSearchTerm.index_messages(messages)
+        unread.add_unread_many(Counter(message.recipient_id for message in messages))
+        stats = UserStats.record_messages(messages, new_conversation_ids)
+        ChangeLog.record_messages(messages, locked=stats)
+
+        for message in messages:
+            # Push to the recipient and to the sender's other open tabs
+            publish_on_commit(message.recipient_id, 'message', MessageSerializer(message.recipient_id)(message))
+            publish_on_commit(message.sender_id, 'message', MessageSerializer(message.sender_id)(message))
+        for conversation in {message.conversation for message in messages}:
+            notify_on_commit(conversation.user_low_id, conversation.user_high_id)
+    return messages
+
+
+class IngestQueue:
+    """
+    Group commit for ``send_message``: a writer thread drains the queue in
+    batches and stores each batch with one ``create_messages``. Started on
+    first use, so every worker process gets its own.
+    """
+
+    def __init__(self, max_batch, max_delay):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, message):
+        """Queue an unsaved message; the future resolves to it once it is committed."""
+        future = Future()
+        self._start()
+        self._queue.put((message, future))
+        return future
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='chat-ingest', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            # Like a request: drop a connection that timed out or went away
+            close_old_connections()
+            try:
+                self._write(batch)
+            except Exception:
+                logger.exception('Message ingest batch failed')
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(RuntimeError('Message could not be stored'))
+
+    def _write(self, batch):
+        # Checked here, once per batch, instead of a lookup per request
+        known = set(User.objects.filter(
+            id__in={message.recipient_id for message, _ in batch}
+        ).values_list('id', flat=True))
+        valid = []
+        for message, future in batch:
+            if message.recipient_id in known:
+                valid.append((message, future))
+            else:
+                future.set_exception(User.DoesNotExist('Recipient not found'))
+        if not valid:
+            return
+
+        try:
+            create_messages([message for message, _ in valid])
+        except Exception as e:
+            if len(valid) == 1:
+                valid[0][1].set_exception(e)
+                return
+            # Don't let one bad message fail the rest: store them one by one
+            for message, future in valid:
+                message.pk = None
+                try:
+                    create_messages([message])
+                except Exception as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(message)
+            return
+        for message, future in valid:
+            future.set_result(message)
+
+
+_ingest_queue = None
+_ingest_queue_lock = threading.Lock()
+
+
+def submit(sender, recipient_id, content):
+    """Queue a message for the group commit writer, see ``IngestQueue``."""
+    global _ingest_queue
+    with _ingest_queue_lock:
+        if _ingest_queue is None:
+            _ingest_queue = IngestQueue(
+                settings.CHAT_INGEST_MAX_BATCH,
+                settings.CHAT_INGEST_MAX_DELAY_MS / 1000,
+            )
+    return _ingest_queue.submit(Message(sender_id=sender.pk, recipient_id=recipient_id, content=content))
@@ -0,0 +1,211 @@
+import asyncio
+import statistics
+import threading
+import time
+import types
+from http.cookies import SimpleCookie
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.models import Session
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management.base import BaseCommand
+from django.db.backends.signals import connection_created
+from django.db import connections
+from django.test import Client, override_settings
+from django.urls import path
+from django.utils.crypto import get_random_string
+
+from chat import async_views, views
+from chat.models import Conversation, Message, UserStats
+
+User = get_user_model()
+
+HOST = 'benchmark.invalid'
+VARIANTS = (('sync views', views), ('async views', async_views))
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive the sync and async chat endpoints through the ASGI handler with '
+        'many concurrent clients and report throughput, latency, and peak '
+        'threads against requests in flight. Works on committed rows (worker '
+        'threads use their own connections), which are deleted afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=50)
+        parser.add_argument('--rounds', type=int, default=10,
+                            help='Request mixes (unread, updates, history, send) per client')
+        parser.add_argument('--query-latency', type=float, default=2.0,
+                            help='Milliseconds added to every query, as a network round trip')
+        parser.add_argument('--history', type=int, default=30)
+
+    def handle(self, *args, **options):
+        users = self._create_users(options)
+        latency = options['query_latency'] / 1000
+
+        def slow(execute, sql, params, many, context):
+            time.sleep(latency)
+            return execute(sql, params, many, context)
+
+        def add_latency(sender, connection, **kwargs):
+            connection.execute_wrappers.append(slow)
+
+        connection_created.connect(add_latency)
+        try:
+            self.stdout.write(
+                f"{'variant':<14}{'requests':>10}{'errors':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}"
+                f"{'peak in flight':>16}{'peak threads':>14}"
+            )
+            for label, module in VARIANTS:
+                # New connections only, so nothing opened before is left unwrapped
+                connections.close_all()
+                stats = self._run(module, users, options)
+                self.stdout.write(
+                    f"{label:<14}{stats['requests']:>10}{stats['errors']:>8}{stats['rate']:>9.1f}"
+                    f"{stats['p50']:>9.1f}{stats['p95']:>9.1f}"
+                    f"{stats['in_flight']:>16}{stats['threads']:>14}"
+                )
+        finally:
+            connection_created.disconnect(add_latency)
+            connections.close_all()
+            self._cleanup(users)
+
+    def _create_users(self, options):
+        peer = User.objects.create_user(f'bench_async_peer_{get_random_string(6)}', password=None)
+        clients = []
+        for i in range(options['clients']):
+            user = User.objects.create_user(f'bench_async_{get_random_string(6)}_{i}', password=None)
+            conversation = Conversation.between(user, peer)
+            Message.objects.bulk_create([
+                Message(sender=peer if n % 2 else user, recipient=user if n % 2 else peer,
+                        conversation=conversation, content=f'benchmark message {n}')
+                for n in range(options['history'])
+            ])
+            last_id = Message.objects.filter(conversation=conversation).order_by('-id').values_list('id', flat=True)[0]
+            Conversation.objects.filter(pk=conversation.pk).update(last_message_id=last_id)
+            # Steady state: stats rows exist, so reads never turn into rebuilds
+            UserStats.rebuild(user)
+
+            client = Client()
+            client.force_login(user)
+            clients.append({
+                'user': user,
+                'session': client.cookies[settings.SESSION_COOKIE_NAME].value,
+                'last_id': last_id,
+            })
+        return {'peer': peer, 'clients': clients}
+
+    def _cleanup(self, users):
+        Session.objects.filter(session_key__in=[c['session'] for c in users['clients']]).delete()
+        User.objects.filter(pk__in=[users['peer'].pk, *[c['user'].pk for c in users['clients']]]).delete()
+
+    def _run(self, module, users, options):
+        peer_id = users['peer'].pk
+        urlconf = types.ModuleType(f'benchmark_urls_{module.__name__}')
+        urlconf.urlpatterns = [
+            path('unread/', module.get_unread_count),
+            path('updates/', module.get_message_updates),
+            path('get/<int:user_id>/', module.get_messages),
+            path('send/', module.send_message),
+        ]
+        middleware = [m for m in settings.MIDDLEWARE if m != 'whitenoise.middleware.WhiteNoiseMiddleware']
+        overrides = override_settings(
+            ROOT_URLCONF=urlconf,
+            MIDDLEWARE=middleware,
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, HOST],
+        )
+        with overrides:
+            return asyncio.run(self._drive(ASGIHandler(), users['clients'], peer_id, options))
+
+    async def _drive(self, handler, clients, peer_id, options):
+        timings = []
+        errors = [0]
+        in_flight = [0, 0]  # current, peak
+        peak_threads = [threading.active_count()]
+        done = asyncio.Event()
+
+        async def sample_threads():
+            while not done.is_set():
+                peak_threads[0] = max(peak_threads[0], threading.active_count())
+                await asyncio.sleep(0.001)
+
+        async def request(client, method, url, body=b''):
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight[1], in_flight[0])
+            started = time.perf_counter()
+            try:
+                status = await _call(handler, client, method, url, body)
+            finally:
+                in_flight[0] -= 1
+            timings.append(time.perf_counter() - started)
+            errors[0] += status >= 400
+
+        async def run_client(client):
+            for round_ in range(options['rounds']):
+                await request(client, 'GET', '/unread/')
+                await request(client, 'GET', f"/updates/?user_id={peer_id}&last_id={client['last_id']}")
+                await request(client, 'GET', f'/get/{peer_id}/')
+                body = f'{{"recipient_id": {peer_id}, "content": "benchmark {round_}"}}'
+                await request(client, 'POST', '/send/', body.encode())
+
+        sampler = asyncio.create_task(sample_threads())
+        started = time.perf_counter()
+        await asyncio.gather(*(run_client(client) for client in clients))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await sampler
+
+        timings.sort()
+        return {
+            'requests': len(timings),
+            'errors': errors[0],
+            'rate': len(timings) / elapsed,
+            'p50': statistics.median(timings) * 1000,
+            'p95': timings[int(len(timings) * 0.95) - 1] * 1000,
+            'in_flight': in_flight[1],
+            'threads': peak_threads[0],
+        }
+
+
+async def _call(handler, client, method, url, body):
+    path_, _, query = url.partition('?')
+    csrf = get_random_string(32)
+    cookie = SimpleCookie({settings.SESSION_COOKIE_NAME: client['session'], settings.CSRF_COOKIE_NAME: csrf})
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': method,
+        'scheme': 'http',
+        'path': path_,
+        'raw_path': path_.encode(),
+        'query_string': query.encode(),
+        'root_path': '',
+        'headers': [
+            (b'host', HOST.encode()),
+            (b'cookie', cookie.output(header='', sep=';').strip().encode()),
+            (b'x-csrftoken', csrf.encode()),
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode()),
+        ],
+        'client': ('127.0.0.1', 0),
+        'server': (HOST, 80),
+    }
+    received = [False]
+    status = [0]
+
+    async def receive():
+        if not received[0]:
+            received[0] = True
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        # Nothing more will come; wait like a client that stays connected
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status[0] = message['status']
+
+    await handler(scope, receive, send)
+    return status[0]
@@ -0,0 +1,146 @@
+import statistics
+import threading
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.utils.crypto import get_random_string
+
+from chat import ingest
+from chat.models import Message, UserStats
+
+User = get_user_model()
+
+
+class _CountingQueue(ingest.IngestQueue):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.batches = 0
+
+    def _write(self, batch):
+        self.batches += 1
+        super()._write(batch)
+
+
+class Command(BaseCommand):
+    help = (
+        'Send the same burst of messages from many concurrent clients one '
+        'transaction per message, through the group commit queue, and through '
+        'the batch API, and report throughput, latency and transactions. Works '
+        'on committed rows (clients use their own connections), which are '
+        'deleted afterwards.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=20)
+        parser.add_argument('--messages', type=int, default=50, help='Messages per client')
+        parser.add_argument('--batch-size', type=int, default=50, help='Messages per batch API request')
+        parser.add_argument('--max-delay', type=float, default=5.0, help='Group commit window in milliseconds')
+        parser.add_argument('--query-latency', type=float, default=1.0,
+                            help='Milliseconds added to every query, as a network round trip')
+
+    def handle(self, *args, **options):
+        pairs = self._create_users(options)
+        latency = options['query_latency'] / 1000
+
+        def slow(execute, sql, params, many, context):
+            time.sleep(latency)
+            return execute(sql, params, many, context)
+
+        def add_latency(sender, connection, **kwargs):
+            # The writer thread reconnects between batches on the same wrapper
+            if slow not in connection.execute_wrappers:
+                connection.execute_wrappers.append(slow)
+
+        connection_created.connect(add_latency)
+        try:
+            self.stdout.write(
+                f"{'mode':<16}{'messages':>10}{'errors':>8}{'msg/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'transactions':>14}"
+            )
+            for label, mode in (('per message', self._per_message),
+                                ('group commit', self._group_commit),
+                                ('batch API', self._batch_api)):
+                # New connections only, so nothing opened before is left unwrapped
+                connections.close_all()
+                stats = self._run(mode, pairs, options)
+                self.stdout.write(
+                    f"{label:<16}{stats['messages']:>10}{stats['errors']:>8}{stats['rate']:>9.1f}"
+                    f"{stats['p50']:>9.1f}{stats['p95']:>9.1f}{stats['transactions']:>14}"
+                )
+        finally:
+            connection_created.disconnect(add_latency)
+            connections.close_all()
+            User.objects.filter(pk__in=[user.pk for pair in pairs for user in pair]).delete()
+
+    def _create_users(self, options):
+        tag = get_random_string(6)
+        pairs = []
+        for i in range(options['clients']):
+            sender = User.objects.create_user(f'bench_ingest_{tag}_{i}', password=None)
+            recipient = User.objects.create_user(f'bench_ingest_{tag}_{i}_peer', password=None)
+            # Steady state: stats rows exist, so writes never turn into rebuilds
+            UserStats.rebuild(sender)
+            UserStats.rebuild(recipient)
+            pairs.append((sender, recipient))
+        return pairs
+
+    def _per_message(self, sender, recipient, contents, options, state):
+        for content in contents:
+            started = time.perf_counter()
+            ingest.create_messages([Message(sender=sender, recipient=recipient, content=content)])
+            yield time.perf_counter() - started, 1
+
+    def _group_commit(self, sender, recipient, contents, options, state):
+        for content in contents:
+            started = time.perf_counter()
+            state['queue'].submit(Message(sender=sender, recipient=recipient, content=content)).result()
+            yield time.perf_counter() - started, 1
+
+    def _batch_api(self, sender, recipient, contents, options, state):
+        size = options['batch_size']
+        for start in range(0, len(contents), size):
+            chunk = contents[start:start + size]
+            started = time.perf_counter()
+            ingest.create_messages([Message(sender=sender, recipient=recipient, content=c) for c in chunk])
+            # Every message of the request waited this long
+            yield time.perf_counter() - started, len(chunk)
+
+    def _run(self, mode, pairs, options):
+        state = {'queue': _CountingQueue(10 ** 6, options['max_delay'] / 1000)}
+        timings, errors, transactions = [], [0], [0]
+        lock = threading.Lock()
+
+        def client(sender, recipient):
+            contents = [f'benchmark message {n}' for n in range(options['messages'])]
+            try:
+                for elapsed, count in mode(sender, recipient, contents, options, state):
+                    with lock:
+                        timings.extend([elapsed] * count)
+                        transactions[0] += mode != self._group_commit
+            except Exception:
+                with lock:
+                    errors[0] += 1
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=client, args=pair) for pair in pairs]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        if mode == self._group_commit:
+            transactions[0] = state['queue'].batches
+        timings.sort()
+        return {
+            'messages': len(timings),
+            'errors': errors[0],
+            'rate': len(timings) / elapsed,
+            'p50': statistics.median(timings) * 1000 if timings else 0,
+            'p95': timings[max(int(len(timings) * 0.95) - 1, 0)] * 1000 if timings else 0,
+            'transactions': transactions[0],
+        }
@@ -0,0 +1,95 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from chat.models import Conversation, Message, MessageSearchTerm
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare message search through the inverted index against a '
+        'content__icontains scan. Runs on synthetic data inside a transaction '
+        'that is rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=20000)
+        parser.add_argument('--conversations', type=int, default=20)
+        parser.add_argument('--queries', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        vocabulary = [f'word{i}' for i in range(5000)]
+
+        with transaction.atomic():
+            conversation_ids = self._populate(rng, vocabulary, options)
+
+            # Skewed query terms: mostly common words, some rare ones
+            queries = [vocabulary[min(int(rng.expovariate(1 / 200)), len(vocabulary) - 1)]
+                       for _ in range(options['queries'])]
+
+            like = self._time(queries, lambda q: list(
+                Message.objects.filter(
+                    conversation_id__in=conversation_ids,
+                    content__icontains=q
+                ).order_by('-id').values_list('id', flat=True)[:20]
+            ))
+            index = self._time(queries, lambda q: list(
+                Message.objects.in_bulk([
+                    hit['message_id']
+                    for hit in MessageSearchTerm.search(q, conversation_ids)[:20]
+                ])
+            ))
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(f"{'method':<16}{'mean ms':>10}{'p95 ms':>10}")
+        for name, timings in (('LIKE scan', like), ('inverted index', index)):
+            p95 = sorted(timings)[int(len(timings) * 0.95) - 1]
+            self.stdout.write(f'{name:<16}{statistics.mean(timings):>10.2f}{p95:>10.2f}')
+
+    def _populate(self, rng, vocabulary, options):
+        users = [
+            User.objects.create_user(f'bench_search_{i}', password=None)
+            for i in range(options['conversations'] + 1)
+        ]
+        conversations = [Conversation.between(users[0], user) for user in users[1:]]
+
+        messages = []
+        for _ in range(options['messages']):
+            conversation = rng.choice(conversations)
+            sender_id, recipient_id = conversation.user_low_id, conversation.user_high_id
+            if rng.random() < 0.5:
+                sender_id, recipient_id = recipient_id, sender_id
+            words = [vocabulary[min(int(rng.expovariate(1 / 200)), len(vocabulary) - 1)]
+                     for _ in range(rng.randint(3, 15))]
+            messages.append(Message(
+                sender_id=sender_id,
+                recipient_id=recipient_id,
+                conversation=conversation,
+                content=' '.join(words),
+            ))
+        Message.objects.bulk_create(messages, batch_size=1000)
+
+        conversation_ids = [conversation.id for conversation in conversations]
+        # Not every backend returns ids from bulk_create, so read them back
+        created = Message.objects.filter(conversation_id__in=conversation_ids).only(
+            'id', 'conversation_id', 'content'
+        )
+        MessageSearchTerm.index_messages(list(created))
+        return conversation_ids
+
+    def _time(self, queries, search):
+        timings = []
+        for query in queries:
+            started = time.perf_counter()
+            search(query)
+            timings.append((time.perf_counter() - started) * 1000)
+        return timings
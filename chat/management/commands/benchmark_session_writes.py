@@ -0,0 +1,90 @@
+import time
+import types
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+import ChatApp.middleware
+
+User = get_user_model()
+
+REFRESH_MIDDLEWARE = 'ChatApp.middleware.SessionRefreshMiddleware'
+
+# (label, session engine, save every request, coalesced refresh)
+SCENARIOS = (
+    ('db, save every request', 'django.contrib.sessions.backends.db', True, False),
+    ('db, coalesced', 'django.contrib.sessions.backends.db', False, True),
+    ('cached_db, coalesced', 'django.contrib.sessions.backends.cached_db', False, True),
+    ('signed_cookies, coalesced', 'django.contrib.sessions.backends.signed_cookies', False, True),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Simulate logged-in clients polling the unread counter and report '
+        'session reads and writes per minute per client for each session '
+        'configuration. Runs on a simulated clock inside a transaction that '
+        'is rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=10)
+        parser.add_argument('--minutes', type=int, default=5)
+        parser.add_argument('--poll-interval', type=float, default=2.0)
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"{'configuration':<28}{'writes/min/client':>19}{'reads/min/client':>18}{'cookie sets':>13}"
+        )
+        for label, engine, save_every_request, coalesced in SCENARIOS:
+            writes, reads, cookies = self._run(engine, save_every_request, coalesced, options)
+            per_client_minute = options['clients'] * options['minutes']
+            self.stdout.write(
+                f'{label:<28}{writes / per_client_minute:>19.2f}'
+                f'{reads / per_client_minute:>18.2f}{cookies:>13}'
+            )
+
+    def _run(self, engine, save_every_request, coalesced, options):
+        middleware = [m for m in settings.MIDDLEWARE if m != REFRESH_MIDDLEWARE]
+        if coalesced:
+            middleware.insert(middleware.index('django.contrib.sessions.middleware.SessionMiddleware') + 1,
+                              REFRESH_MIDDLEWARE)
+
+        started = time.time()
+        clock = [started]
+        fake_time = types.SimpleNamespace(time=lambda: clock[0])
+        overrides = override_settings(
+            SESSION_ENGINE=engine,
+            SESSION_SAVE_EVERY_REQUEST=save_every_request,
+            MIDDLEWARE=middleware,
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+        )
+        with overrides, mock.patch.object(ChatApp.middleware, 'time', fake_time), transaction.atomic():
+            clients = []
+            for i in range(options['clients']):
+                client = Client()
+                client.force_login(User.objects.create_user(f'bench_session_{i}', password=None))
+                clients.append(client)
+
+            url = reverse('get_unread_count')
+            polls = int(options['minutes'] * 60 / options['poll_interval'])
+            cookies = 0
+            with CaptureQueriesContext(connection) as queries:
+                for poll in range(polls):
+                    clock[0] = started + poll * options['poll_interval']
+                    for client in clients:
+                        response = client.get(url)
+                        cookies += settings.SESSION_COOKIE_NAME in response.cookies
+
+            transaction.set_rollback(True)
+
+        session_queries = [q['sql'].lstrip().upper() for q in queries if 'django_session' in q['sql']]
+        writes = sum(1 for sql in session_queries if sql.startswith(('UPDATE', 'INSERT')))
+        reads = sum(1 for sql in session_queries if sql.startswith('SELECT'))
+        return writes, reads, cookies
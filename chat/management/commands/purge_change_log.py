@@ -0,0 +1,31 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from chat.models import ChangeLog
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete change log entries older than --days. Clients further behind '
+        'than that are told to reload instead of catching up.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30)
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        purged = 0
+        while True:
+            # Small batches keep each delete's locks short on a busy table
+            ids = list(ChangeLog.objects.filter(
+                created_at__lt=cutoff
+            ).values_list('id', flat=True)[:options['batch_size']])
+            if not ids:
+                break
+            purged += ChangeLog.objects.filter(id__in=ids).delete()[0]
+
+        self.stdout.write(self.style.SUCCESS(f'Purged {purged} change log entries'))
@@ -0,0 +1,107 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, Max, Min, Q
+from django.db.models.functions import Greatest, Least
+
+from chat.models import Conversation, Message
+
+
+class Command(BaseCommand):
+    help = (
+        'Attach messages to their conversation key and rebuild the conversation '
+        'summaries used by the chat sidebar from the message history'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        backfilled = self._backfill_conversation_keys()
+        self.stdout.write(f'Attached {backfilled} messages to their conversation')
+
+        summaries = Message.objects.filter(conversation__isnull=False).order_by().values('conversation_id').annotate(
+            last_id=Max('id'),
+            low_unread=Count('id', filter=Q(
+                recipient_id=F('conversation__user_low_id'),
+                id__gt=F('conversation__low_last_read'),
+            )),
+            high_unread=Count('id', filter=Q(
+                recipient_id=F('conversation__user_high_id'),
+                id__gt=F('conversation__high_last_read'),
+            )),
+        )
+
+        conversations = []
+        rebuilt = 0
+        with transaction.atomic():
+            for summary in summaries.iterator():
+                conversations.append(Conversation(
+                    id=summary['conversation_id'],
+                    last_message_id=summary['last_id'],
+                    low_unread=summary['low_unread'],
+                    high_unread=summary['high_unread'],
+                ))
+                if len(conversations) >= batch_size:
+                    rebuilt += self._flush(conversations)
+                    conversations = []
+            rebuilt += self._flush(conversations)
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rebuilt} conversations'))
+
+        # Dashboard figures are derived from the conversation summaries
+        call_command('rebuild_user_stats', stdout=self.stdout)
+
+    def _backfill_conversation_keys(self):
+        # Messages written before conversation keys existed
+        pairs = Message.objects.filter(conversation__isnull=True).order_by().annotate(
+            low=Least('sender_id', 'recipient_id'),
+            high=Greatest('sender_id', 'recipient_id'),
+        ).values_list('low', 'high').distinct()
+
+        backfilled = 0
+        for low, high in list(pairs):
+            with transaction.atomic():
+                conversation = Conversation.between(low, high)
+                legacy = Message.objects.filter(
+                    Q(sender_id=low, recipient_id=high) | Q(sender_id=high, recipient_id=low),
+                    conversation__isnull=True,
+                )
+                watermarks = self._legacy_watermarks(legacy, low, high)
+                backfilled += legacy.update(conversation=conversation)
+                if watermarks:
+                    Conversation.objects.filter(pk=conversation.pk).update(**{
+                        field: Greatest(F(field), watermark)
+                        for field, watermark in watermarks.items()
+                    })
+        return backfilled
+
+    def _legacy_watermarks(self, legacy, low, high):
+        # Old messages carry their read state in the per-row is_read flag.
+        # Each side has read everything up to its first unread message.
+        watermarks = {}
+        for side, reader_id in (('low', low), ('high', high)):
+            received = legacy.filter(recipient_id=reader_id).aggregate(
+                last=Max('id'),
+                first_unread=Min('id', filter=Q(is_read=False)),
+            )
+            if received['last'] is None:
+                continue
+            if received['first_unread'] is None:
+                watermarks[f'{side}_last_read'] = received['last']
+            else:
+                watermarks[f'{side}_last_read'] = received['first_unread'] - 1
+        return watermarks
+
+    def _flush(self, conversations):
+        timestamps = Message.objects.only('timestamp').in_bulk(
+            [c.last_message_id for c in conversations]
+        )
+        for conversation in conversations:
+            conversation.last_activity = timestamps[conversation.last_message_id].timestamp
+        return Conversation.objects.bulk_update(
+            conversations,
+            ['last_message', 'last_activity', 'low_unread', 'high_unread'],
+        )
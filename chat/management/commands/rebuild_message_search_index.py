@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from chat.models import Message, MessageSearchTerm
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the inverted index used by message search'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        messages = Message.objects.filter(conversation__isnull=False).only(
+            'id', 'conversation_id', 'content'
+        ).order_by('id')
+
+        indexed = 0
+        with transaction.atomic():
+            MessageSearchTerm.objects.all().delete()
+            batch = []
+            for message in messages.iterator(chunk_size=batch_size):
+                batch.append(message)
+                if len(batch) >= batch_size:
+                    MessageSearchTerm.index_messages(batch)
+                    indexed += len(batch)
+                    batch = []
+            MessageSearchTerm.index_messages(batch)
+            indexed += len(batch)
+
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} messages'))
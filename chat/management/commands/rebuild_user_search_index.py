@@ -0,0 +1,19 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from chat.models import UserSearchToken
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the prefix index used by the chat user search'
+
+    def handle(self, *args, **options):
+        indexed = 0
+        users = User.objects.only('id', *UserSearchToken.INDEXED_FIELDS).order_by('id')
+        for user in users.iterator(chunk_size=1000):
+            UserSearchToken.index_user(user)
+            indexed += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} users'))
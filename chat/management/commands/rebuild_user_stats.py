@@ -0,0 +1,21 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from chat import unread
+from chat.models import UserStats
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the per-user dashboard statistics from the conversation summaries'
+
+    def handle(self, *args, **options):
+        user_ids = list(User.objects.order_by('id').values_list('id', flat=True))
+        for user_id in user_ids:
+            UserStats.rebuild(user_id)
+
+        # Cached unread totals are reloaded from the rebuilt rows
+        unread.invalidate(*user_ids)
+        rebuilt = len(user_ids)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt statistics for {rebuilt} users'))
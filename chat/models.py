@@ -1,18 +1,644 @@
-from django.db import models
+import re
+from collections import Counter
+
+from django.db import models, transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.db.models import Case, Count, F, Max, Q, Sum, Value, When
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 
+from contacts.models import Notification
+
 User = get_user_model()
 
+
+def _pk(user):
+    return user if isinstance(user, int) else user.pk
+
+
+class MessageQuerySet(models.QuerySet):
+    def between(self, user_a, user_b):
+        # Joins on the unique (user_low, user_high) key, so the database
+        # resolves the conversation once and range-scans (conversation, id)
+        low, high = sorted((_pk(user_a), _pk(user_b)))
+        return self.filter(conversation__user_low_id=low, conversation__user_high_id=high)
+
+
 class Message(models.Model):
     sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_messages')
     recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='received_messages')
+    # Canonical key of the user pair; indexed together with id below
+    conversation = models.ForeignKey('Conversation', on_delete=models.CASCADE, related_name='messages', null=True, blank=True, db_index=False)
     content = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
+    # Legacy per-row flag. Read state now lives in the Conversation
+    # watermarks; it is only used to seed them for old messages.
     is_read = models.BooleanField(default=False)
     
+    objects = MessageQuerySet.as_manager()
+    
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            models.Index(fields=['conversation', 'id']),
+        ]
         
     def __str__(self):
-        return f"{self.sender} to {self.recipient} - {self.timestamp}"
\ No newline at end of file
+        return f"{self.sender} to {self.recipient} - {self.timestamp}"
+
+
+class ConversationQuerySet(models.QuerySet):
+    def for_user(self, user):
+        return self.filter(Q(user_low=user) | Q(user_high=user))
+
+    def between(self, user_a, user_b):
+        low, high = sorted((_pk(user_a), _pk(user_b)))
+        return self.filter(user_low_id=low, user_high_id=high)
+
+    def unread_total(self, user):
+        user_id = _pk(user)
+        return self.for_user(user_id).aggregate(total=Sum(Case(
+            When(user_low_id=user_id, then=F('low_unread')),
+            default=F('high_unread'),
+        )))['total'] or 0
+
+
+class Conversation(models.Model):
+    """
+    Denormalized summary of a one-to-one conversation, kept up to date by the
+    chat write paths so the sidebar can be served without scanning messages.
+
+    The pair is stored in canonical order (``user_low`` has the smaller id).
+    Each side has a read watermark, the id of the last message it has read,
+    and an unread counter derived from it.
+    """
+    user_low = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    user_high = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    last_message = models.ForeignKey(Message, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    last_activity = models.DateTimeField(default=timezone.now)
+    low_last_read = models.PositiveBigIntegerField(default=0)
+    high_last_read = models.PositiveBigIntegerField(default=0)
+    low_unread = models.PositiveIntegerField(default=0)
+    high_unread = models.PositiveIntegerField(default=0)
+
+    # What mark_read and mark_unread reload under a row lock
+    READ_STATE_FIELDS = ('last_message_id', 'low_last_read', 'high_last_read', 'low_unread', 'high_unread')
+
+    objects = ConversationQuerySet.as_manager()
+
+    class Meta:
+        unique_together = ('user_low', 'user_high')
+        indexes = [
+            models.Index(fields=['user_low', '-last_activity']),
+            models.Index(fields=['user_high', '-last_activity']),
+        ]
+
+    def __str__(self):
+        return f"{self.user_low} & {self.user_high}"
+
+    @classmethod
+    def between(cls, user_a, user_b):
+        low, high = sorted((_pk(user_a), _pk(user_b)))
+        conversation, created = cls.objects.get_or_create(user_low_id=low, user_high_id=high)
+        return conversation
+
+    @classmethod
+    def for_pairs(cls, pairs):
+        """``{(low, high): conversation}`` for user id pairs, creating missing ones in one insert."""
+        pairs = {tuple(sorted(pair)) for pair in pairs}
+
+        def fetch(keys):
+            condition = Q()
+            for low, high in keys:
+                condition |= Q(user_low_id=low, user_high_id=high)
+            return {(c.user_low_id, c.user_high_id): c for c in cls.objects.filter(condition)}
+
+        found = fetch(pairs)
+        missing = pairs - found.keys()
+        if missing:
+            # A concurrent writer may be creating some of them too
+            cls.objects.bulk_create(
+                [cls(user_low_id=low, user_high_id=high) for low, high in missing],
+                ignore_conflicts=True,
+            )
+            found.update(fetch(missing))
+        return found
+
+    @staticmethod
+    def side(reader, peer):
+        # Prefix of the fields holding ``reader``'s read state
+        return 'low' if _pk(reader) < _pk(peer) else 'high'
+
+    def peer_id(self, user):
+        return self.user_high_id if _pk(user) == self.user_low_id else self.user_low_id
+
+    def unread_for(self, user):
+        return getattr(self, f'{self.side(user, self.peer_id(user))}_unread')
+
+    def last_read_for(self, user):
+        return getattr(self, f'{self.side(user, self.peer_id(user))}_last_read')
+
+    def is_read(self, message):
+        return message.id <= self.last_read_for(message.recipient_id)
+
+    def record_messages(self, messages):
+        """Count new ``messages`` of this conversation, in id order, with one update."""
+        unread = Counter(f'{self.side(message.recipient_id, message.sender_id)}_unread' for message in messages)
+        last = messages[-1]
+        # Batches can commit out of order; never move the last message backwards
+        newer = Q(last_message__isnull=True) | Q(last_message_id__lt=last.id)
+        Conversation.objects.filter(pk=self.pk).update(
+            last_message=Case(
+                When(newer, then=Value(last.id)), default=F('last_message'),
+                output_field=self._meta.get_field('last_message'),
+            ),
+            last_activity=Case(When(newer, then=Value(last.timestamp)), default=F('last_activity')),
+            **{field: F(field) + count for field, count in unread.items()}
+        )
+
+    def _lock(self):
+        """
+        Reload the read state under a row lock, so counters are moved by
+        what the row holds now and not by what was loaded earlier (a message
+        may have arrived since). Call inside a transaction.
+        """
+        locked = Conversation.objects.select_for_update().filter(pk=self.pk).values(*self.READ_STATE_FIELDS).get()
+        for field, value in locked.items():
+            setattr(self, field, value)
+
+    def mark_read(self, reader, up_to=None):
+        """
+        Move ``reader``'s watermark up to ``up_to``, or to the latest message,
+        with a single row update. Returns how many messages became read.
+        """
+        peer = self.peer_id(reader)
+        side = self.side(reader, peer)
+        unread, last_read = f'{side}_unread', f'{side}_last_read'
+        with transaction.atomic():
+            self._lock()
+            previous = getattr(self, unread)
+            if not previous:
+                return 0
+            if up_to is not None and up_to <= getattr(self, last_read):
+                return 0
+
+            if up_to is None:
+                setattr(self, last_read, self.last_message_id or getattr(self, last_read))
+                setattr(self, unread, 0)
+            else:
+                setattr(self, last_read, up_to)
+                setattr(self, unread, self.messages.filter(sender_id=peer, id__gt=up_to).count())
+            Conversation.objects.filter(pk=self.pk).update(**{
+                last_read: getattr(self, last_read),
+                unread: getattr(self, unread),
+            })
+        return previous - getattr(self, unread)
+
+    def mark_unread(self, reader):
+        """Reset ``reader``'s watermark. Returns how many messages became unread."""
+        peer = self.peer_id(reader)
+        side = self.side(reader, peer)
+        with transaction.atomic():
+            self._lock()
+            previous = getattr(self, f'{side}_unread')
+            received = self.messages.filter(sender_id=peer).count()
+            Conversation.objects.filter(pk=self.pk).update(**{
+                f'{side}_last_read': 0,
+                f'{side}_unread': received,
+            })
+        setattr(self, f'{side}_last_read', 0)
+        setattr(self, f'{side}_unread', received)
+        return received - previous
+
+
+class GroupConversation(models.Model):
+    """
+    A conversation between any number of members, see chat/groups.py.
+
+    Each message is stored once, as a ``GroupMessage``. Read state is one
+    watermark per member (``GroupMember.last_read``), so sending to a
+    group writes the same rows whatever its size, and a member's unread
+    count is a range scan of (group, id) past their watermark.
+    """
+    name = models.CharField(max_length=100)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_message = models.ForeignKey('GroupMessage', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    last_activity = models.DateTimeField(default=timezone.now)
+    member_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return self.name
+
+
+class GroupMember(models.Model):
+    group = models.ForeignKey(GroupConversation, on_delete=models.CASCADE, related_name='members')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='group_memberships')
+    joined_at = models.DateTimeField(auto_now_add=True)
+    # Id of the last GroupMessage this member has read
+    last_read = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('group', 'user')
+        indexes = [
+            models.Index(fields=['user', 'group']),
+        ]
+
+    def __str__(self):
+        return f"{self.user} in {self.group}"
+
+
+class GroupMessage(models.Model):
+    # Indexed together with id below
+    group = models.ForeignKey(GroupConversation, on_delete=models.CASCADE, related_name='messages', db_index=False)
+    sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_group_messages')
+    content = models.TextField()
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['group', 'id']),
+        ]
+
+    def __str__(self):
+        return f"{self.sender} to {self.group} - {self.timestamp}"
+
+
+class Presence(models.Model):
+    """
+    When a user was last seen on the chat page. Written in batches by
+    chat/presence.py, never on the request path.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='presence')
+    last_seen = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.user_id} seen {self.last_seen}"
+
+
+class UserSearchToken(models.Model):
+    """
+    Prefix index over user names and emails for ``search_users``.
+
+    Every word of the indexed fields is stored with all of its leading
+    n-grams (edge n-grams), so a prefix search is an equality lookup on
+    ``token`` instead of a leading-wildcard LIKE over ``auth_user``.
+    """
+    INDEXED_FIELDS = ('username', 'first_name', 'last_name', 'email')
+    MAX_TOKEN_LENGTH = 20
+    CANDIDATE_LIMIT = 500
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    token = models.CharField(max_length=MAX_TOKEN_LENGTH)
+
+    class Meta:
+        unique_together = ('token', 'user')
+
+    def __str__(self):
+        return f"{self.token} → {self.user_id}"
+
+    @classmethod
+    def words(cls, text):
+        return [word[:cls.MAX_TOKEN_LENGTH] for word in re.findall(r'\w+', text.lower())]
+
+    @classmethod
+    def tokens_for(cls, user):
+        tokens = set()
+        for field in cls.INDEXED_FIELDS:
+            for word in cls.words(getattr(user, field) or ''):
+                tokens.update(word[:length] for length in range(1, len(word) + 1))
+        return tokens
+
+    @classmethod
+    def search(cls, query, limit=10, exclude=None):
+        """
+        Ids of up to ``limit`` users with a word starting with each word of
+        ``query``. Work is bounded by ``CANDIDATE_LIMIT`` postings per word.
+        """
+        words = sorted(set(cls.words(query)), key=len, reverse=True)
+        if not words:
+            return []
+
+        # Start from the longest, usually most selective, word
+        postings = cls.objects.filter(token=words[0])
+        if exclude is not None:
+            postings = postings.exclude(user_id=exclude)
+        size = limit if len(words) == 1 else cls.CANDIDATE_LIMIT
+        user_ids = list(postings.order_by('user_id').values_list('user_id', flat=True)[:size])
+
+        for word in words[1:]:
+            if not user_ids:
+                break
+            user_ids = list(cls.objects.filter(
+                token=word, user_id__in=user_ids
+            ).order_by('user_id').values_list('user_id', flat=True))
+        return user_ids[:limit]
+
+    @classmethod
+    def index_user(cls, user):
+        tokens = cls.tokens_for(user)
+        existing = set(cls.objects.filter(user=user).values_list('token', flat=True))
+        if existing - tokens:
+            cls.objects.filter(user=user, token__in=existing - tokens).delete()
+        cls.objects.bulk_create(
+            [cls(user=user, token=token) for token in tokens - existing],
+            ignore_conflicts=True
+        )
+
+
+@receiver(post_save, sender=User)
+def index_user_for_search(sender, instance, update_fields=None, **kwargs):
+    # Logins only touch last_login, don't rewrite the index for them
+    if update_fields and not set(update_fields) & set(UserSearchToken.INDEXED_FIELDS):
+        return
+    UserSearchToken.index_user(instance)
+
+
+class MessageSearchTerm(models.Model):
+    """
+    Inverted index over message content: one row per distinct term of a
+    message, with the number of times it occurs. Rows carry the
+    conversation so a search can be scoped to one or several of them
+    straight from the (term, conversation, message) index.
+    """
+    MIN_TERM_LENGTH = 2
+    MAX_TERM_LENGTH = 32
+
+    term = models.CharField(max_length=MAX_TERM_LENGTH)
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='+')
+    message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name='search_terms')
+    frequency = models.PositiveSmallIntegerField(default=1)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['term', 'conversation', 'message']),
+        ]
+
+    def __str__(self):
+        return f"{self.term} ({self.message_id})"
+
+    @classmethod
+    def terms(cls, text):
+        return Counter(
+            word[:cls.MAX_TERM_LENGTH]
+            for word in re.findall(r'\w+', text.lower())
+            if len(word) >= cls.MIN_TERM_LENGTH
+        )
+
+    @classmethod
+    def index_messages(cls, messages):
+        cls.objects.bulk_create([
+            cls(term=term, conversation_id=message.conversation_id, message_id=message.id,
+                frequency=min(frequency, 32767))
+            for message in messages
+            for term, frequency in cls.terms(message.content).items()
+        ])
+
+    @classmethod
+    def search(cls, query, conversation_ids):
+        """
+        Ranked message ids matching any term of ``query``: messages matching
+        more distinct terms first, then by total term frequency, then newest.
+        """
+        terms = list(cls.terms(query))
+        if not terms or not conversation_ids:
+            return cls.objects.none().values('message_id')
+        return cls.objects.filter(
+            term__in=terms,
+            conversation_id__in=conversation_ids
+        ).values('message_id').annotate(
+            matched=Count('term', distinct=True),
+            score=Sum('frequency'),
+        ).order_by('-matched', '-score', '-message_id')
+
+
+class UserStats(models.Model):
+    """
+    Per-user dashboard figures, adjusted in place by the chat write paths so
+    the dashboard reads one row instead of aggregating the message history.
+    A missing row is rebuilt on first use; ``manage.py rebuild_user_stats``
+    rebuilds them all.
+    """
+    RECENT_CONTACTS = 3
+
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='chat_stats')
+    total_messages = models.IntegerField(default=0)
+    active_conversations = models.IntegerField(default=0)
+    unread_count = models.IntegerField(default=0)
+    # Peers of the most recently active conversations, newest first
+    recent_contact_ids = models.JSONField(default=list, blank=True)
+    # Last sequence number handed out to the user's ChangeLog
+    change_seq = models.PositiveBigIntegerField(default=0)
+    # Unread contacts.Notification rows, see contacts.notifications
+    unread_notifications = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user} stats"
+
+    @classmethod
+    def for_user(cls, user):
+        try:
+            return cls.objects.get(user_id=_pk(user))
+        except cls.DoesNotExist:
+            return cls.rebuild(user)
+
+    @classmethod
+    def rebuild(cls, user):
+        user_id = _pk(user)
+        conversations = Conversation.objects.for_user(user_id).filter(last_message__isnull=False)
+        figures = {
+            'total_messages': Message.objects.filter(Q(sender_id=user_id) | Q(recipient_id=user_id)).count(),
+            'active_conversations': conversations.count(),
+            'unread_count': Conversation.objects.unread_total(user_id),
+            'recent_contact_ids': cls._recent_contacts(user_id),
+            'unread_notifications': Notification.objects.filter(user_id=user_id, is_read=False).count(),
+        }
+        # The change sequence is never rebuilt, only picked up where the log ends
+        stats, created = cls.objects.update_or_create(user_id=user_id, defaults=figures, create_defaults={
+            **figures,
+            'change_seq': ChangeLog.objects.filter(user_id=user_id).aggregate(last=Max('seq'))['last'] or 0,
+        })
+        return stats
+
+    @classmethod
+    def lock(cls, user_ids):
+        """Lock the rows of ``user_ids``, in id order, creating missing ones."""
+        user_ids = sorted(set(user_ids))
+        rows = {stats.user_id: stats for stats in cls.objects.select_for_update().filter(
+            user_id__in=user_ids
+        ).order_by('user_id')}
+        for user_id in user_ids:
+            if user_id not in rows:
+                cls.rebuild(user_id)
+                rows[user_id] = cls.objects.select_for_update().get(user_id=user_id)
+        return rows
+
+    @classmethod
+    def _recent_contacts(cls, user_id):
+        recent = Conversation.objects.for_user(user_id).filter(
+            last_message__isnull=False
+        ).order_by('-last_activity').values_list('user_low_id', 'user_high_id')[:cls.RECENT_CONTACTS]
+        return [high if low == user_id else low for low, high in recent]
+
+    @classmethod
+    def record_messages(cls, messages, new_conversation_ids=()):
+        """
+        Count ``messages`` (in id order) for their participants, saving each
+        stats row once. ``new_conversation_ids`` are the conversations these
+        messages started. Call inside their transaction; returns the rows
+        it locked, ``{user_id: stats}``.
+        """
+        participants = sorted({message.sender_id for message in messages} | {message.recipient_id for message in messages})
+        # Lock in id order so two senders writing to each other can't deadlock
+        rows = {stats.user_id: stats for stats in cls.objects.select_for_update().filter(
+            user_id__in=participants
+        ).order_by('user_id')}
+        for user_id in participants:
+            if user_id not in rows:
+                # Built from the data this transaction can see, messages included
+                cls.rebuild(user_id)
+
+        started = set()
+        for message in messages:
+            for user_id in {message.sender_id, message.recipient_id}:
+                peer = message.recipient_id if user_id == message.sender_id else message.sender_id
+                stats = rows.get(user_id)
+                if stats is None:
+                    continue
+                stats.total_messages += 1
+                if message.conversation_id in new_conversation_ids and (user_id, peer) not in started:
+                    started.add((user_id, peer))
+                    stats.active_conversations += 1
+                stats.recent_contact_ids = [peer] + [
+                    contact for contact in stats.recent_contact_ids if contact != peer
+                ][:cls.RECENT_CONTACTS - 1]
+        # One statement for every row, they are locked already
+        cls.objects.bulk_update(rows.values(), ['total_messages', 'active_conversations', 'recent_contact_ids'])
+        return rows
+
+    @classmethod
+    def remove_conversation(cls, conversation, message_count):
+        """Take a conversation that has just been deleted out of both participants' figures."""
+        for user_id in (conversation.user_low_id, conversation.user_high_id):
+            cls.objects.filter(user_id=user_id).update(
+                total_messages=F('total_messages') - message_count,
+                active_conversations=F('active_conversations') - int(conversation.last_message_id is not None),
+                recent_contact_ids=cls._recent_contacts(user_id),
+            )
+
+    @classmethod
+    def adjust_unread(cls, user, delta):
+        cls.objects.filter(user_id=_pk(user)).update(unread_count=F('unread_count') + delta)
+
+    @classmethod
+    def adjust_unread_many(cls, user_ids, delta):
+        cls.objects.filter(user_id__in=user_ids).update(unread_count=F('unread_count') + delta)
+
+    @classmethod
+    def adjust_notifications(cls, user_ids, delta):
+        cls.objects.filter(user_id__in=user_ids).update(unread_notifications=F('unread_notifications') + delta)
+
+
+class ChangeLog(models.Model):
+    """
+    Per-user, gap-free sequence of everything a client has to apply to
+    catch up: messages, read watermark moves, deleted conversations and
+    contact changes. A client that remembers the last ``seq`` it applied
+    resumes with ``seq__gt`` instead of refetching whole histories.
+
+    Sequence numbers come from ``UserStats.change_seq`` under a row lock,
+    so for each user they are handed out in commit order.
+    """
+    MESSAGE = 'message'
+    READ = 'read'
+    CONVERSATION_DELETED = 'conversation_deleted'
+    CONTACTS = 'contacts'
+    KIND_CHOICES = (
+        (MESSAGE, 'Message'),
+        (READ, 'Read'),
+        (CONVERSATION_DELETED, 'Conversation deleted'),
+        (CONTACTS, 'Contacts'),
+    )
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    seq = models.PositiveBigIntegerField()
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    peer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+', null=True, blank=True)
+    # Not a foreign key: entries outlive the messages of deleted conversations
+    message_id = models.PositiveBigIntegerField(null=True, blank=True)
+    data = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('user', 'seq')
+        indexes = [
+            models.Index(fields=['created_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.user} #{self.seq} {self.kind}"
+
+    @classmethod
+    def append(cls, *changes, locked=None):
+        """
+        Number unsaved ``changes`` in their users' sequences and save them,
+        with one counter update and one insert. ``locked`` are stats rows
+        the caller's transaction has already locked, ``{user_id: stats}``.
+        """
+        increments = Counter(change.user_id for change in changes)
+        with transaction.atomic(savepoint=False):
+            counters = {user_id: stats for user_id, stats in (locked or {}).items() if user_id in increments}
+            if increments.keys() - counters.keys():
+                counters.update(UserStats.lock(increments.keys() - counters.keys()))
+            for change in changes:
+                counters[change.user_id].change_seq += 1
+                change.seq = counters[change.user_id].change_seq
+            if len(set(increments.values())) == 1:
+                step = Value(next(iter(increments.values())))
+            else:
+                step = Case(
+                    *[When(user_id=user_id, then=Value(count)) for user_id, count in increments.items()],
+                    output_field=models.PositiveBigIntegerField(),
+                )
+            UserStats.objects.filter(user_id__in=increments).update(change_seq=F('change_seq') + step)
+            cls.objects.bulk_create(changes)
+
+    @classmethod
+    def record_messages(cls, messages, locked=None):
+        cls.append(*[
+            change
+            for message in messages
+            for change in (
+                cls(user_id=message.sender_id, kind=cls.MESSAGE, peer_id=message.recipient_id, message_id=message.id),
+                cls(user_id=message.recipient_id, kind=cls.MESSAGE, peer_id=message.sender_id, message_id=message.id),
+            )
+        ], locked=locked)
+
+    @classmethod
+    def record_read(cls, conversation, reader):
+        """Record ``reader``'s watermark after a mark_read or mark_unread."""
+        reader_id, peer_id = _pk(reader), conversation.peer_id(reader)
+        data = {'reader_id': reader_id, 'last_read': conversation.last_read_for(reader_id)}
+        cls.append(
+            cls(user_id=reader_id, kind=cls.READ, peer_id=peer_id,
+                data={**data, 'unread_count': conversation.unread_for(reader_id)}),
+            cls(user_id=peer_id, kind=cls.READ, peer_id=reader_id, data=data),
+        )
+
+    @classmethod
+    def record_conversation_deleted(cls, conversation):
+        low, high = conversation.user_low_id, conversation.user_high_id
+        cls.append(
+            cls(user_id=low, kind=cls.CONVERSATION_DELETED, peer_id=high),
+            cls(user_id=high, kind=cls.CONVERSATION_DELETED, peer_id=low),
+        )
+
+    @classmethod
+    def record_contacts(cls, user_a, user_b, event):
+        """``event`` is one of request, accepted, rejected or removed."""
+        a, b = _pk(user_a), _pk(user_b)
+        cls.append(
+            cls(user_id=a, kind=cls.CONTACTS, peer_id=b, data={'event': event}),
+            cls(user_id=b, kind=cls.CONTACTS, peer_id=a, data={'event': event}),
+        )
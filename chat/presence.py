@@ -0,0 +1,213 @@
+"""
+Presence: who is on the chat page, and when everyone else was last seen.
+
+The chat page sends a heartbeat every ``PRESENCE_HEARTBEAT_SECONDS``.
+Heartbeats are only recorded in memory, the latest one per user, and a
+flusher thread writes whatever accumulated every
+``CHAT_PRESENCE_FLUSH_SECONDS`` with a single upsert, so a thousand users
+polling cost one statement per interval instead of a write per request.
+
+Each worker process flushes its own heartbeats. Lookups merge the
+process's unflushed ones with the table, so a user counts as online while
+their last heartbeat, flushed by any worker, is within
+``PRESENCE_ONLINE_SECONDS``.
+"""
+import logging
+import sys
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import close_old_connections, connections, router, transaction
+from django.utils import timezone
+
+from .models import Presence, _pk
+
+logger = logging.getLogger(__name__)
+
+User = get_user_model()
+
+# chat.js sends a heartbeat this often while the chat page is open
+PRESENCE_HEARTBEAT_SECONDS = 30
+# A heartbeat may wait a flush interval before other workers see it, so
+# allow for a missed heartbeat plus a flush
+PRESENCE_ONLINE_SECONDS = 75
+# Most users one presence lookup may ask about
+PRESENCE_MAX_USERS = 200
+
+
+class HeartbeatAggregator:
+    """
+    Buffers the latest heartbeat per user and writes them in batches from
+    a flusher thread, started on first use so every worker process gets
+    its own. ``metrics()`` reports its memory use and flush rate.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._pending = {}
+        # Swapped out by flush() and visible to lookups until committed
+        self._flushing = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._started = time.monotonic()
+        self._heartbeats = 0
+        self._flushes = 0
+        self._rows_flushed = 0
+        self._failures = 0
+        self._peak_pending = 0
+        self._last_flush_at = None
+        self._last_flush_seconds = 0.0
+
+    def beat(self, user_id, seen=None):
+        seen = seen or timezone.now()
+        self._start()
+        with self._lock:
+            self._pending[user_id] = seen
+            self._heartbeats += 1
+            self._peak_pending = max(self._peak_pending, len(self._pending))
+
+    def pending(self, user_ids):
+        """``{user_id: last_seen}`` of heartbeats not yet committed, among ``user_ids``."""
+        with self._lock:
+            found = {}
+            for user_id in user_ids:
+                beats = [beats[user_id] for beats in (self._flushing, self._pending) if user_id in beats]
+                if beats:
+                    found[user_id] = max(beats)
+            return found
+
+    def _requeue(self, batch):
+        # A newer beat that came in meanwhile wins
+        for user_id, seen in batch.items():
+            if self._pending.get(user_id, seen) <= seen:
+                self._pending[user_id] = seen
+
+    def flush(self):
+        """Write buffered heartbeats with one upsert. Returns how many rows were written."""
+        with self._lock:
+            batch, self._pending = self._pending, {}
+            self._flushing = batch
+        if not batch:
+            return 0
+        started = time.perf_counter()
+        using = router.db_for_write(Presence)
+        # MySQL's ON DUPLICATE KEY UPDATE takes no conflict target, it
+        # matches on the user primary key by itself
+        target = {'unique_fields': ['user']} if connections[using].features.supports_update_conflicts_with_target else {}
+        try:
+            Presence.objects.using(using).bulk_create(
+                [Presence(user_id=user_id, last_seen=seen) for user_id, seen in batch.items()],
+                update_conflicts=True,
+                update_fields=['last_seen'],
+                **target,
+            )
+        except Exception:
+            try:
+                # Users deleted since their heartbeat would fail every later flush
+                live = set(User.objects.using(using).filter(id__in=batch).values_list('id', flat=True))
+                batch = {user_id: seen for user_id, seen in batch.items() if user_id in live}
+            except Exception:
+                pass
+            with self._lock:
+                self._failures += 1
+                self._requeue(batch)
+                self._flushing = {}
+            raise
+
+        def committed():
+            with self._lock:
+                self._flushing = {}
+                self._flushes += 1
+                self._rows_flushed += len(batch)
+                self._last_flush_at = timezone.now()
+                self._last_flush_seconds = time.perf_counter() - started
+        # Immediately in autocommit, the flusher thread's case
+        transaction.on_commit(committed, using=using)
+        return len(batch)
+
+    def metrics(self):
+        with self._lock:
+            pending = len(self._pending)
+            # The dict and its entries; datetimes and small ints are not shared
+            memory = sys.getsizeof(self._pending) + sum(
+                sys.getsizeof(user_id) + sys.getsizeof(seen) for user_id, seen in self._pending.items()
+            )
+            uptime = time.monotonic() - self._started
+            return {
+                'pending_users': pending,
+                'flushing_users': len(self._flushing),
+                'peak_pending_users': self._peak_pending,
+                'pending_bytes': memory,
+                'heartbeats': self._heartbeats,
+                'flushes': self._flushes,
+                'rows_flushed': self._rows_flushed,
+                'flush_failures': self._failures,
+                # Heartbeats absorbed per row written
+                'coalescing_ratio': round(self._heartbeats / self._rows_flushed, 2) if self._rows_flushed else None,
+                'flushes_per_minute': round(self._flushes / uptime * 60, 2) if uptime else 0,
+                'last_flush_at': self._last_flush_at.isoformat() if self._last_flush_at else None,
+                'last_flush_ms': round(self._last_flush_seconds * 1000, 2),
+                'flush_interval_seconds': self.interval,
+            }
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='chat-presence', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            # Like a request: drop a connection that timed out or went away
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Presence flush failed')
+
+
+_aggregator = None
+_aggregator_lock = threading.Lock()
+
+
+def get_aggregator():
+    global _aggregator
+    with _aggregator_lock:
+        if _aggregator is None:
+            _aggregator = HeartbeatAggregator(settings.CHAT_PRESENCE_FLUSH_SECONDS)
+    return _aggregator
+
+
+def heartbeat(user):
+    get_aggregator().beat(_pk(user))
+
+
+def last_seen(user_ids):
+    """``{user_id: last_seen}`` for ``user_ids`` seen at least once, in one query."""
+    user_ids = set(user_ids)
+    seen = dict(Presence.objects.filter(user_id__in=user_ids).values_list('user_id', 'last_seen'))
+    for user_id, pending in get_aggregator().pending(user_ids).items():
+        if user_id not in seen or pending > seen[user_id]:
+            seen[user_id] = pending
+    return seen
+
+
+def presence(user_ids):
+    """``{user_id: {'online', 'last_seen'}}`` for every id in ``user_ids``."""
+    seen = last_seen(user_ids)
+    cutoff = timezone.now() - timedelta(seconds=PRESENCE_ONLINE_SECONDS)
+    return {
+        user_id: {
+            'online': user_id in seen and seen[user_id] >= cutoff,
+            'last_seen': seen[user_id].isoformat() if user_id in seen else None,
+        }
+        for user_id in user_ids
+    }
+
+
+def metrics():
+    return get_aggregator().metrics()
@@ -0,0 +1,100 @@
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+# Columns needed to render a message; nothing here touches a relation, so
+# serializing a page is always the single query that fetched it.
+MESSAGE_FIELDS = ('id', 'sender_id', 'recipient_id', 'content', 'timestamp')
+
+# Rows fetched per round trip when streaming a history
+STREAM_CHUNK_SIZE = 500
+
+
+def message_rows(queryset):
+    return queryset.values(*MESSAGE_FIELDS)
+
+
+class MessageSerializer:
+    """
+    Turns message rows into the JSON payload shared by the chat endpoints.
+
+    Rows may be ``values()`` dicts or ``Message`` instances; only the
+    ``MESSAGE_FIELDS`` columns are read, so no related object is ever
+    loaded. Read state comes from the conversation's watermarks, looked up
+    once instead of per message; without a conversation it is left out.
+    """
+
+    def __init__(self, viewer, conversation=None):
+        self.viewer_id = viewer if isinstance(viewer, int) else viewer.pk
+        self.watermarks = {}
+        if conversation is not None:
+            self.watermarks = {
+                conversation.user_low_id: conversation.low_last_read,
+                conversation.user_high_id: conversation.high_last_read,
+            }
+
+    def __call__(self, row, **extra):
+        if not isinstance(row, dict):
+            row = {field: getattr(row, field) for field in MESSAGE_FIELDS}
+        data = {
+            'id': row['id'],
+            'sender_id': row['sender_id'],
+            'recipient_id': row['recipient_id'],
+            'content': row['content'],
+            'timestamp': row['timestamp'].isoformat(),
+            'is_me': row['sender_id'] == self.viewer_id,
+            **extra,
+        }
+        if self.watermarks:
+            data['is_read'] = row['id'] <= self.watermarks[row['recipient_id']]
+        return data
+
+    def many(self, rows):
+        return [self(row) for row in rows]
+
+
+def _dumps(value):
+    return json.dumps(value, cls=DjangoJSONEncoder, ensure_ascii=False)
+
+
+def _opening(payload, key):
+    head = _dumps(payload)[1:-1]
+    return '{' + head + (', ' if head else '') + _dumps(key) + ': ['
+
+
+def stream_json(payload, key, items):
+    """
+    Stream ``payload`` as a JSON object whose ``key`` member is the list of
+    ``items``, encoding one item at a time so the list is never held in memory.
+    """
+    def generate():
+        yield _opening(payload, key)
+        for position, item in enumerate(items):
+            yield (', ' if position else '') + _dumps(item)
+        yield ']}'
+
+    return StreamingHttpResponse(generate(), content_type='application/json')
+
+
+def astream_json(payload, key, items):
+    """``stream_json`` over an async iterable, for async views."""
+    async def generate():
+        yield _opening(payload, key)
+        position = 0
+        async for item in items:
+            yield (', ' if position else '') + _dumps(item)
+            position += 1
+        yield ']}'
+
+    return StreamingHttpResponse(generate(), content_type='application/json')
+
+
+def stream_messages(queryset, serializer, payload, key='messages'):
+    rows = message_rows(queryset).iterator(chunk_size=STREAM_CHUNK_SIZE)
+    return stream_json(payload, key, (serializer(row) for row in rows))
+
+
+def astream_messages(queryset, serializer, payload, key='messages'):
+    rows = message_rows(queryset).aiterator(chunk_size=STREAM_CHUNK_SIZE)
+    return astream_json(payload, key, (serializer(row) async for row in rows))
@@ -0,0 +1,178 @@
+from django.db.models import Q
+
+from contacts import graph, notifications
+from contacts.models import Contact
+
+from . import typing_state, unread
+from .models import ChangeLog, Conversation, Message, UserStats, _pk
+from .serializers import MessageSerializer, message_rows
+
+# Most change log entries returned by one sync; the client asks again
+# right away when has_more is set.
+SYNC_CHANGE_LIMIT = 200
+
+# Change log page sizes, see changes()
+CHANGES_PAGE_SIZE = 100
+CHANGES_MAX_PAGE_SIZE = 500
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class Cursor:
+    """
+    Client position in the sync stream: the last entry of its change log
+    (``ChangeLog.seq``) it has applied. Sequence numbers are handed out in
+    commit order without gaps, so nothing committed after the cursor can
+    sort before it, whatever its message id or the clock of the worker
+    that wrote it.
+    """
+
+    def __init__(self, seq):
+        self.seq = seq
+
+    def __str__(self):
+        return str(self.seq)
+
+    @classmethod
+    def parse(cls, value):
+        try:
+            seq = int(value)
+        except ValueError:
+            raise InvalidCursor(value)
+        if seq < 0:
+            raise InvalidCursor(value)
+        return cls(seq)
+
+
+def _request_record(contact):
+    requester = contact.requester
+    return {
+        'id': contact.id,
+        'requester_id': requester.id,
+        'username': requester.username,
+        'full_name': requester.get_full_name(),
+        'created_at': contact.created_at.isoformat(),
+    }
+
+
+def _contacts(user_id):
+    pending = Contact.objects.filter(
+        recipient_id=user_id, status='pending'
+    ).select_related('requester').order_by('-created_at')
+    return {
+        'contacts': graph.contact_users(user_id),
+        'pending_requests': [_request_record(contact) for contact in pending],
+    }
+
+
+def sync(user, cursor=None, typing_peers=()):
+    """
+    Everything that changed for ``user`` since ``cursor`` in one payload:
+    the change log entries after it (see ``changes``), the unread counts
+    and read ticks of the conversations they touch, and the contacts and
+    unread notifications when those changed. Without a cursor only the
+    current state and a starting cursor are returned; the page the client
+    has just loaded already shows the rest.
+
+    ``reset`` is set when the log can no longer bring the client up to
+    date; it then has to reload its state and continue from ``cursor``.
+    An idle sync costs the change sequence lookup and nothing else.
+    """
+    user_id = _pk(user)
+    payload = {
+        'changes': [],
+        'has_more': False,
+        'reset': False,
+        'conversations': [],
+        'unread_total': unread.unread_total(user_id),
+        'typing': {
+            str(peer_id): typing_state.is_typing(peer_id, user_id)
+            for peer_id in typing_peers
+        },
+        'contacts': None,
+        'notifications': [],
+    }
+
+    if cursor is None:
+        payload['cursor'] = str(Cursor(UserStats.for_user(user_id).change_seq))
+        return payload
+
+    page = changes(user_id, cursor.seq, SYNC_CHANGE_LIMIT)
+    payload.update(changes=page['changes'], has_more=page['has_more'], reset=page['reset'])
+    payload['cursor'] = str(Cursor(page['last_seq']))
+
+    kinds = {change['kind'] for change in page['changes']}
+    peer_ids = {
+        change['peer_id'] for change in page['changes']
+        if change['kind'] in (ChangeLog.MESSAGE, ChangeLog.READ)
+    }
+    if peer_ids:
+        conversations = Conversation.objects.for_user(user_id).filter(
+            Q(user_low_id__in=peer_ids) | Q(user_high_id__in=peer_ids)
+        )
+        payload['conversations'] = [{
+            'user_id': conversation.peer_id(user_id),
+            'unread_count': conversation.unread_for(user_id),
+            # Everything the peer has read, for the sender's read ticks
+            'peer_last_read': conversation.last_read_for(conversation.peer_id(user_id)),
+        } for conversation in conversations]
+
+    if page['reset'] or ChangeLog.CONTACTS in kinds:
+        payload['contacts'] = _contacts(user_id)
+        # Every notification comes with a contacts change
+        payload['notifications'] = notifications.feed(user_id, unread_only=True)['notifications']
+    return payload
+
+
+def _change_record(change, message_rows_by_id, serialize):
+    record = {
+        'seq': change.seq,
+        'kind': change.kind,
+        'peer_id': change.peer_id,
+        'created_at': change.created_at.isoformat(),
+        **change.data,
+    }
+    if change.kind == ChangeLog.MESSAGE:
+        record['message'] = serialize(message_rows_by_id[change.message_id])
+    return record
+
+
+def changes(user, after=None, limit=CHANGES_PAGE_SIZE):
+    """
+    One page of ``user``'s change log after sequence number ``after``.
+
+    Without ``after`` only the current position is returned. ``reset`` is
+    set when the log can no longer bring the client up to date (entries
+    after its position were purged, or the position is unknown); it then
+    has to reload its state and continue from ``last_seq``.
+    """
+    user_id = _pk(user)
+    current = UserStats.for_user(user_id).change_seq
+    payload = {'changes': [], 'has_more': False, 'reset': False, 'last_seq': current}
+    if after is None or after == current:
+        return payload
+    if after > current:
+        payload['reset'] = True
+        return payload
+
+    entries = list(ChangeLog.objects.filter(user_id=user_id, seq__gt=after).order_by('seq')[:limit + 1])
+    # Sequences have no gaps, so a missing next entry means it was purged
+    if not entries or entries[0].seq != after + 1:
+        payload['reset'] = True
+        return payload
+    payload['has_more'] = len(entries) > limit
+    entries = entries[:limit]
+
+    message_ids = [entry.message_id for entry in entries if entry.kind == ChangeLog.MESSAGE]
+    rows = {row['id']: row for row in message_rows(Message.objects.filter(id__in=message_ids))} if message_ids else {}
+    serialize = MessageSerializer(user_id)
+    payload['changes'] = [
+        _change_record(entry, rows, serialize)
+        for entry in entries
+        # Messages of conversations deleted since are followed by the deletion
+        if entry.kind != ChangeLog.MESSAGE or entry.message_id in rows
+    ]
+    payload['last_seq'] = entries[-1].seq
+    return payload
@@ -1,3 +1,383 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import DatabaseError, connection
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from contacts.models import Contact
+
+from . import groups, ingest, sync, unread
+from .models import ChangeLog, Conversation, GroupConversation, GroupMessage, Message, Presence, UserStats
+from .presence import HeartbeatAggregator
+from .views import _create_message, _mark_read
+
+User = get_user_model()
+
+
+class PresenceFlushTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user('alice', password='pw123456')
+        self.bob = User.objects.create_user('bob', password='pw123456')
+        # Never flushes by itself during a test
+        self.aggregator = HeartbeatAggregator(interval=3600)
+
+    def flush(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.aggregator.flush()
+
+    def test_flush_writes_latest_heartbeats(self):
+        earlier = timezone.now() - timedelta(minutes=5)
+        self.aggregator.beat(self.alice.id, earlier)
+        self.aggregator.beat(self.alice.id, earlier + timedelta(minutes=1))
+        self.aggregator.beat(self.bob.id, earlier)
+
+        self.assertEqual(self.flush(), 2)
+        self.assertEqual(dict(Presence.objects.values_list('user_id', 'last_seen')), {
+            self.alice.id: earlier + timedelta(minutes=1),
+            self.bob.id: earlier,
+        })
+        self.assertEqual(self.aggregator.pending([self.alice.id, self.bob.id]), {})
+
+        # Existing rows are updated in place
+        later = timezone.now()
+        self.aggregator.beat(self.bob.id, later)
+        self.assertEqual(self.flush(), 1)
+        self.assertEqual(Presence.objects.count(), 2)
+        self.assertEqual(Presence.objects.get(user=self.bob).last_seen, later)
+        self.assertEqual(self.aggregator.metrics()['rows_flushed'], 3)
+
+    def test_batch_stays_visible_while_written_and_is_requeued_on_failure(self):
+        seen = timezone.now()
+        self.aggregator.beat(self.alice.id, seen)
+        during = {}
+
+        def fail(*args, **kwargs):
+            during.update(self.aggregator.pending([self.alice.id]))
+            raise DatabaseError('gone away')
+
+        with mock.patch.object(Presence.objects, 'using') as using:
+            using.return_value.bulk_create.side_effect = fail
+            with self.assertRaises(DatabaseError):
+                self.aggregator.flush()
+
+        self.assertEqual(during, {self.alice.id: seen})
+        self.assertEqual(self.aggregator.pending([self.alice.id]), {self.alice.id: seen})
+        self.assertEqual(self.aggregator.metrics()['flush_failures'], 1)
+        # The next flush writes it
+        self.assertEqual(self.flush(), 1)
+        self.assertEqual(Presence.objects.get(user=self.alice).last_seen, seen)
+
+
+class ReadStateRaceTests(TestCase):
+    """A message arriving after the conversation was loaded must still be counted."""
+
+    def setUp(self):
+        # Counters are cached per user id, and ids come round again between tests
+        cache.clear()
+        self.alice = User.objects.create_user('alice', password='pw123456')
+        self.bob = User.objects.create_user('bob', password='pw123456')
+        _create_message(self.alice, self.bob, 'one')
+        self.stale = Conversation.objects.get()
+        _create_message(self.alice, self.bob, 'two')
+
+    def assertUnread(self, count):
+        self.assertEqual(Conversation.objects.get().unread_for(self.bob), count)
+        self.assertEqual(UserStats.objects.get(user=self.bob).unread_count, count)
+        self.assertEqual(unread.unread_total(self.bob), count)
+
+    def test_mark_read_subtracts_messages_loaded_after(self):
+        self.assertEqual(self.stale.unread_for(self.bob), 1)
+        _mark_read(self.bob, self.stale)
+        self.assertUnread(0)
+
+    def test_mark_unread_adds_only_what_became_unread(self):
+        _mark_read(self.bob, Conversation.objects.get())
+        stale = Conversation.objects.get()
+        _create_message(self.alice, self.bob, 'three')
+        unread.add_unread(self.bob, stale.mark_unread(self.bob))
+        self.assertUnread(3)
+
+    def test_delete_conversation_removes_messages_loaded_after(self):
+        unread.unread_total(self.bob)
+        self.client.force_login(self.bob)
+        with mock.patch.object(Conversation.objects, 'between') as between, \
+                self.captureOnCommitCallbacks(execute=True):
+            between.return_value.first.return_value = self.stale
+            response = self.client.delete(reverse('delete_conversation', args=[self.alice.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Conversation.objects.exists())
+        self.assertEqual(UserStats.objects.get(user=self.bob).unread_count, 0)
+        self.assertEqual(unread.unread_total(self.bob), 0)
+
+    def test_read_event_carries_the_watermark(self):
+        conversation = Conversation.objects.get()
+        with mock.patch('chat.events.broker.publish') as publish, self.captureOnCommitCallbacks(execute=True):
+            _mark_read(self.bob, conversation, up_to=conversation.last_message_id - 1)
+        publish.assert_called_once_with(self.alice.id, 'read', {
+            'reader_id': self.bob.id, 'last_read': conversation.last_message_id - 1,
+        })
+
+
+class IngestTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user('alice', password='pw123456')
+        self.bob = User.objects.create_user('bob', password='pw123456')
+
+    def test_late_batch_does_not_move_last_message_back(self):
+        first = _create_message(self.alice, self.bob, 'one')
+        second = _create_message(self.alice, self.bob, 'two')
+        conversation = Conversation.objects.get()
+        # A batch holding the older message commits last
+        conversation.record_messages([first])
+        conversation.refresh_from_db()
+        self.assertEqual(conversation.last_message_id, second.id)
+        self.assertEqual(conversation.last_activity, second.timestamp)
+        self.assertEqual(conversation.unread_for(self.bob), 3)
+
+    def test_ids_are_read_back_without_bulk_insert_returning(self):
+        older = _create_message(self.alice, self.bob, 'same')
+        messages = [Message(sender=self.alice, recipient=self.bob, content=content)
+                    for content in ('same', 'other', 'same')]
+        # As on MySQL
+        with mock.patch.object(type(connection.features), 'can_return_rows_from_bulk_insert',
+                               new_callable=mock.PropertyMock, return_value=False):
+            ingest.create_messages(messages)
+        ids = [message.id for message in messages]
+        self.assertEqual(ids, sorted(ids))
+        self.assertGreater(ids[0], older.id)
+        self.assertEqual([Message.objects.get(pk=pk).content for pk in ids], ['same', 'other', 'same'])
+
+
+class ChangeLogTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user('alice', password='pw123456')
+        self.bob = User.objects.create_user('bob', password='pw123456')
+        self.carol = User.objects.create_user('carol', password='pw123456')
+
+    def seqs(self, user):
+        return list(ChangeLog.objects.filter(user=user).order_by('seq').values_list('seq', flat=True))
+
+    def test_batch_numbers_each_users_sequence(self):
+        ingest.create_messages([
+            Message(sender=self.alice, recipient=recipient, content='hi')
+            for recipient in (self.bob, self.carol, self.bob)
+        ])
+        self.assertEqual(self.seqs(self.alice), [1, 2, 3])
+        self.assertEqual(self.seqs(self.bob), [1, 2])
+        self.assertEqual(self.seqs(self.carol), [1])
+        self.assertEqual(
+            dict(UserStats.objects.values_list('user_id', 'change_seq')),
+            {self.alice.id: 3, self.bob.id: 2, self.carol.id: 1},
+        )
+
+    def test_messages_committed_out_of_id_order_all_reach_the_client(self):
+        _create_message(self.alice, self.bob, 'one')
+        after = sync.changes(self.bob)['last_seq']
+        conversation = Conversation.objects.get()
+        # Ids are taken on insert, log entries on commit: the later id commits first
+        early, late = [
+            Message.objects.create(sender=self.alice, recipient=self.bob, conversation=conversation, content=content)
+            for content in ('two', 'three')
+        ]
+        received = []
+        for message in (late, early):
+            ChangeLog.record_messages([message])
+            page = sync.changes(self.bob, after)
+            self.assertFalse(page['reset'])
+            received += [change['message']['id'] for change in page['changes']]
+            after = page['last_seq']
+        self.assertEqual(received, [late.id, early.id])
+
+    def test_pages(self):
+        for content in ('one', 'two', 'three'):
+            _create_message(self.alice, self.bob, content)
+        page = sync.changes(self.bob, 0, limit=2)
+        self.assertTrue(page['has_more'])
+        self.assertEqual([change['message']['content'] for change in page['changes']], ['one', 'two'])
+        page = sync.changes(self.bob, page['last_seq'], limit=2)
+        self.assertFalse(page['has_more'])
+        self.assertEqual([change['message']['content'] for change in page['changes']], ['three'])
+        self.assertEqual(sync.changes(self.bob, page['last_seq'])['changes'], [])
+
+
+class SyncCursorTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user('alice', password='pw123456')
+        self.bob = User.objects.create_user('bob', password='pw123456')
+        _create_message(self.alice, self.bob, 'one')
+
+    def sync(self, cursor):
+        return sync.sync(self.bob, sync.Cursor.parse(cursor))
+
+    def test_first_cursor_is_current(self):
+        payload = self.sync(sync.sync(self.bob)['cursor'])
+        self.assertEqual(payload['changes'], [])
+        self.assertEqual(payload['conversations'], [])
+        self.assertIsNone(payload['contacts'])
+
+    def test_messages_committed_out_of_id_order_all_arrive(self):
+        cursor = sync.sync(self.bob)['cursor']
+        conversation = Conversation.objects.get()
+        # Ids are taken on insert, log entries on commit: the later id commits first
+        early, late = [
+            Message.objects.create(sender=self.alice, recipient=self.bob, conversation=conversation, content=content)
+            for content in ('two', 'three')
+        ]
+        received = []
+        for message in (late, early):
+            ChangeLog.record_messages([message])
+            payload = self.sync(cursor)
+            received += [change['message']['id'] for change in payload['changes'] if change['kind'] == ChangeLog.MESSAGE]
+            cursor = payload['cursor']
+        self.assertEqual(received, [late.id, early.id])
+
+    def test_purged_log_resets(self):
+        cursor = sync.sync(self.bob)['cursor']
+        _create_message(self.alice, self.bob, 'two')
+        ChangeLog.objects.filter(user=self.bob).delete()
+        payload = self.sync(cursor)
+        self.assertTrue(payload['reset'])
+        self.assertEqual(payload['cursor'], str(UserStats.objects.get(user=self.bob).change_seq))
+        self.assertIsNotNone(payload['contacts'])
+
+
+class ConversationQueryTests(TestCase):
+    """Opening, polling and writing to a conversation cost a fixed number of queries."""
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user('alice', password='pw123456')
+        self.bob = User.objects.create_user('bob', password='pw123456')
+        self.last = _create_message(self.alice, self.bob, 'one')
+        self.client.force_login(self.bob)
+        # Opens and reads the conversation, and loads the session
+        self.get_messages()
+
+    def send(self, content):
+        with self.captureOnCommitCallbacks(execute=True):
+            return _create_message(self.alice, self.bob, content)
+
+    def get_messages(self):
+        return self.client.get(reverse('get_messages', args=[self.alice.id]))
+
+    def get_updates(self, last_id, etag=None):
+        response = self.client.get(
+            reverse('message_updates'), {'user_id': self.alice.id, 'last_id': last_id},
+            headers={'If-None-Match': etag} if etag else {},
+        )
+        if response.streaming:
+            # Rows are read while the body streams
+            b''.join(response.streaming_content)
+        return response
+
+    def test_get_messages(self):
+        # Session, both users, the conversation and the page
+        with self.assertNumQueries(5):
+            self.assertEqual(self.get_messages().status_code, 200)
+
+        self.send('two')
+        # Plus marking it read: the locked read state, the counters and the change log
+        with self.assertNumQueries(15):
+            self.assertEqual(self.get_messages().status_code, 200)
+
+    def test_get_message_updates(self):
+        response = self.get_updates(self.last.id)
+        self.assertEqual(response.status_code, 200)
+
+        # Answered from the cached versions
+        with self.assertNumQueries(2):
+            self.assertEqual(self.get_updates(self.last.id, response['ETag']).status_code, 304)
+
+        self.send('two')
+        with self.assertNumQueries(15):
+            self.assertEqual(self.get_updates(self.last.id, response['ETag']).status_code, 200)
+
+    def test_send_message(self):
+        # Session, both users, then the conversation, message, search term,
+        # unread counter and stats writes, and one numbering update and one
+        # insert for both change log entries
+        with self.assertNumQueries(14):
+            response = self.client.post(
+                reverse('send_message'), {'recipient_id': self.alice.id, 'content': 'hi'}, content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            list(ChangeLog.objects.filter(kind=ChangeLog.MESSAGE).order_by('user_id', 'seq').values_list('user_id', 'seq')),
+            [(self.alice.id, 1), (self.alice.id, 3), (self.bob.id, 1), (self.bob.id, 3)],
+        )
+
+
+class GroupTests(TestCase):
+    def setUp(self):
+        # The contact graph is cached per user id
+        cache.clear()
+        self.alice, self.bob, self.carol, self.dave = [
+            User.objects.create_user(name, password='pw123456') for name in ('alice', 'bob', 'carol', 'dave')
+        ]
+        for user in (self.bob, self.carol):
+            Contact.objects.create(requester=self.alice, recipient=user, status='accepted')
+        self.group = groups.create(self.alice, 'Team', [self.bob.id])
+
+    def unread(self, user):
+        return groups.membership(user, self.group.id).unread_count
+
+    def test_members_must_be_contacts(self):
+        with self.assertRaises(ValueError):
+            groups.create(self.alice, 'Team', [self.dave.id])
+        with self.assertRaises(ValueError):
+            groups.add_members(self.group, [self.dave.id])
+        self.assertEqual(groups.add_members(self.group, [self.bob.id, self.carol.id]), [self.carol.id])
+        self.group.refresh_from_db()
+        self.assertEqual(self.group.member_count, 3)
+
+    def test_watermarks(self):
+        first = groups.send(self.group, self.alice, 'one')
+        groups.send(self.group, self.alice, 'two')
+        self.group.refresh_from_db()
+        # Writing to the group means having read it
+        self.assertEqual((self.unread(self.alice), self.unread(self.bob)), (0, 2))
+
+        self.assertTrue(groups.mark_read(self.group, self.bob, up_to=first.id))
+        self.assertEqual(self.unread(self.bob), 1)
+        # Never backwards, and never past the latest message
+        self.assertFalse(groups.mark_read(self.group, self.bob, up_to=first.id))
+        self.assertTrue(groups.mark_read(self.group, self.bob, up_to=self.group.last_message_id + 10))
+        self.assertEqual(groups.membership(self.bob, self.group.id).last_read, self.group.last_message_id)
+
+        # Members who join later start with nothing unread
+        groups.add_members(self.group, [self.carol.id])
+        self.assertEqual(self.unread(self.carol), 0)
+        groups.send(self.group, self.bob, 'three')
+        self.assertEqual(self.unread(self.carol), 1)
+
+    def test_opening_a_group_reads_it(self):
+        groups.send(self.group, self.alice, 'one')
+        self.client.force_login(self.bob)
+        response = self.client.get(reverse('get_group_messages', args=[self.group.id]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['group']['unread_count'], 0)
+        self.assertEqual(self.unread(self.bob), 0)
+
+    def test_outsiders_get_404(self):
+        groups.send(self.group, self.alice, 'one')
+        self.client.force_login(self.carol)
+        self.assertEqual(self.client.get(reverse('get_group_messages', args=[self.group.id])).status_code, 404)
+        response = self.client.post(
+            reverse('send_group_message', args=[self.group.id]), {'content': 'hi'}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(GroupMessage.objects.count(), 1)
 
-# Create your tests here.
+    def test_owner_leaving_hands_over_and_last_member_deletes(self):
+        groups.leave(self.group, self.alice)
+        self.group.refresh_from_db()
+        self.assertEqual((self.group.owner_id, self.group.member_count), (self.bob.id, 1))
+        groups.leave(self.group, self.bob)
+        self.assertFalse(GroupConversation.objects.exists())
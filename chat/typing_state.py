@@ -0,0 +1,82 @@
+import threading
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+
+# How long a "typing" signal stays valid without being refreshed. chat.js
+# re-sends it every few seconds while the user keeps typing.
+TYPING_TTL_SECONDS = 6
+
+
+class MemoryTypingBackend:
+    """
+    Keeps typing state in this process only. Fine for a single worker; use
+    CacheTypingBackend when several workers must see each other's state.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._expiry = {}
+
+    def start(self, sender_id, recipient_id, ttl):
+        with self._lock:
+            self._prune()
+            self._expiry[(sender_id, recipient_id)] = time.monotonic() + ttl
+
+    def stop(self, sender_id, recipient_id):
+        with self._lock:
+            self._expiry.pop((sender_id, recipient_id), None)
+
+    def is_typing(self, sender_id, recipient_id):
+        expires = self._expiry.get((sender_id, recipient_id))
+        return expires is not None and expires > time.monotonic()
+
+    def _prune(self):
+        now = time.monotonic()
+        for key in [key for key, expires in self._expiry.items() if expires <= now]:
+            del self._expiry[key]
+
+
+class CacheTypingBackend:
+    """
+    Stores typing state in a Django cache so every worker shares it. Point
+    CHAT_TYPING_CACHE at a shared alias (e.g. redis, or a FileBasedCache for
+    several workers on one host).
+    """
+
+    def __init__(self):
+        self._cache = caches[getattr(settings, 'CHAT_TYPING_CACHE', 'default')]
+
+    def _key(self, sender_id, recipient_id):
+        return f'chat:typing:{sender_id}:{recipient_id}'
+
+    def start(self, sender_id, recipient_id, ttl):
+        self._cache.set(self._key(sender_id, recipient_id), True, ttl)
+
+    def stop(self, sender_id, recipient_id):
+        self._cache.delete(self._key(sender_id, recipient_id))
+
+    def is_typing(self, sender_id, recipient_id):
+        return bool(self._cache.get(self._key(sender_id, recipient_id)))
+
+
+@lru_cache(maxsize=None)
+def get_typing_store():
+    backend = getattr(settings, 'CHAT_TYPING_BACKEND', 'chat.typing_state.MemoryTypingBackend')
+    return import_string(backend)()
+
+
+def set_typing(sender_id, recipient_id, is_typing):
+    store = get_typing_store()
+    if is_typing:
+        store.start(sender_id, recipient_id, TYPING_TTL_SECONDS)
+    else:
+        store.stop(sender_id, recipient_id)
+
+
+def is_typing(sender_id, recipient_id):
+    return get_typing_store().is_typing(sender_id, recipient_id)
@@ -0,0 +1,89 @@
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import UserStats, _pk
+from . import versions
+
+
+# Counters are adjusted in place by the write paths. The timeout only bounds
+# how long a counter that lost a race with a rebuild can stay off.
+UNREAD_CACHE_TIMEOUT = 10 * 60
+
+
+def _key(user_id):
+    return f'chat:unread:{user_id}'
+
+
+def unread_total(user):
+    """
+    Total unread messages for ``user``. Served from the cache; on a miss
+    (cold cache, restart, eviction) it is reloaded from the user's stats row.
+    """
+    key = _key(_pk(user))
+    total = cache.get(key)
+    if total is None:
+        total = UserStats.for_user(user).unread_count
+        cache.add(key, total, UNREAD_CACHE_TIMEOUT)
+    return total
+
+
+async def aunread_total(user):
+    key = _key(_pk(user))
+    total = await cache.aget(key)
+    if total is None:
+        stats = await UserStats.objects.filter(user_id=_pk(user)).afirst()
+        if stats is None:
+            stats = await sync_to_async(UserStats.rebuild)(user)
+        total = stats.unread_count
+        await cache.aadd(key, total, UNREAD_CACHE_TIMEOUT)
+    return total
+
+
+def add_unread(user, count=1):
+    if count:
+        UserStats.adjust_unread(user, count)
+        versions.touch_user(user)
+        transaction.on_commit(lambda: _adjust(_pk(user), count))
+
+
+def add_unread_many(counts):
+    """``add_unread`` for ``{user_id: count}``, one update per distinct count."""
+    counts = {user_id: count for user_id, count in counts.items() if count}
+    by_count = defaultdict(list)
+    for user_id, count in counts.items():
+        by_count[count].append(user_id)
+    for count, user_ids in by_count.items():
+        UserStats.adjust_unread_many(user_ids, count)
+    if counts:
+        versions.touch_user(*counts)
+
+        def adjust():
+            for user_id, count in counts.items():
+                _adjust(user_id, count)
+        transaction.on_commit(adjust)
+
+
+def remove_unread(user, count):
+    if count:
+        UserStats.adjust_unread(user, -count)
+        versions.touch_user(user)
+        transaction.on_commit(lambda: _adjust(_pk(user), -count))
+
+
+def _adjust(user_id, delta):
+    key = _key(user_id)
+    try:
+        total = cache.incr(key, delta)
+    except ValueError:
+        # Not cached, the next read rebuilds it
+        return
+    if total < 0:
+        cache.delete(key)
+
+
+def invalidate(*users):
+    cache.delete_many([_key(_pk(user)) for user in users])
+    versions.touch_user(*users)
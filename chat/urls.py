@@ -1,17 +1,36 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
+
+# Endpoints with an async variant, see chat/async_views.py
+api = async_views if settings.CHAT_ASYNC_VIEWS else views
 
 urlpatterns = [
     path('', views.chat_view, name='chat'),
-    path('send/', views.send_message, name='send_message'),
-    path('get/<int:user_id>/', views.get_messages, name='get_messages'),
+    path('send/', api.send_message, name='send_message'),
+    path('send-batch/', views.send_messages, name='send_messages'),
+    path('get/<int:user_id>/', api.get_messages, name='get_messages'),
     path('search-users/', views.search_users, name='search_users'),
-    path('unread/', views.get_unread_count, name='get_unread_count'),
+    path('search-messages/', views.search_messages, name='search_messages'),
+    path('unread/', api.get_unread_count, name='get_unread_count'),
+    path('sync/', views.sync_changes, name='sync'),
+    path('changes/', views.get_changes, name='changes'),
     path('typing/', views.typing_indicator, name='typing_indicator'),
     path('typing-status/', views.typing_status, name='typing_status'),
     path('mark-read/<int:message_id>/', views.mark_read, name='mark_read'),
-    path('updates/', views.get_message_updates, name='message_updates'),
+    path('updates/', api.get_message_updates, name='message_updates'),
+    path('stream/', views.event_stream, name='event_stream'),
     path('delete/<int:user_id>/', views.delete_conversation, name='delete_conversation'),
     path('mark-unread/<int:user_id>/', views.mark_as_unread, name='mark_as_unread'),
+    path('groups/', views.group_list, name='group_list'),
+    path('groups/create/', views.create_group, name='create_group'),
+    path('groups/<int:group_id>/messages/', views.get_group_messages, name='get_group_messages'),
+    path('groups/<int:group_id>/send/', views.send_group_message, name='send_group_message'),
+    path('groups/<int:group_id>/read/', views.mark_group_read, name='mark_group_read'),
+    path('groups/<int:group_id>/members/', views.group_members, name='group_members'),
+    path('groups/<int:group_id>/members/add/', views.add_group_members, name='add_group_members'),
+    path('groups/<int:group_id>/leave/', views.leave_group, name='leave_group'),
+    path('presence/', views.presence_heartbeat, name='presence_heartbeat'),
+    path('presence/metrics/', views.presence_metrics, name='presence_metrics'),
     path('profile/<int:user_id>/', views.view_recipient_profile, name='view_recipient_profile'),
 ]
\ No newline at end of file
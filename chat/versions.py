@@ -0,0 +1,88 @@
+import time
+from datetime import datetime, timezone
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import _pk
+
+
+# Versions are the time of the last change in nanoseconds. A version that
+# was evicted comes back as "now", which can only cause one spurious full
+# response, never a stale 304.
+VERSION_CACHE_TIMEOUT = 24 * 60 * 60
+
+
+def _user_key(user_id, scope='unread'):
+    return f'chat:version:{scope}:{user_id}'
+
+
+def _conversation_key(user_a, user_b):
+    low, high = sorted((_pk(user_a), _pk(user_b)))
+    return f'chat:version:conversation:{low}:{high}'
+
+
+def _current(key):
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), VERSION_CACHE_TIMEOUT)
+        version = cache.get(key, time.time_ns())
+    return version
+
+
+async def _acurrent(key):
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, time.time_ns(), VERSION_CACHE_TIMEOUT)
+        version = await cache.aget(key, time.time_ns())
+    return version
+
+
+def _bump(*keys):
+    # Bump once the change can be read back, like the unread counters
+    transaction.on_commit(lambda: cache.set_many(
+        {key: time.time_ns() for key in keys}, VERSION_CACHE_TIMEOUT
+    ))
+
+
+def user_version(user):
+    """Version of ``user``'s unread total."""
+    return _current(_user_key(_pk(user)))
+
+
+def conversation_version(user_a, user_b):
+    """Version of the messages and read state between two users."""
+    return _current(_conversation_key(user_a, user_b))
+
+
+async def auser_version(user):
+    return await _acurrent(_user_key(_pk(user)))
+
+
+async def aconversation_version(user_a, user_b):
+    return await _acurrent(_conversation_key(user_a, user_b))
+
+
+def contacts_version(user):
+    """Version of ``user``'s contacts, contact requests and notifications."""
+    return _current(_user_key(_pk(user), 'contacts'))
+
+
+def touch_user(*users):
+    _bump(*[_user_key(_pk(user)) for user in users])
+
+
+def touch_contacts(*users):
+    _bump(*[_user_key(_pk(user), 'contacts') for user in users])
+
+
+def touch_conversation(conversation):
+    _bump(_conversation_key(conversation.user_low_id, conversation.user_high_id))
+
+
+def etag(*parts):
+    return '"' + '-'.join(str(part) for part in parts) + '"'
+
+
+def last_modified(version):
+    return datetime.fromtimestamp(version / 1e9, tz=timezone.utc)
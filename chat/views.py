@@ -1,93 +1,165 @@
+from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
+from django.http import Http404, JsonResponse, HttpResponse, StreamingHttpResponse
 from django.contrib.auth import get_user_model
-from django.db.models import Q, Max
-from django.views.decorators.http import require_http_methods
+from django.db.models import Max
+from django.views.decorators.http import require_http_methods, condition
+from django.db import DEFAULT_DB_ALIAS, transaction
 from django.views.decorators.csrf import csrf_exempt
-from .models import Message
-from contacts.models import Contact
-from django.utils import timezone
+from django.views.decorators.cache import cache_control
+from django.utils.http import http_date, parse_etags
+from django.core.handlers.asgi import ASGIRequest
+from .models import Message, Conversation, GroupMember, UserSearchToken, MessageSearchTerm, UserStats, ChangeLog
+from .events import broker, publish_on_commit, format_sse, notifier, notify_on_commit
+from .serializers import MessageSerializer, message_rows, stream_messages
+from . import groups, ingest, presence, unread, typing_state, versions, sync
+from contacts import graph
+from ChatApp.routers import read_replica
+from functools import wraps
+import asyncio
 import json
+import time
 
 User = get_user_model()
 
+# Push stream tuning. Streams are recycled periodically so that proxies and
+# workers never hold a connection forever; EventSource reconnects by itself.
+STREAM_MAX_SECONDS = 55
+STREAM_KEEPALIVE_SECONDS = 15
+STREAM_RETRY_MS = 3000
+
+# A long-polling get_message_updates re-checks the shared cache this often,
+# for changes made by other workers that the in-process notifier misses.
+# The longest hold is settings.CHAT_LONG_POLL_SECONDS.
+LONG_POLL_RECHECK_SECONDS = 5
+
+# Longest a group-committed send_message waits for its batch to be stored
+INGEST_TIMEOUT_SECONDS = 30
+
+# Most messages accepted by one send_messages request
+SEND_BATCH_MAX_MESSAGES = 100
+
+# Page size for message history, see get_messages
+MESSAGES_PAGE_SIZE = 50
+MESSAGES_MAX_PAGE_SIZE = 200
+SEARCH_PAGE_SIZE = 20
+
 
 @login_required
+@read_replica
 def chat_view(request):
-    contacts = Contact.objects.filter(
-        (Q(requester=request.user) | Q(recipient=request.user)),
-        status='accepted'
-    ).select_related('requester', 'recipient')
+    # Read before the page state, so catching up from it can't miss a change
+    change_seq = UserStats.for_user(request.user).change_seq
+    contact_users = graph.contact_users(request.user)
+    # Opening the page counts as a heartbeat
+    presence.heartbeat(request.user)
+    statuses = presence.presence([user['id'] for user in contact_users])
     
-    contact_users = []
-    for contact in contacts:
-        if contact.requester == request.user:
-            contact_users.append(contact.recipient)
-        else:
-            contact_users.append(contact.requester)
+    # One ordered query over the conversation summaries, most recent first
+    conversations = {
+        conversation.peer_id(request.user): conversation
+        for conversation in Conversation.objects.for_user(request.user)
+            .select_related('last_message')
+            .order_by('-last_activity')
+    }
     
     participants = []
     for user in contact_users:
-        last_message = Message.objects.filter(
-            Q(sender=request.user, recipient=user) |
-            Q(sender=user, recipient=request.user)
-        ).order_by('-timestamp').first()
-        
-        unread_count = Message.objects.filter(
-            sender=user,
-            recipient=request.user,
-            is_read=False
-        ).count()
-        
-        # Safe avatar URL handling
-        avatar_url = None
-        if hasattr(user, 'profile') and hasattr(user.profile, 'avatar') and user.profile.avatar:
-            try:
-                avatar_url = user.profile.avatar.url
-            except ValueError:
-                # Handle case where avatar exists but has no file
-                avatar_url = None
-        
+        conversation = conversations.get(user['id'])
         participants.append({
-            'id': user.id,
-            'username': user.username,
-            'full_name': user.get_full_name(),
-            'email': user.email,
-            'last_message': last_message,
-            'unread_count': unread_count,
-            'avatar_url': avatar_url 
+            **user,
+            'last_message': conversation.last_message if conversation else None,
+            'last_activity': conversation.last_activity if conversation else None,
+            'unread_count': conversation.unread_for(request.user) if conversation else 0,
+            **statuses[user['id']],
         })
     
-    participants.sort(key=lambda x: x['last_message'].timestamp if x['last_message'] else timezone.now(), reverse=True)
+    # Contacts we haven't talked to yet go first, then most recent activity
+    order = {user_id: position for position, user_id in enumerate(conversations)}
+    participants.sort(key=lambda x: order.get(x['id'], -1) if x['last_message'] else -1)
     
     return render(request, 'dashboard/chat/index.html', {
         'participants': participants,
-        'all_users': contact_users
-    })
-    
-    # Sort participants by most recent message
-    participants.sort(key=lambda x: x['last_message'].timestamp if x['last_message'] else timezone.now(), reverse=True)
-    
-    # Get all contact users for new message modal (only contacts)
-    all_users = contact_users
-    
-    return render(request, 'dashboard/chat/index.html', {
-        'participants': participants,
-        'all_users': all_users
+        'all_users': contact_users,
+        # Change log position the page was rendered at, see get_changes
+        'chat_state': {'user_id': request.user.id, 'change_seq': change_seq},
     })
 
 @login_required
+def sync_changes(request):
+    """One poll for everything the client shows: messages, unread counts, typing, contacts."""
+    try:
+        cursor = sync.Cursor.parse(request.GET['cursor']) if request.GET.get('cursor') else None
+        typing_peers = [int(peer_id) for peer_id in request.GET.get('typing', '').split(',') if peer_id]
+    except ValueError:
+        return JsonResponse({'error': 'Invalid sync parameters'}, status=400)
+
+    return JsonResponse(sync.sync(request.user, cursor, typing_peers), json_dumps_params={'ensure_ascii': False})
+
+
+@login_required
+def get_changes(request):
+    """Page of the user's change log after ``after``, for catching up after a reconnect."""
+    try:
+        after = int(request.GET['after']) if request.GET.get('after') else None
+        limit = int(request.GET.get('limit', sync.CHANGES_PAGE_SIZE))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid change log parameters'}, status=400)
+    if after is not None and after < 0:
+        return JsonResponse({'error': 'Invalid change log parameters'}, status=400)
+    limit = max(1, min(limit, sync.CHANGES_MAX_PAGE_SIZE))
+
+    return JsonResponse(sync.changes(request.user, after, limit), json_dumps_params={'ensure_ascii': False})
+
+
+def _unread_etag(request):
+    return versions.etag('u', request.user.id, versions.user_version(request.user))
+
+
+def _unread_last_modified(request):
+    return versions.last_modified(versions.user_version(request.user))
+
+
+@login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_unread_etag, last_modified_func=_unread_last_modified)
 def get_unread_count(request):
-    unread_count = Message.objects.filter(
-        recipient=request.user,
-        is_read=False
-    ).count()
+    unread_count = unread.unread_total(request.user)
 
     return JsonResponse({
         'unread_count': unread_count
     })
 
+def _create_message(sender, recipient, content):
+    """Store a message, update everything derived from it and push it out."""
+    return ingest.create_messages([Message(sender=sender, recipient=recipient, content=content)])[0]
+
+
+def _sent_record(message, data):
+    return {
+        'message_id': message.id,
+        'timestamp': message.timestamp.isoformat(),
+        'content': message.content,
+        'is_read': False,
+        'temp_id': data.get('temp_id', ''),
+    }
+
+
+def _message_sent(message, data):
+    return JsonResponse({
+        'status': 'success',
+        **_sent_record(message, data),
+    }, status=201, json_dumps_params={'ensure_ascii': False})
+
+
+def _recipient_id(data):
+    try:
+        return int(data.get('recipient_id'))
+    except (TypeError, ValueError):
+        raise Http404('No User matches the given query.')
+
+
 @login_required
 @require_http_methods(["POST"])
 def send_message(request):
@@ -97,88 +169,175 @@ def send_message(request):
         except json.JSONDecodeError:
             return JsonResponse({'status': 'error', 'message': 'Invalid JSON data'}, status=400)
         
-        recipient = get_object_or_404(User, id=data.get('recipient_id'))
+        if settings.CHAT_INGEST_GROUP_COMMIT:
+            # The recipient is checked by the writer, once per batch
+            recipient_id = _recipient_id(data)
+        else:
+            recipient = get_object_or_404(User, id=data.get('recipient_id'))
         content = data.get('content', '').strip()
         
         if not content:
             return JsonResponse({'status': 'error', 'message': 'Message cannot be empty'}, status=400)
         
-        # Create the message
-        message = Message.objects.create(
-            sender=request.user,
-            recipient=recipient,
-            content=content
-        )
-        
-        return JsonResponse({
-            'status': 'success',
-            'message_id': message.id,
-            'timestamp': message.timestamp.isoformat(),
-            'content': message.content,
-            'is_read': message.is_read,
-            'temp_id': data.get('temp_id', ''),
-        }, status=201, json_dumps_params={'ensure_ascii': False})
+        if settings.CHAT_INGEST_GROUP_COMMIT:
+            try:
+                message = ingest.submit(request.user, recipient_id, content).result(INGEST_TIMEOUT_SECONDS)
+            except User.DoesNotExist:
+                raise Http404('No User matches the given query.')
+        else:
+            message = _create_message(request.user, recipient, content)
+        return _message_sent(message, data)
     
     except Exception as e:
         return JsonResponse({'status': 'error', 'message': str(e)}, status=500)
 
+
 @login_required
-def get_messages(request, user_id):
+@require_http_methods(["POST"])
+def send_messages(request):
+    """
+    Send many messages, e.g. from a bot or an announcement, stored in one
+    transaction. The body is ``{"messages": [{"recipient_id", "content",
+    "temp_id"}, ...]}``; nothing is stored unless every message is valid.
+    """
     try:
-        other_user = User.objects.get(id=user_id)
-    except User.DoesNotExist:
+        items = json.loads(request.body.decode('utf-8'))['messages']
+        if not isinstance(items, list):
+            raise TypeError
+    except (json.JSONDecodeError, KeyError, TypeError):
+        return JsonResponse({'status': 'error', 'message': 'Invalid JSON data'}, status=400)
+    if not items or len(items) > SEND_BATCH_MAX_MESSAGES:
         return JsonResponse({
-            'error': 'User not found',
-            'status': 404
-        }, status=404)
+            'status': 'error',
+            'message': f'Send between 1 and {SEND_BATCH_MAX_MESSAGES} messages',
+        }, status=400)
 
-    messages = Message.objects.filter(
-        Q(sender=request.user, recipient=other_user) |
-        Q(sender=other_user, recipient=request.user)
-    ).order_by('timestamp')
-
-    # Mark messages as read
-    Message.objects.filter(
-        sender=other_user,
-        recipient=request.user,
-        is_read=False
-    ).update(is_read=True)
-
-    messages_data = [{
-        'id': message.id,
-        'sender_id': message.sender.id,
-        'content': message.content,
-        'timestamp': message.timestamp.isoformat(),
-        'is_read': message.is_read,
-        'is_me': message.sender == request.user
-    } for message in messages]
+    messages = []
+    for position, item in enumerate(items):
+        try:
+            recipient_id = int(item.get('recipient_id'))
+            content = item.get('content', '').strip()
+        except (AttributeError, TypeError, ValueError):
+            return JsonResponse({'status': 'error', 'message': 'Invalid message', 'index': position}, status=400)
+        if not content:
+            return JsonResponse({'status': 'error', 'message': 'Message cannot be empty', 'index': position}, status=400)
+        messages.append(Message(sender=request.user, recipient_id=recipient_id, content=content))
 
+    # One lookup for all recipients
+    known = set(User.objects.filter(
+        id__in={message.recipient_id for message in messages}
+    ).values_list('id', flat=True))
+    for position, message in enumerate(messages):
+        if message.recipient_id not in known:
+            return JsonResponse({'status': 'error', 'message': 'User not found', 'index': position}, status=404)
+
+    ingest.create_messages(messages)
     return JsonResponse({
-        'messages': messages_data,
+        'status': 'success',
+        'messages': [_sent_record(message, item) for message, item in zip(messages, items)],
+    }, status=201, json_dumps_params={'ensure_ascii': False})
+
+
+def _mark_read(reader, conversation, up_to=None):
+    """Move ``reader``'s watermark and propagate it to counters, caches and the peer."""
+    if conversation._state.db != DEFAULT_DB_ALIAS:
+        # Loaded by a @read_replica view; the counters have to move by what
+        # the primary holds, not by a lagging copy
+        conversation.refresh_from_db(using=DEFAULT_DB_ALIAS)
+    if not conversation.unread_for(reader):
+        return
+    with transaction.atomic():
+        read = conversation.mark_read(reader, up_to=up_to)
+        if not read:
+            return
+        unread.remove_unread(reader, read)
+        versions.touch_conversation(conversation)
+        ChangeLog.record_read(conversation, reader)
+    publish_on_commit(conversation.peer_id(reader), 'read', {
+        'reader_id': reader.id, 'last_read': conversation.last_read_for(reader),
+    })
+    notify_on_commit(reader.id, conversation.peer_id(reader))
+
+
+def _page_params(request):
+    before_id = int(request.GET['before_id']) if request.GET.get('before_id') else None
+    limit = int(request.GET.get('limit', MESSAGES_PAGE_SIZE))
+    return before_id, max(1, min(limit, MESSAGES_MAX_PAGE_SIZE))
+
+
+def _page_query(conversation, before_id, limit):
+    # Keyset pagination: newest page first, walking back by message id.
+    # One extra row tells whether there is more.
+    messages = Message.objects.filter(conversation=conversation)
+    if before_id is not None:
+        messages = messages.filter(id__lt=before_id)
+    return messages.order_by('-id')[:limit + 1]
+
+
+def _peer_record(user):
+    return {
+        'id': user.id,
+        'username': user.username,
+        'full_name': user.get_full_name(),
+    }
+
+
+def _messages_page(viewer, other_user, conversation, rows, limit):
+    has_more = len(rows) > limit
+    rows = rows[:limit][::-1]
+    return {
+        'messages': MessageSerializer(viewer, conversation).many(rows),
+        'has_more': has_more,
+        'next_before_id': rows[0]['id'] if has_more else None,
         'other_user': {
-            'id': other_user.id,
-            'username': other_user.username,
-            'full_name': other_user.get_full_name(),
+            **_peer_record(other_user),
             'profile': {
-                'avatar': other_user.profile.avatar.url if hasattr(other_user, 'profile') and other_user.profile.avatar else None
+                'avatar': other_user.profile.avatar_medium_url if hasattr(other_user, 'profile') else None
             }
         }
-    })
+    }
+
 
 @login_required
+@read_replica
+def get_messages(request, user_id):
+    try:
+        other_user = User.objects.select_related('profile').get(id=user_id)
+    except User.DoesNotExist:
+        return JsonResponse({
+            'error': 'User not found',
+            'status': 404
+        }, status=404)
+
+    try:
+        before_id, limit = _page_params(request)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid pagination parameters'}, status=400)
+
+    conversation = Conversation.objects.between(request.user, other_user).first()
+    rows = []
+    if conversation:
+        # Opening the conversation moves the read watermark to its end
+        if before_id is None:
+            _mark_read(request.user, conversation)
+        rows = list(message_rows(_page_query(conversation, before_id, limit)))
+
+    return JsonResponse(_messages_page(request.user, other_user, conversation, rows, limit))
+
+@login_required
+@read_replica
 def search_users(request):
     query = request.GET.get('q', '').strip()
     
     if not query:
         return JsonResponse({'users': []})
     
-    # Search by username, first name, last name, or email
-    users = User.objects.filter(
-        Q(username__icontains=query) |
-        Q(first_name__icontains=query) |
-        Q(last_name__icontains=query) |
-        Q(email__icontains=query)
-    ).exclude(id=request.user.id).distinct()[:10]
+    # Prefix search by username, first name, last name, or email
+    user_ids = UserSearchToken.search(query, limit=10, exclude=request.user.id)
+    users = sorted(
+        User.objects.filter(id__in=user_ids),
+        key=lambda user: (user.username.lower() != query.lower(), user.username.lower())
+    )
     
     users_data = []
     for user in users:
@@ -191,93 +350,256 @@ def search_users(request):
     
     return JsonResponse({'users': users_data})
 
+@login_required
+@read_replica
+def search_messages(request):
+    query = request.GET.get('q', '').strip()
+    try:
+        page = max(1, int(request.GET.get('page', 1)))
+        other_user_id = int(request.GET['user_id']) if request.GET.get('user_id') else None
+    except ValueError:
+        return JsonResponse({'error': 'Invalid search parameters'}, status=400)
+    
+    # Search one conversation, or all of the user's conversations
+    if other_user_id is not None:
+        conversations = Conversation.objects.between(request.user, other_user_id)
+    else:
+        conversations = Conversation.objects.for_user(request.user)
+    conversation_ids = list(conversations.values_list('id', flat=True))
+    
+    offset = (page - 1) * SEARCH_PAGE_SIZE
+    hits = list(MessageSearchTerm.search(query, conversation_ids)[offset:offset + SEARCH_PAGE_SIZE + 1])
+    has_more = len(hits) > SEARCH_PAGE_SIZE
+    hits = hits[:SEARCH_PAGE_SIZE]
+    
+    messages = {
+        row['id']: row
+        for row in message_rows(Message.objects.filter(id__in=[hit['message_id'] for hit in hits]))
+    }
+    serialize = MessageSerializer(request.user)
+    results = [
+        serialize(messages[hit['message_id']], score=hit['score'])
+        for hit in hits
+        if hit['message_id'] in messages
+    ]
+    
+    return JsonResponse({
+        'results': results,
+        'page': page,
+        'has_more': has_more,
+    })
+
 @login_required
 @require_http_methods(["POST"])
 def typing_indicator(request):
-    data = json.loads(request.body)
-    recipient = User.objects.get(id=data['recipient_id'])
-    is_typing = data['is_typing']
+    try:
+        data = json.loads(request.body)
+        recipient_id = int(data['recipient_id'])
+        is_typing = bool(data['is_typing'])
+    except (json.JSONDecodeError, KeyError, TypeError, ValueError):
+        return JsonResponse({'status': 'error', 'message': 'Invalid typing data'}, status=400)
     
+    # Ephemeral state, never written to the database
+    typing_state.set_typing(request.user.id, recipient_id, is_typing)
+    notifier.notify(notifier.key(request.user.id, recipient_id))
+    broker.publish(recipient_id, 'typing', {
+        'user_id': request.user.id,
+        'is_typing': is_typing,
+    })
     
     return JsonResponse({
         'status': 'success',
         'is_typing': is_typing,
         'sender_id': request.user.id,
-        'recipient_id': recipient.id
+        'recipient_id': recipient_id
     })
 
+def _typing_etag(request):
+    try:
+        user_id = int(request.GET.get('user_id'))
+    except (TypeError, ValueError):
+        return None
+    return versions.etag('t', user_id, request.user.id, int(typing_state.is_typing(user_id, request.user.id)))
+
+
 @login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_typing_etag)
 def typing_status(request):
     user_id = request.GET.get('user_id')
     try:
-        other_user = User.objects.get(id=user_id)
-        
-        return JsonResponse({
-            'is_typing': False,
-            'user_id': user_id
-        })
-    except User.DoesNotExist:
-        return JsonResponse({
-            'error': 'User not found',
-            'status': 404
-        }, status=404)
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return JsonResponse({'error': 'user_id parameter is required'}, status=400)
+    
+    return JsonResponse({
+        'is_typing': typing_state.is_typing(user_id, request.user.id),
+        'user_id': user_id
+    })
 
 @login_required
 @require_http_methods(["POST"])
 @csrf_exempt
 def mark_read(request, message_id):
-    message = Message.objects.get(id=message_id)
-    message.is_read = True
-    message.save()
+    message = get_object_or_404(
+        Message.objects.select_related('conversation'),
+        id=message_id,
+        recipient=request.user
+    )
+    if message.conversation:
+        _mark_read(request.user, message.conversation, up_to=message.id)
     return JsonResponse({'status': 'success'})
 
+def _updates_params(request):
+    """``(peer_id, last_id)`` of a get_message_updates request; raises on bad input."""
+    peer_id = int(request.GET.get('user_id'))
+    last_id = int(request.GET['last_id']) if request.GET.get('last_id') else None
+    return peer_id, last_id
+
+
+def _conversation_etag(user_id, peer_id, last_id, version, typing):
+    return versions.etag('c', user_id, peer_id, '' if last_id is None else last_id, version, int(typing))
+
+
+def _updates_etag(request, version=None):
+    try:
+        peer_id, last_id = _updates_params(request)
+    except (TypeError, ValueError):
+        return None
+    if version is None:
+        version = versions.conversation_version(request.user, peer_id)
+    typing = typing_state.is_typing(peer_id, request.user.id)
+    return _conversation_etag(request.user.id, peer_id, last_id, version, typing)
+
+
+def _next_last_id(conversation, last_id):
+    # The last_id of the client's next poll: its validators are the ones the
+    # response carries, so an unchanged conversation gets a 304, or a held
+    # long poll, straight away
+    if conversation is None or conversation.last_message_id is None:
+        return last_id
+    return max(conversation.last_message_id, last_id or 0)
+
+
+def _updates_payload(viewer, other_user, conversation):
+    return {
+        'other_user': _peer_record(other_user),
+        'is_typing': typing_state.is_typing(other_user.id, viewer.id),
+        # Everything the peer has read, for the sender's read ticks
+        'peer_last_read': conversation.last_read_for(other_user) if conversation else 0,
+    }
+
+
+def _long_poll_seconds(request):
+    try:
+        seconds = float(request.GET.get('wait') or 0)
+    except ValueError:
+        return 0
+    return max(0, min(seconds, settings.CHAT_LONG_POLL_SECONDS))
+
+
+def _is_current(request, etag):
+    return etag in parse_etags(request.headers.get('If-None-Match', ''))
+
+
+def _wait_for_updates(request, seconds):
+    """
+    Hold the request while the ETag the client sent is still current, at
+    most ``seconds``. Woken by the notifier as soon as the conversation
+    changes in this process.
+    """
+    peer_id, last_id = _updates_params(request)
+    key = notifier.key(request.user.id, peer_id)
+    event = notifier.listen(key)
+    try:
+        etag = _updates_etag(request)
+        if not _is_current(request, etag):
+            return
+        deadline = time.monotonic() + seconds
+        while (remaining := deadline - time.monotonic()) > 0:
+            if event.wait(min(remaining, LONG_POLL_RECHECK_SECONDS)) or _updates_etag(request) != etag:
+                return
+    finally:
+        notifier.unlisten(key, event)
+
+
+def _long_poll(view):
+    # Outside @condition, so a hold that times out still ends in a 304
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        seconds = _long_poll_seconds(request)
+        if seconds:
+            try:
+                _wait_for_updates(request, seconds)
+            except (TypeError, ValueError):
+                pass  # Bad parameters, the view answers them
+        return view(request, *args, **kwargs)
+    return wrapper
+
+
+def _updates_query(conversation, last_id):
+    # Without last_id this is the whole history
+    messages = Message.objects.filter(conversation=conversation)
+    if last_id is not None:
+        messages = messages.filter(id__gt=last_id)
+    return messages.order_by('id')
+
+
+def _set_validators(response, etag, version):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(versions.last_modified(version).timestamp())
+
+
+def _updates_last_modified(request):
+    try:
+        peer_id = int(request.GET.get('user_id'))
+    except (TypeError, ValueError):
+        return None
+    return versions.last_modified(versions.conversation_version(request.user, peer_id))
+
+
 @login_required
+@cache_control(private=True, no_cache=True)
+@_long_poll
+@condition(etag_func=_updates_etag, last_modified_func=_updates_last_modified)
 def get_message_updates(request):
+    """
+    Messages after ``last_id``. With ``wait=<seconds>`` and the ETag of the
+    previous response in If-None-Match, the request is held until something
+    changes (new messages, read state, typing) or the time is up.
+    """
     try:
         user_id = request.GET.get('user_id')
         last_id = request.GET.get('last_id')
         
         if not user_id:
             return JsonResponse({'error': 'user_id parameter is required'}, status=400)
+        try:
+            last_id = int(last_id) if last_id else None
+        except ValueError:
+            return JsonResponse({'error': 'Invalid last_id'}, status=400)
             
         other_user = User.objects.get(id=user_id)
         
-        # Base query
-        messages = Message.objects.filter(
-            Q(sender=request.user, recipient=other_user) |
-            Q(sender=other_user, recipient=request.user)
-        )
-        
-        # Filter messages after last_id if provided
-        if last_id:
-            messages = messages.filter(id__gt=last_id)
-        
-        messages = messages.order_by('timestamp')
-        
-        # Mark messages as read
-        Message.objects.filter(
-            sender=other_user,
-            recipient=request.user,
-            is_read=False
-        ).update(is_read=True)
-
-        messages_data = [{
-            'id': message.id,
-            'sender_id': message.sender.id,
-            'content': message.content,
-            'timestamp': message.timestamp.isoformat(),
-            'is_read': message.is_read,
-            'is_me': message.sender == request.user
-        } for message in messages]
+        conversation = Conversation.objects.between(request.user, other_user).first()
+        messages = Message.objects.none()
+        if conversation:
+            # Mark messages as read
+            _mark_read(request.user, conversation)
+            messages = _updates_query(conversation, last_id)
 
-        return JsonResponse({
-            'messages': messages_data,
-            'other_user': {
-                'id': other_user.id,
-                'username': other_user.username,
-                'full_name': other_user.get_full_name(),
-            }
-        })
+        # Stream row by row, this may be the whole history
+        response = stream_messages(
+            messages,
+            MessageSerializer(request.user, conversation),
+            _updates_payload(request.user, other_user, conversation),
+        )
+        # Validators for the state after marking read, so the next poll gets a 304
+        version = versions.conversation_version(request.user, other_user)
+        typing = typing_state.is_typing(other_user.id, request.user.id)
+        etag = _conversation_etag(request.user.id, other_user.id, _next_last_id(conversation, last_id), version, typing)
+        _set_validators(response, etag, version)
+        return response
         
     except User.DoesNotExist:
         return JsonResponse({'error': 'User not found'}, status=404)
@@ -289,11 +611,25 @@ def get_message_updates(request):
 def delete_conversation(request, user_id):
     try:
         other_user = User.objects.get(id=user_id)
-        # Delete messages both ways
-        Message.objects.filter(
-            Q(sender=request.user, recipient=other_user) |
-            Q(sender=other_user, recipient=request.user)
-        ).delete()
+        # Deleting the conversation takes its messages with it
+        conversation = Conversation.objects.between(request.user, other_user).first()
+        if conversation:
+            with transaction.atomic():
+                # Locked before the stats rows, like the message writes, and
+                # the counters moved by what the row holds now
+                try:
+                    conversation._lock()
+                except Conversation.DoesNotExist:
+                    return JsonResponse({'status': 'success'})
+                unread.remove_unread(request.user, conversation.unread_for(request.user))
+                unread.remove_unread(other_user, conversation.unread_for(other_user))
+                message_count = conversation.messages.count()
+                MessageSearchTerm.objects.filter(conversation=conversation).delete()
+                conversation.delete()
+                versions.touch_conversation(conversation)
+                UserStats.remove_conversation(conversation, message_count)
+                ChangeLog.record_conversation_deleted(conversation)
+                notify_on_commit(conversation.user_low_id, conversation.user_high_id)
         
         return JsonResponse({'status': 'success'})
     except User.DoesNotExist:
@@ -304,25 +640,193 @@ def delete_conversation(request, user_id):
 def mark_as_unread(request, user_id):
     try:
         other_user = User.objects.get(id=user_id)
-        # Mark all messages as unread
-        Message.objects.filter(
-            sender=other_user,
-            recipient=request.user
-        ).update(is_read=False)
+        # Mark all messages as unread by resetting the read watermark
+        conversation = Conversation.objects.between(request.user, other_user).first()
+        if conversation:
+            with transaction.atomic():
+                unread.add_unread(request.user, conversation.mark_unread(request.user))
+                versions.touch_conversation(conversation)
+                ChangeLog.record_read(conversation, request.user)
+                notify_on_commit(request.user.id, other_user.id)
         
         return JsonResponse({'status': 'success'})
     except User.DoesNotExist:
         return JsonResponse({'error': 'User not found'}, status=404)
 
+
+def _group_not_found():
+    return JsonResponse({'error': 'Group not found', 'status': 404}, status=404)
+
+
+@login_required
+@read_replica
+def group_list(request):
+    """The user's groups, most recently active first, with their unread counts."""
+    records = [groups.group_record(member) for member in groups.memberships(request.user)]
+    return JsonResponse({
+        'groups': records,
+        'unread_total': sum(record['unread_count'] for record in records),
+    })
+
+
+@login_required
+@require_http_methods(["POST"])
+def create_group(request):
+    try:
+        data = json.loads(request.body.decode('utf-8'))
+        member_ids = {int(user_id) for user_id in data.get('member_ids', [])}
+    except (json.JSONDecodeError, AttributeError, TypeError, ValueError):
+        return JsonResponse({'status': 'error', 'message': 'Invalid JSON data'}, status=400)
+    try:
+        group = groups.create(request.user, data.get('name'), member_ids)
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    return JsonResponse({
+        'status': 'success',
+        'group': groups.group_record(groups.membership(request.user, group.id)),
+    }, status=201)
+
+
+@login_required
+@read_replica
+def get_group_messages(request, group_id):
+    member = groups.membership(request.user, group_id)
+    if member is None:
+        return _group_not_found()
+    try:
+        before_id, limit = _page_params(request)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid pagination parameters'}, status=400)
+
+    # Opening the group moves the read watermark to its end
+    if before_id is None and groups.mark_read(member.group, request.user):
+        # The count was taken along with the group, so nothing in it is unread now
+        member.last_read, member.unread_count = member.group.last_message_id, 0
+    rows = list(groups.page_query(member.group, before_id, limit))
+    has_more = len(rows) > limit
+    rows = rows[:limit][::-1]
+    return JsonResponse({
+        'messages': [groups.group_message_record(row) for row in rows],
+        'has_more': has_more,
+        'next_before_id': rows[0]['id'] if has_more else None,
+        'group': groups.group_record(member),
+    })
+
+
+@login_required
+@require_http_methods(["POST"])
+def send_group_message(request, group_id):
+    member = groups.membership(request.user, group_id)
+    if member is None:
+        return _group_not_found()
+    try:
+        data = json.loads(request.body.decode('utf-8'))
+        content = data.get('content', '').strip()
+    except (json.JSONDecodeError, AttributeError):
+        return JsonResponse({'status': 'error', 'message': 'Invalid JSON data'}, status=400)
+    if not content:
+        return JsonResponse({'status': 'error', 'message': 'Message cannot be empty'}, status=400)
+
+    message = groups.send(member.group, request.user, content)
+    return _message_sent(message, data)
+
+
+@login_required
+@require_http_methods(["POST"])
+def mark_group_read(request, group_id):
+    """Move the read watermark to ``up_to`` (the newest message shown), or to the end."""
+    member = groups.membership(request.user, group_id)
+    if member is None:
+        return _group_not_found()
+    try:
+        data = json.loads(request.body or '{}')
+        up_to = int(data['up_to']) if data.get('up_to') is not None else None
+    except (ValueError, TypeError, AttributeError):
+        return JsonResponse({'status': 'error', 'message': 'Invalid up_to'}, status=400)
+
+    groups.mark_read(member.group, request.user, up_to)
+    return JsonResponse({'status': 'success'})
+
+
+@login_required
+@read_replica
+def group_members(request, group_id):
+    if groups.membership(request.user, group_id) is None:
+        return _group_not_found()
+    members = GroupMember.objects.filter(group_id=group_id).select_related('user').order_by('joined_at', 'id')
+    return JsonResponse({'members': [_peer_record(member.user) for member in members]})
+
+
+@login_required
+@require_http_methods(["POST"])
+def add_group_members(request, group_id):
+    member = groups.membership(request.user, group_id)
+    if member is None:
+        return _group_not_found()
+    if member.group.owner_id != request.user.id:
+        return JsonResponse({'status': 'error', 'message': 'Only the group owner can add members'}, status=403)
+    try:
+        user_ids = {int(user_id) for user_id in json.loads(request.body.decode('utf-8'))['user_ids']}
+    except (json.JSONDecodeError, KeyError, TypeError, ValueError):
+        return JsonResponse({'status': 'error', 'message': 'Invalid JSON data'}, status=400)
+    try:
+        added = groups.add_members(member.group, user_ids)
+    except ValueError as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+    return JsonResponse({'status': 'success', 'added': added})
+
+
+@login_required
+@require_http_methods(["POST"])
+def leave_group(request, group_id):
+    member = groups.membership(request.user, group_id)
+    if member is None:
+        return _group_not_found()
+    groups.leave(member.group, request.user)
+    return JsonResponse({'status': 'success'})
+
+
+@login_required
+@require_http_methods(["POST"])
+def presence_heartbeat(request):
+    """
+    Heartbeat from the chat page, answered with the presence of ``user_ids``
+    (the sidebar contacts) so both take a single round trip.
+    """
+    try:
+        data = json.loads(request.body or '{}')
+        user_ids = {int(user_id) for user_id in data.get('user_ids', [])}
+    except (json.JSONDecodeError, AttributeError, TypeError, ValueError):
+        return JsonResponse({'status': 'error', 'message': 'Invalid JSON data'}, status=400)
+    if len(user_ids) > presence.PRESENCE_MAX_USERS:
+        return JsonResponse({
+            'status': 'error',
+            'message': f'Ask for at most {presence.PRESENCE_MAX_USERS} users',
+        }, status=400)
+
+    presence.heartbeat(request.user)
+    return JsonResponse({
+        'presence': presence.presence(user_ids),
+        'heartbeat_seconds': presence.PRESENCE_HEARTBEAT_SECONDS,
+    })
+
+
+@login_required
+def presence_metrics(request):
+    """Heartbeat buffer and flush figures of the worker that serves the request."""
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Forbidden'}, status=403)
+    return JsonResponse(presence.metrics())
+
+
 @login_required
 def view_recipient_profile(request, user_id):
     
     recipient = get_object_or_404(User, id=user_id)
     
-    conversation_messages = Message.objects.filter(
-        Q(sender=request.user, recipient=recipient) |
-        Q(sender=recipient, recipient=request.user)
-    ).order_by('-timestamp')[:5]  # Last 5 messages
+    conversation_messages = Message.objects.between(
+        request.user, recipient
+    ).order_by('-id')[:5]  # Last 5 messages
     
     context = {
         'recipient': recipient,
@@ -330,4 +834,45 @@ def view_recipient_profile(request, user_id):
         'total_messages': conversation_messages.count(),
     }
     
-    return render(request, 'dashboard/chat/profile.html', context)
\ No newline at end of file
+    return render(request, 'dashboard/chat/profile.html', context)
+
+
+@login_required
+async def event_stream(request):
+    # Long-lived streams need an ASGI server; under WSGI each one would pin a
+    # worker thread, so tell the client to stay on polling instead. A 204
+    # also stops EventSource from reconnecting.
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+
+    user = await request.auser()
+    queue = broker.subscribe(user.id)
+    response = StreamingHttpResponse(
+        _event_stream(user.id, queue),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+async def _event_stream(user_id, queue):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + STREAM_MAX_SECONDS
+    try:
+        yield f"retry: {STREAM_RETRY_MS}\n\n"
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                event = await asyncio.wait_for(
+                    queue.get(),
+                    timeout=min(STREAM_KEEPALIVE_SECONDS, remaining)
+                )
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            yield format_sse(event)
+    finally:
+        broker.unsubscribe(user_id, queue)
@@ -0,0 +1,73 @@
+from django.contrib.auth import get_user_model
+from django.db.models import OuterRef, Q, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from chat.models import UserSearchToken, _pk
+
+from .models import Contact
+
+User = get_user_model()
+
+# Directory page size, see page()
+DIRECTORY_PAGE_SIZE = 20
+DIRECTORY_MAX_PAGE_SIZE = 100
+
+
+def _contact_status(user):
+    if 'accepted' in (user.sent_status, user.received_status):
+        return 'contact'
+    if user.sent_status == 'pending':
+        return 'request_sent'
+    if user.received_status == 'pending':
+        return 'request_received'
+    if 'rejected' in (user.sent_status, user.received_status):
+        return 'rejected'
+    return None
+
+
+def _directory_record(user):
+    profile = getattr(user, 'profile', None)
+    return {
+        'id': user.id,
+        'username': user.username,
+        'full_name': user.get_full_name(),
+        'email': user.email,
+        # Rows are 40px wide
+        'avatar_url': profile.avatar_small_url if profile else None,
+        'contact_status': _contact_status(user),
+    }
+
+
+def page(viewer, query='', after=None, limit=DIRECTORY_PAGE_SIZE, exclude_contacts=False):
+    """
+    One page of the user directory as seen by ``viewer``, in id order.
+
+    Pages are keyed on the last id shown (``next_after``), words of
+    ``query`` are matched as prefixes through ``UserSearchToken``, and the
+    viewer's contact status with each user is annotated, all in a single
+    query.
+    """
+    viewer_id = _pk(viewer)
+    sent = Contact.objects.filter(requester_id=viewer_id, recipient_id=OuterRef('pk'))
+    received = Contact.objects.filter(requester_id=OuterRef('pk'), recipient_id=viewer_id)
+    # Coalesced, a NULL would make the exclude below drop strangers too
+    users = User.objects.exclude(id=viewer_id).select_related('profile').annotate(
+        sent_status=Coalesce(Subquery(sent.values('status')[:1]), Value('')),
+        received_status=Coalesce(Subquery(received.values('status')[:1]), Value('')),
+    )
+
+    for word in set(UserSearchToken.words(query)):
+        users = users.filter(id__in=UserSearchToken.objects.filter(token=word).values('user_id'))
+    if exclude_contacts:
+        users = users.exclude(Q(sent_status='accepted') | Q(received_status='accepted'))
+    if after is not None:
+        users = users.filter(id__gt=after)
+
+    rows = list(users.order_by('id')[:limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        'users': [_directory_record(user) for user in rows],
+        'has_more': has_more,
+        'next_after': rows[-1].id if has_more else None,
+    }
@@ -0,0 +1,75 @@
+from django.core.cache import cache
+from django.db import models, transaction
+
+from chat.models import _pk
+
+from .models import Contact
+
+
+# Entries are invalidated explicitly whenever a contact relationship or a
+# contact's profile changes; the timeout is only a safety net.
+CONTACT_GRAPH_TIMEOUT = 60 * 60
+
+
+def _key(user_id):
+    return f'contacts:graph:{user_id}'
+
+
+def avatar_url(user):
+    # Lists render avatars at most 80px wide, the 128px variant covers retina screens
+    profile = getattr(user, 'profile', None)
+    if profile is None:
+        return None
+    return profile.avatar_medium_url
+
+
+def _user_record(user):
+    return {
+        'id': user.id,
+        'username': user.username,
+        'full_name': user.get_full_name(),
+        'email': user.email,
+        'is_staff': user.is_staff,
+        'avatar_url': avatar_url(user),
+    }
+
+
+def _load(user_id):
+    contacts = Contact.objects.filter(
+        (models.Q(requester_id=user_id) | models.Q(recipient_id=user_id)),
+        status='accepted'
+    ).select_related('requester__profile', 'recipient__profile')
+
+    users = []
+    for contact in contacts:
+        other = contact.recipient if contact.requester_id == user_id else contact.requester
+        users.append(_user_record(other))
+    return {'ids': frozenset(user['id'] for user in users), 'users': users}
+
+
+def _graph(user):
+    user_id = _pk(user)
+    graph = cache.get(_key(user_id))
+    if graph is None:
+        graph = _load(user_id)
+        cache.set(_key(user_id), graph, CONTACT_GRAPH_TIMEOUT)
+    return graph
+
+
+def contact_users(user):
+    """Lightweight records (id, username, full_name, email, is_staff, avatar_url) of accepted contacts."""
+    return _graph(user)['users']
+
+
+def contact_ids(user):
+    return _graph(user)['ids']
+
+
+def is_contact(user, other):
+    return _pk(other) in contact_ids(user)
+
+
+def invalidate(*users):
+    keys = [_key(_pk(user)) for user in users]
+    # Drop the entries once the change is visible to the next reload
+    transaction.on_commit(lambda: cache.delete_many(keys))
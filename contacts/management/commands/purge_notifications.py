@@ -0,0 +1,44 @@
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from chat import versions
+from chat.models import UserStats
+from contacts.models import Notification
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete notifications older than --days. Unread ones that are purged '
+        'are taken off their owners\' unread counters.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90)
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        purged = 0
+        while True:
+            with transaction.atomic():
+                # Small batches keep each delete's locks short on a busy table.
+                # Locked, so a concurrent mark-read can't change what we count.
+                batch = list(Notification.objects.select_for_update().filter(
+                    created_at__lt=cutoff
+                ).values_list('id', 'user_id', 'is_read')[:options['batch_size']])
+                if not batch:
+                    break
+                unread = Counter(user_id for _, user_id, is_read in batch if not is_read)
+                by_count = defaultdict(list)
+                for user_id, count in unread.items():
+                    by_count[count].append(user_id)
+                purged += Notification.objects.filter(id__in=[row[0] for row in batch]).delete()[0]
+                for count, user_ids in by_count.items():
+                    UserStats.adjust_notifications(user_ids, -count)
+                versions.touch_contacts(*unread)
+
+        self.stdout.write(self.style.SUCCESS(f'Purged {purged} notifications'))
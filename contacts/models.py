@@ -29,5 +29,11 @@ class Notification(models.Model):
     is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Unread counts and mark-read for one user, and the retention purge
+            models.Index(fields=['user', 'is_read', 'created_at']),
+        ]
+
     def __str__(self):
         return f"{self.user.username}: {self.message}"
\ No newline at end of file
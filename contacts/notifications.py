@@ -0,0 +1,108 @@
+from collections import Counter, defaultdict
+
+from django.db import transaction
+
+from chat import versions
+from chat.models import UserStats, _pk
+
+from .models import Notification
+
+# Feed page size, see feed()
+FEED_PAGE_SIZE = 20
+FEED_MAX_PAGE_SIZE = 100
+
+
+def notification_record(notification):
+    return {
+        'id': notification.id,
+        'message': notification.message,
+        'contact_request_id': notification.contact_request_id,
+        'is_read': notification.is_read,
+        'created_at': notification.created_at.isoformat(),
+    }
+
+
+class NotificationWriter:
+    """
+    Collects notifications and writes them together when the ``with`` block
+    ends (or on ``flush()``): one ``bulk_create``, and one counter update
+    per distinct number of notifications a recipient got, so notifying a
+    thousand users costs the same handful of queries as notifying one.
+    """
+
+    def __init__(self):
+        self._pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+        else:
+            self._pending = []
+
+    def add(self, user, message, contact_request=None):
+        self._pending.append(Notification(user_id=_pk(user), message=message, contact_request=contact_request))
+
+    def flush(self):
+        pending, self._pending = self._pending, []
+        if not pending:
+            return []
+        recipients = Counter(notification.user_id for notification in pending)
+        by_count = defaultdict(list)
+        for user_id, count in recipients.items():
+            by_count[count].append(user_id)
+        with transaction.atomic():
+            created = Notification.objects.bulk_create(pending)
+            for count, user_ids in by_count.items():
+                UserStats.adjust_notifications(user_ids, count)
+            versions.touch_contacts(*recipients)
+        return created
+
+
+def notify(user, message, contact_request=None):
+    with NotificationWriter() as writer:
+        writer.add(user, message, contact_request)
+
+
+def unread_count(user):
+    return UserStats.for_user(user).unread_notifications
+
+
+def feed(user, before_id=None, limit=FEED_PAGE_SIZE, unread_only=False):
+    """
+    One page of ``user``'s notifications, newest first. Pages are keyed on
+    the id of the last one shown (``next_before_id``), so each page is an
+    index range scan however deep the client has scrolled.
+    """
+    notifications = Notification.objects.filter(user_id=_pk(user))
+    if unread_only:
+        notifications = notifications.filter(is_read=False)
+    if before_id is not None:
+        notifications = notifications.filter(id__lt=before_id)
+    page = list(notifications.order_by('-id')[:limit + 1])
+    has_more = len(page) > limit
+    page = page[:limit]
+    return {
+        'notifications': [notification_record(notification) for notification in page],
+        'has_more': has_more,
+        'next_before_id': page[-1].id if has_more else None,
+        'unread_count': unread_count(user),
+    }
+
+
+def mark_read(user, up_to=None):
+    """
+    Mark ``user``'s notifications read up to id ``up_to`` (all of them
+    without it) with one update. Returns how many became read.
+    """
+    notifications = Notification.objects.filter(user_id=_pk(user), is_read=False)
+    if up_to is not None:
+        notifications = notifications.filter(id__lte=up_to)
+    with transaction.atomic():
+        read = notifications.update(is_read=True)
+        if read:
+            UserStats.adjust_notifications([_pk(user)], -read)
+            versions.touch_contacts(user)
+    return read
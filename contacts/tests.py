@@ -1,3 +1,123 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
 from django.test import TestCase
+from django.utils import timezone
+
+from chat.models import UserStats
+
+from . import directory, notifications
+from .models import Contact, Notification
+
+User = get_user_model()
+
+
+class NotificationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice, self.bob, self.carol = [
+            User.objects.create_user(name, password='pw123456') for name in ('alice', 'bob', 'carol')
+        ]
+        for user in (self.alice, self.bob, self.carol):
+            UserStats.for_user(user)
+
+    def unread(self, user):
+        return UserStats.objects.get(user=user).unread_notifications
+
+    def test_writer_batches(self):
+        # A savepoint, one insert, and a counter update per distinct count:
+        # alice got two, bob and carol one
+        with self.assertNumQueries(5), notifications.NotificationWriter() as writer:
+            for user in (self.alice, self.alice, self.bob, self.carol):
+                writer.add(user, 'hello')
+        self.assertEqual(Notification.objects.count(), 4)
+        self.assertEqual([self.unread(user) for user in (self.alice, self.bob, self.carol)], [2, 1, 1])
+
+    def test_writer_drops_pending_on_error(self):
+        with self.assertRaises(RuntimeError), notifications.NotificationWriter() as writer:
+            writer.add(self.alice, 'hello')
+            raise RuntimeError
+        self.assertFalse(Notification.objects.exists())
+        self.assertEqual(self.unread(self.alice), 0)
+
+    def test_mark_read_up_to(self):
+        with notifications.NotificationWriter() as writer:
+            for message in ('one', 'two', 'three'):
+                writer.add(self.alice, message)
+        first, second, third = Notification.objects.order_by('id')
+
+        self.assertEqual(notifications.mark_read(self.alice, up_to=second.id), 2)
+        self.assertEqual(self.unread(self.alice), 1)
+        self.assertEqual(notifications.mark_read(self.alice, up_to=second.id), 0)
+        self.assertEqual(
+            list(Notification.objects.filter(is_read=False).values_list('id', flat=True)), [third.id]
+        )
+        self.assertEqual(notifications.mark_read(self.alice), 1)
+        self.assertEqual(self.unread(self.alice), 0)
+
+    def test_feed_pages(self):
+        with notifications.NotificationWriter() as writer:
+            for message in ('one', 'two', 'three'):
+                writer.add(self.alice, message)
+        page = notifications.feed(self.alice, limit=2)
+        self.assertEqual([n['message'] for n in page['notifications']], ['three', 'two'])
+        self.assertTrue(page['has_more'])
+        page = notifications.feed(self.alice, before_id=page['next_before_id'], limit=2)
+        self.assertEqual([n['message'] for n in page['notifications']], ['one'])
+        self.assertFalse(page['has_more'])
+        self.assertEqual(page['unread_count'], 3)
+
+    def test_purge_takes_unread_off_the_counters(self):
+        with notifications.NotificationWriter() as writer:
+            for user in (self.alice, self.alice, self.bob):
+                writer.add(user, 'old')
+            writer.add(self.bob, 'new')
+        notifications.mark_read(self.alice, up_to=Notification.objects.filter(user=self.alice).order_by('id')[0].id)
+        Notification.objects.filter(message='old').update(created_at=timezone.now() - timedelta(days=100))
+
+        call_command('purge_notifications', days=90, batch_size=2, stdout=StringIO())
+        self.assertEqual(list(Notification.objects.values_list('message', flat=True)), ['new'])
+        self.assertEqual((self.unread(self.alice), self.unread(self.bob)), (0, 1))
+
+
+class DirectoryTests(TestCase):
+    def setUp(self):
+        self.alice, self.bob, self.carl, self.carol, self.dave = [
+            User.objects.create_user(name, password='pw123456') for name in ('alice', 'bob', 'carl', 'carol', 'dave')
+        ]
+        Contact.objects.create(requester=self.alice, recipient=self.bob, status='accepted')
+        Contact.objects.create(requester=self.alice, recipient=self.carl, status='pending')
+        Contact.objects.create(requester=self.carol, recipient=self.alice, status='pending')
+
+    def ids(self, page):
+        return [user['id'] for user in page['users']]
+
+    def test_keyset_pages_with_contact_status(self):
+        with self.assertNumQueries(1):
+            first = directory.page(self.alice, limit=2)
+        self.assertEqual(self.ids(first), [self.bob.id, self.carl.id])
+        self.assertEqual([user['contact_status'] for user in first['users']], ['contact', 'request_sent'])
+        self.assertEqual(first['next_after'], self.carl.id)
+
+        second = directory.page(self.alice, after=first['next_after'], limit=2)
+        self.assertEqual(self.ids(second), [self.carol.id, self.dave.id])
+        self.assertEqual([user['contact_status'] for user in second['users']], ['request_received', None])
+        self.assertFalse(second['has_more'])
+        self.assertIsNone(second['next_after'])
+
+    def test_prefix_search(self):
+        self.assertEqual(self.ids(directory.page(self.alice, 'car')), [self.carl.id, self.carol.id])
+        self.assertEqual(self.ids(directory.page(self.alice, 'ali')), [])
 
-# Create your tests here.
+    def test_exclude_contacts(self):
+        # Pending and unrelated users stay, accepted contacts go, from both sides
+        self.assertEqual(
+            self.ids(directory.page(self.alice, exclude_contacts=True)),
+            [self.carl.id, self.carol.id, self.dave.id],
+        )
+        self.assertEqual(self.ids(directory.page(self.bob, exclude_contacts=True)), [self.carl.id, self.carol.id, self.dave.id])
+        page = directory.page(self.alice, after=self.bob.id, limit=1, exclude_contacts=True)
+        self.assertEqual((self.ids(page), page['has_more']), ([self.carl.id], True))
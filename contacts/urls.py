@@ -6,4 +6,8 @@ urlpatterns = [
     path('add/', views.add_contact, name='add_contact'),
     path('respond/', views.respond_to_request, name='respond_to_request'),
     path('remove/', views.remove_contact, name='remove_contact'),
+    path('directory/', views.user_directory, name='user_directory'),
+    path('notifications/', views.notification_feed, name='notification_feed'),
+    path('notifications/unread/', views.notification_unread_count, name='notification_unread_count'),
+    path('notifications/read/', views.mark_notifications_read, name='mark_notifications_read'),
 ]
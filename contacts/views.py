@@ -1,9 +1,14 @@
 from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse
 from django.shortcuts import render, get_object_or_404
-from django.views.decorators.http import require_http_methods
+from django.views.decorators.http import require_http_methods, condition
+from django.views.decorators.cache import cache_control
 from django.contrib.auth import get_user_model
-from .models import Contact, Notification
+from .models import Contact
+from . import directory, graph, notifications
+from chat import versions
+from chat.models import ChangeLog
+from ChatApp.routers import read_replica
 from django.template.loader import render_to_string
 from django.db import models
 import json
@@ -12,19 +17,8 @@ User = get_user_model()
 
 @login_required
 def contact_list_view(request):
-    # Show contacts where user is either requester or recipient and status is accepted
-    contacts = Contact.objects.filter(
-        (models.Q(requester=request.user) | models.Q(recipient=request.user)),
-        status='accepted'
-    ).select_related('requester', 'recipient')
-    
-    # Get the other user for each contact
-    contact_users = []
-    for contact in contacts:
-        if contact.requester == request.user:
-            contact_users.append(contact.recipient)
-        else:
-            contact_users.append(contact.requester)
+    # Accepted contacts come from the cached contact graph
+    contact_users = graph.contact_users(request.user)
     
     # Show pending requests received
     pending_requests = Contact.objects.filter(
@@ -32,17 +26,30 @@ def contact_list_view(request):
         status='pending'
     ).select_related('requester')
     
-    all_users = User.objects.exclude(id=request.user.id)
-    contact_user_ids = [user.id for user in contact_users]
-    
+    # Users to add are fetched page by page from user_directory
     return render(request, 'dashboard/contacts/contact_list.html', {
-        'contacts': contacts,
         'contact_users': contact_users,
         'pending_requests': pending_requests,
-        'all_users': all_users,
-        'contact_user_ids': contact_user_ids,
     })
 
+@login_required
+@read_replica
+def user_directory(request):
+    try:
+        after = int(request.GET['after']) if request.GET.get('after') else None
+        limit = int(request.GET.get('limit', directory.DIRECTORY_PAGE_SIZE))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid pagination parameters'}, status=400)
+    limit = max(1, min(limit, directory.DIRECTORY_MAX_PAGE_SIZE))
+
+    return JsonResponse(directory.page(
+        request.user,
+        query=request.GET.get('q', '').strip(),
+        after=after,
+        limit=limit,
+        exclude_contacts=request.GET.get('exclude_contacts') in ('1', 'true'),
+    ))
+
 @login_required
 @require_http_methods(["POST"])
 def add_contact(request):
@@ -83,11 +90,13 @@ def add_contact(request):
         )
         
         # Create notification for the recipient
-        Notification.objects.create(
-            user=contact_user,
-            message=f"{request.user.username} sent you a contact request",
+        notifications.notify(
+            contact_user,
+            f"{request.user.username} sent you a contact request",
             contact_request=contact
         )
+        versions.touch_contacts(request.user, contact_user)
+        ChangeLog.record_contacts(request.user, contact_user, 'request')
         
         return JsonResponse({
             'status': 'success',
@@ -120,9 +129,9 @@ def respond_to_request(request):
             message = 'Contact request accepted'
             
             # Create notification for the sender
-            Notification.objects.create(
-                user=contact_request.requester,
-                message=f"{request.user.username} accepted your contact request"
+            notifications.notify(
+                contact_request.requester_id,
+                f"{request.user.username} accepted your contact request"
             )
             
         elif action == 'reject':
@@ -132,6 +141,11 @@ def respond_to_request(request):
             return JsonResponse({'status': 'error', 'message': 'Invalid action'}, status=400)
         
         contact_request.save()
+        if action == 'accept':
+            # After the save, or a reload in between caches the old graph
+            graph.invalidate(request.user, contact_request.requester_id)
+        versions.touch_contacts(request.user, contact_request.requester_id)
+        ChangeLog.record_contacts(request.user, contact_request.requester_id, contact_request.status)
         
         return JsonResponse({
             'status': 'success',
@@ -161,6 +175,9 @@ def remove_contact(request):
              models.Q(requester=contact_user, recipient=request.user)),
             status='accepted'
         ).delete()
+        graph.invalidate(request.user, contact_user)
+        versions.touch_contacts(request.user, contact_user)
+        ChangeLog.record_contacts(request.user, contact_user, 'removed')
         
         return JsonResponse({
             'status': 'success',
@@ -168,4 +185,46 @@ def remove_contact(request):
         })
         
     except Exception as e:
-        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
\ No newline at end of file
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+
+def _notifications_etag(request):
+    return versions.etag('n', request.user.id, versions.contacts_version(request.user))
+
+
+@login_required
+def notification_feed(request):
+    try:
+        before_id = int(request.GET['before_id']) if request.GET.get('before_id') else None
+        limit = int(request.GET.get('limit', notifications.FEED_PAGE_SIZE))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid pagination parameters'}, status=400)
+    limit = max(1, min(limit, notifications.FEED_MAX_PAGE_SIZE))
+    unread_only = request.GET.get('unread') in ('1', 'true')
+
+    return JsonResponse(notifications.feed(request.user, before_id, limit, unread_only))
+
+
+@login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_notifications_etag)
+def notification_unread_count(request):
+    return JsonResponse({'unread_count': notifications.unread_count(request.user)})
+
+
+@login_required
+@require_http_methods(["POST"])
+def mark_notifications_read(request):
+    """Mark notifications read up to ``up_to`` (the newest one shown), or all of them."""
+    try:
+        data = json.loads(request.body or '{}')
+        up_to = int(data['up_to']) if data.get('up_to') is not None else None
+    except (ValueError, TypeError, AttributeError):
+        return JsonResponse({'status': 'error', 'message': 'Invalid up_to'}, status=400)
+
+    read = notifications.mark_read(request.user, up_to)
+    return JsonResponse({
+        'status': 'success',
+        'read': read,
+        'unread_count': notifications.unread_count(request.user),
+    })
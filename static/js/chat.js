@@ -57,11 +57,38 @@ document.addEventListener("DOMContentLoaded", function () {
   let currentChatUserId = null;
   let isTyping = false;
   let typingTimeout = null;
+  let lastTypingSentAt = 0;
   let messageUpdateInterval = null;
+  let updatesController = null; // Long poll of the open conversation, see pollUpdates
+  let updatesEtag = null;
   let lastMessageId = null;
+  let isSyncing = false;
+  let eventSource = null; // Push channel, polling is only used as a fallback
+  let pushConnected = false;
+  let pushSyncInterval = null; // Slow sync tick kept while push is connected
+  let typingHideTimeout = null;
+  let oldestMessageId = null; // Cursor for loading older history
+  let hasOlderMessages = false;
+  let isLoadingOlder = false;
+  let lastScrollTop = 0;
   const pendingMessages = new Map(); // For tracking temporary messages
   let isSending = false; // Flag to prevent duplicate sends
 
+  // Change log position and the recently opened conversations, so that
+  // switching chats, reconnecting and restoring the tab only fetch what
+  // changed (see catchUp)
+  const chatState = JSON.parse(document.getElementById("chat-state").textContent);
+  const STATE_STORAGE_KEY = `chat-state:${chatState.user_id}`;
+  const CACHED_MESSAGES_LIMIT = 200;
+  const LONG_POLL_SECONDS = 25;
+  // The push broker is per server process, so events published by another
+  // worker never reach our stream; a slow sync picks those up
+  const PUSH_SYNC_INTERVAL = 60000;
+  let changeSeq = chatState.change_seq;
+  let isCatchingUp = false;
+  // Peer id -> {otherUser, messages, oldestMessageId, hasOlderMessages, readUpTo}
+  const conversationCache = new Map();
+
   // New message modal
   newMessageBtn.addEventListener("click", function () {
     newMessageModal.classList.remove("hidden");
@@ -112,7 +139,7 @@ document.addEventListener("DOMContentLoaded", function () {
 
         loadingIndicator.classList.remove("hidden");
 
-        fetch(`/chat/search-users/?q=${encodeURIComponent(query)}`)
+        fetch(`search-users/?q=${encodeURIComponent(query)}`)
           .then((response) => response.json())
           .then((data) => {
             const userItems = document.querySelectorAll(".user-item");
@@ -365,8 +392,10 @@ document.addEventListener("DOMContentLoaded", function () {
 
   // Typing indicator
   messageInput.addEventListener("input", function () {
-    if (!isTyping && currentChatUserId) {
+    // Typing state expires on the server, so refresh it while typing goes on
+    if (currentChatUserId && (!isTyping || Date.now() - lastTypingSentAt > 3000)) {
       isTyping = true;
+      lastTypingSentAt = Date.now();
       sendTypingIndicator(true);
     }
 
@@ -393,24 +422,6 @@ document.addEventListener("DOMContentLoaded", function () {
     });
   }
 
-  // Check for typing indicators
-  function checkTypingIndicators() {
-    if (currentChatUserId) {
-      fetch(`typing-status/?user_id=${currentChatUserId}`)
-        .then((response) => response.json())
-        .then((data) => {
-          if (data.is_typing) {
-            showTypingIndicator();
-          } else {
-            hideTypingIndicator();
-          }
-        })
-        .catch((error) => {
-          console.error("Error checking typing status:", error);
-        });
-    }
-  }
-
   function showTypingIndicator() {
     let typingIndicator = document.getElementById("typing-indicator");
     if (!typingIndicator) {
@@ -440,6 +451,18 @@ document.addEventListener("DOMContentLoaded", function () {
 
   // Fetch messages for a user
   function fetchMessages(userId) {
+    hasOlderMessages = false;
+    oldestMessageId = null;
+
+    // Kept up to date through the change log; show it straight away and
+    // apply whatever the log has that has not reached us yet
+    const cached = conversationCache.get(String(userId));
+    if (cached) {
+      showConversation(cached);
+      catchUp();
+      return;
+    }
+
     // Show loading state
     messagesContainer.innerHTML = `
         <div class="text-center py-8">
@@ -460,32 +483,17 @@ document.addEventListener("DOMContentLoaded", function () {
                 throw new Error(data.error);
             }
 
-            currentChatUserId = data.other_user.id;
-            const displayName = data.other_user.full_name || data.other_user.username;
-            chatUserName.textContent = displayName;
-            
-            // Safe avatar handling - use real avatar if available, otherwise fallback
-            const avatarUrl = data.other_user.profile?.avatar || 
-                `https://ui-avatars.com/api/?name=${encodeURIComponent(displayName)}&background=random&color=fff`;
-            chatUserAvatar.src = avatarUrl;
-            
-            // Add error handling in case the avatar fails to load
-            chatUserAvatar.onerror = () => {
-                chatUserAvatar.src = `https://ui-avatars.com/api/?name=${encodeURIComponent(displayName)}&background=random&color=fff`;
-                chatUserAvatar.onerror = null; // Prevent infinite loop
+            // Opening the conversation marked everything in it as read
+            const incoming = data.messages.filter((message) => !message.is_me);
+            const conversation = {
+                otherUser: data.other_user,
+                messages: data.messages.slice(),
+                oldestMessageId: data.next_before_id,
+                hasOlderMessages: data.has_more,
+                readUpTo: incoming.length ? incoming[incoming.length - 1].id : 0,
             };
-            
-            chatUserName.href = `profile/${data.other_user.id}/`;
-
-            renderMessages(data.messages);
-
-            // Update last message ID
-            if (data.messages.length > 0) {
-                lastMessageId = data.messages[data.messages.length - 1].id;
-            }
-
-            // Start checking for new messages
-            startMessageUpdates();
+            conversationCache.set(String(data.other_user.id), conversation);
+            showConversation(conversation);
           })
           .catch((error) => {
               console.error("Fetch error:", error);
@@ -505,6 +513,192 @@ document.addEventListener("DOMContentLoaded", function () {
           });
   }
 
+  // Show a conversation we have the latest messages of
+  function showConversation(conversation) {
+    const otherUser = conversation.otherUser;
+    currentChatUserId = otherUser.id;
+    const displayName = otherUser.full_name || otherUser.username;
+    chatUserName.textContent = displayName;
+
+    // Safe avatar handling - use real avatar if available, otherwise fallback
+    const avatarUrl = otherUser.profile?.avatar ||
+        `https://ui-avatars.com/api/?name=${encodeURIComponent(displayName)}&background=random&color=fff`;
+    chatUserAvatar.src = avatarUrl;
+
+    // Add error handling in case the avatar fails to load
+    chatUserAvatar.onerror = () => {
+        chatUserAvatar.src = `https://ui-avatars.com/api/?name=${encodeURIComponent(displayName)}&background=random&color=fff`;
+        chatUserAvatar.onerror = null; // Prevent infinite loop
+    };
+
+    chatUserName.href = `profile/${otherUser.id}/`;
+
+    renderMessages(conversation.messages);
+
+    // Update last message ID
+    const messages = conversation.messages;
+    lastMessageId = messages.length > 0 ? messages[messages.length - 1].id : null;
+    oldestMessageId = conversation.oldestMessageId;
+    hasOlderMessages = conversation.hasOlderMessages;
+
+    // Messages that arrived while another chat was open are seen now
+    const incoming = messages.filter((message) => !message.is_me);
+    const lastIncoming = incoming.length ? incoming[incoming.length - 1].id : 0;
+    if (lastIncoming > conversation.readUpTo) {
+      markRead(conversation, lastIncoming);
+    }
+
+    // Poll for new messages only when the push channel is down
+    if (!pushConnected) {
+      startMessageUpdates();
+    }
+  }
+
+  function markRead(conversation, messageId) {
+    conversation.readUpTo = messageId;
+    fetch(`mark-read/${messageId}/`, {
+      method: "POST",
+      headers: { "X-CSRFToken": getCookie("csrftoken") },
+    }).catch((error) => {
+      console.error("Error marking message as read:", error);
+    });
+  }
+
+  // Keep the cached copy of a conversation current
+  function rememberMessage(message) {
+    const peerId = String(message.is_me ? message.recipient_id : message.sender_id);
+    const conversation = conversationCache.get(peerId);
+    if (!conversation || conversation.messages.some((cached) => cached.id === message.id)) {
+      return;
+    }
+
+    const messages = conversation.messages;
+    messages.push(message);
+    messages.sort((a, b) => a.id - b.id);
+    if (messages.length > CACHED_MESSAGES_LIMIT) {
+      messages.splice(0, messages.length - CACHED_MESSAGES_LIMIT);
+      conversation.oldestMessageId = messages[0].id;
+      conversation.hasOlderMessages = true;
+    }
+  }
+
+  function receiveMessage(message) {
+    rememberMessage(message);
+    updateConversationPreview(message);
+    handlePushedMessage(message);
+  }
+
+  // The peer has read our messages up to lastRead
+  function applyPeerRead(peerId, lastRead) {
+    const conversation = conversationCache.get(String(peerId));
+    if (conversation) {
+      conversation.messages.forEach((message) => {
+        if (message.is_me) {
+          message.is_read = message.id <= lastRead;
+        }
+      });
+    }
+    if (
+      String(peerId) === String(currentChatUserId) &&
+      lastMessageId &&
+      lastRead >= Number(lastMessageId)
+    ) {
+      markOwnMessagesAsRead();
+    }
+  }
+
+  function applyChange(change) {
+    const peerId = String(change.peer_id);
+    const conversation = conversationCache.get(peerId);
+
+    if (change.kind === "message") {
+      receiveMessage(change.message);
+    } else if (change.kind === "read") {
+      if (String(change.reader_id) === peerId) {
+        applyPeerRead(peerId, change.last_read);
+      } else if (conversation) {
+        // We read (or marked unread) the conversation from another tab
+        conversation.readUpTo = change.last_read;
+      }
+    } else if (change.kind === "conversation_deleted") {
+      conversationCache.delete(peerId);
+      if (peerId === String(currentChatUserId)) {
+        lastMessageId = null;
+        renderMessages([]);
+      }
+    }
+  }
+
+  // Too far behind for the log, start over from the server state
+  function resetState(lastSeq) {
+    changeSeq = lastSeq;
+    conversationCache.clear();
+    if (currentChatUserId) {
+      fetchMessages(currentChatUserId);
+    }
+  }
+
+  // Apply everything that changed since changeSeq, a page at a time
+  function catchUp() {
+    // A sync in flight is already fetching the same entries
+    if (isCatchingUp || isSyncing) return;
+    isCatchingUp = true;
+
+    fetch(`changes/?after=${changeSeq}`)
+      .then((response) => {
+        if (!response.ok) {
+          throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        return response.json();
+      })
+      .then((data) => {
+        if (data.reset) {
+          resetState(data.last_seq);
+          return;
+        }
+
+        data.changes.forEach(applyChange);
+        changeSeq = data.last_seq;
+        if (data.has_more) {
+          setTimeout(catchUp, 0);
+        }
+      })
+      .catch((error) => {
+        console.error("Error catching up on changes:", error);
+      })
+      .finally(() => {
+        isCatchingUp = false;
+      });
+  }
+
+  // Keep the open conversations across reloads of this tab
+  function saveState() {
+    try {
+      sessionStorage.setItem(STATE_STORAGE_KEY, JSON.stringify({
+        changeSeq: changeSeq,
+        currentChatUserId: currentChatUserId,
+        conversations: Array.from(conversationCache.entries()),
+      }));
+    } catch (error) {
+      console.error("Error saving chat state:", error);
+    }
+  }
+
+  function restoreState() {
+    try {
+      const saved = JSON.parse(sessionStorage.getItem(STATE_STORAGE_KEY));
+      if (!saved) return null;
+      changeSeq = saved.changeSeq;
+      saved.conversations.forEach(([peerId, conversation]) => {
+        conversationCache.set(peerId, conversation);
+      });
+      return saved.currentChatUserId;
+    } catch (error) {
+      console.error("Error restoring chat state:", error);
+      return null;
+    }
+  }
+
   // Render messages
   function renderMessages(messages) {
     // Clear existing messages but keep temporary ones
@@ -536,7 +730,54 @@ document.addEventListener("DOMContentLoaded", function () {
     scrollToBottom();
   }
 
-  function appendMessage(message) {
+  // Load the page of history before the oldest message on screen
+  function loadOlderMessages() {
+    if (!currentChatUserId || !hasOlderMessages || isLoadingOlder) return;
+
+    isLoadingOlder = true;
+    const userId = currentChatUserId;
+
+    fetch(`get/${userId}/?before_id=${oldestMessageId}`)
+      .then((response) => {
+        if (!response.ok) {
+          throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        return response.json();
+      })
+      .then((data) => {
+        // Ignore the page if the user switched chats in the meantime
+        if (String(userId) !== String(currentChatUserId)) return;
+
+        const page = document.createElement("div");
+        data.messages.forEach((message) => appendMessage(message, page));
+
+        // Drop the duplicate date separator where the pages meet
+        const firstElement = messagesContainer.firstElementChild;
+        const lastPageDate = page.lastElementChild?.getAttribute("data-message-date");
+        if (
+          firstElement?.hasAttribute("data-date-separator") &&
+          firstElement.getAttribute("data-date-separator") === lastPageDate
+        ) {
+          firstElement.remove();
+        }
+
+        // Keep the visible messages in place while prepending
+        const previousHeight = messagesContainer.scrollHeight;
+        messagesContainer.prepend(...page.childNodes);
+        messagesContainer.scrollTop += messagesContainer.scrollHeight - previousHeight;
+
+        oldestMessageId = data.next_before_id;
+        hasOlderMessages = data.has_more;
+      })
+      .catch((error) => {
+        console.error("Error loading older messages:", error);
+      })
+      .finally(() => {
+        isLoadingOlder = false;
+      });
+  }
+
+  function appendMessage(message, container = messagesContainer) {
     // Validate input
     if (!message || typeof message !== "object") {
       console.error("Invalid message object:", message);
@@ -548,7 +789,7 @@ document.addEventListener("DOMContentLoaded", function () {
     const messageDate = message.timestamp
       ? new Date(message.timestamp).toLocaleDateString()
       : "";
-    const lastMessageElement = messagesContainer.lastElementChild;
+    const lastMessageElement = container.lastElementChild;
     const lastMessageDate =
       lastMessageElement?.getAttribute("data-message-date");
 
@@ -557,12 +798,13 @@ document.addEventListener("DOMContentLoaded", function () {
       if (messageDate && messageDate !== lastMessageDate) {
         const dateElement = document.createElement("div");
         dateElement.className = "flex justify-center my-4";
+        dateElement.setAttribute("data-date-separator", messageDate);
         dateElement.innerHTML = `
                 <span class="px-3 py-1 text-xs text-gray-500 bg-gray-100 rounded-full">
                     ${messageDate}
                 </span>
             `;
-        messagesContainer.appendChild(dateElement);
+        container.appendChild(dateElement);
       }
 
       // Safely remove existing message
@@ -649,8 +891,8 @@ document.addEventListener("DOMContentLoaded", function () {
         `;
 
       // Safely append to container
-      if (messagesContainer) {
-        messagesContainer.appendChild(messageElement);
+      if (container) {
+        container.appendChild(messageElement);
       } else {
         console.error("Messages container not found");
         return;
@@ -687,104 +929,163 @@ document.addEventListener("DOMContentLoaded", function () {
   function startMessageUpdates() {
     stopMessageUpdates(); // Clear any existing interval
 
-    // Check for new messages every 2 seconds
-    messageUpdateInterval = setInterval(() => {
-      if (currentChatUserId) {
-        checkForNewMessages();
-        checkTypingIndicators();
-      }
-    }, 2000);
-  }
-
-  // Stop periodic updates
-  function stopMessageUpdates() {
-    if (messageUpdateInterval) {
-      clearInterval(messageUpdateInterval);
-      messageUpdateInterval = null;
-    }
+    // The open conversation is long-polled, so the sync only has to keep
+    // the sidebar and the other conversations fresh
+    messageUpdateInterval = setInterval(syncChanges, 30000);
+    pollUpdates();
   }
 
-  // Helper function to check scroll position
-  function isScrolledToBottom() {
-    if (!messagesContainer) return true;
-    return (
-      messagesContainer.scrollHeight - messagesContainer.clientHeight <=
-      messagesContainer.scrollTop + 50
-    );
-  }
-
-  // Check for new messages since lastMessageId
-  function checkForNewMessages() {
+  // Wait for the open conversation to change. The server holds the request
+  // until a message, read receipt or typing change arrives, or answers 304
+  // after LONG_POLL_SECONDS.
+  function pollUpdates() {
+    if (updatesController) updatesController.abort();
     if (!currentChatUserId) return;
 
-    fetch(
-      `updates/?user_id=${currentChatUserId}&last_id=${lastMessageId || ""}`
-    )
+    const controller = new AbortController();
+    updatesController = controller;
+    const userId = currentChatUserId;
+    const startedAt = Date.now();
+    let retryDelay = 0;
+
+    const params = new URLSearchParams({
+      user_id: userId,
+      last_id: lastMessageId || "",
+      wait: LONG_POLL_SECONDS,
+    });
+    fetch(`updates/?${params}`, {
+      headers: updatesEtag ? { "If-None-Match": updatesEtag } : {},
+      cache: "no-store",
+      signal: controller.signal,
+    })
       .then((response) => {
+        if (response.status === 304) return null;
         if (!response.ok) {
           throw new Error(`HTTP error! status: ${response.status}`);
         }
+        updatesEtag = response.headers.get("ETag");
         return response.json();
       })
       .then((data) => {
-        if (!data || !data.messages) {
-          throw new Error("Invalid response format from server");
+        if (!data) return;
+        data.messages.forEach(receiveMessage);
+        applyPeerRead(userId, data.peer_last_read);
+        if (data.is_typing) {
+          showTypingIndicator();
+        } else {
+          hideTypingIndicator();
         }
+      })
+      .catch((error) => {
+        if (error.name === "AbortError") return;
+        console.error("Error polling for updates:", error);
+        retryDelay = 5000;
+      })
+      .finally(() => {
+        // Replaced by a newer poll, or stopped
+        if (updatesController !== controller) return;
+        updatesController = null;
+        // Never more often than every 2 seconds, e.g. against a server
+        // with long polling turned off
+        const delay = Math.max(retryDelay, 2000 - (Date.now() - startedAt));
+        setTimeout(() => {
+          if (!updatesController && messageUpdateInterval && String(userId) === String(currentChatUserId)) {
+            pollUpdates();
+          }
+        }, delay);
+      });
+  }
 
-        // Safely handle message filtering
-        const newMessages = data.messages.filter((message) => {
-          try {
-            // Skip if message is invalid
-            if (!message || !message.id) return false;
-
-            // Convert ID to string if needed
-            const messageId = String(message.id);
+  // Fetch everything that changed since changeSeq, along with unread
+  // counts and typing state. The sync cursor is the change log position.
+  function syncChanges() {
+    if (isSyncing || isCatchingUp) return;
+    isSyncing = true;
 
-            // Skip if already displayed
-            if (document.querySelector(`[data-message-id="${messageId}"]`)) {
-              return false;
-            }
+    const params = new URLSearchParams({
+      cursor: changeSeq,
+      typing: currentChatUserId || "",
+    });
+    fetch(`sync/?${params}`)
+      .then((response) => {
+        if (!response.ok) {
+          throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        return response.json();
+      })
+      .then((data) => {
+        if (data.reset) {
+          resetState(Number(data.cursor));
+          return;
+        }
 
-            // Skip if this is a pending message we've already handled
-            if (messageId.startsWith("temp-")) {
-              const tempId = messageId.replace("temp-", "");
-              return !pendingMessages.has(tempId);
-            }
+        data.changes.forEach(applyChange);
+        changeSeq = Number(data.cursor);
 
-            return true;
-          } catch (error) {
-            console.error("Error processing message:", error);
-            return false;
-          }
+        data.conversations.forEach((conversation) => {
+          applyPeerRead(conversation.user_id, conversation.peer_last_read);
         });
 
-        // Safely append new messages
-        if (newMessages.length > 0) {
-          newMessages.forEach((message) => {
-            try {
-              appendMessage(message);
-            } catch (error) {
-              console.error("Error appending message:", error);
-            }
-          });
-
-          // Update last message ID
-          lastMessageId = String(newMessages[newMessages.length - 1].id);
-
-          // Scroll to bottom if not actively scrolling
-          if (
-            messagesContainer &&
-            !messagesContainer.classList.contains("scrolling")
-          ) {
-            scrollToBottom();
+        if (currentChatUserId && String(currentChatUserId) in data.typing) {
+          if (data.typing[currentChatUserId]) {
+            showTypingIndicator();
+          } else {
+            hideTypingIndicator();
           }
         }
+
+        // More changes are waiting, don't wait for the next tick
+        if (data.has_more) {
+          setTimeout(syncChanges, 0);
+        }
       })
       .catch((error) => {
-        console.error("Error checking for new messages:", error);
+        console.error("Error syncing:", error);
+      })
+      .finally(() => {
+        isSyncing = false;
       });
   }
 
+  // Show the latest message in the sidebar and move the conversation to the top
+  function updateConversationPreview(message) {
+    const peerId = message.is_me ? message.recipient_id : message.sender_id;
+    const item = document.querySelector(
+      `.conversation-item[data-user-id="${peerId}"]`
+    );
+    if (!item) return;
+
+    const preview = item.querySelector("p.text-sm");
+    if (preview) {
+      preview.textContent =
+        message.content.length > 30
+          ? `${message.content.slice(0, 29)}…`
+          : message.content;
+    }
+    item.parentNode.prepend(item);
+  }
+
+  // Stop periodic updates
+  function stopMessageUpdates() {
+    if (messageUpdateInterval) {
+      clearInterval(messageUpdateInterval);
+      messageUpdateInterval = null;
+    }
+    if (updatesController) {
+      updatesController.abort();
+      updatesController = null;
+    }
+  }
+
+  // Helper function to check scroll position
+  function isScrolledToBottom() {
+    if (!messagesContainer) return true;
+    return (
+      messagesContainer.scrollHeight - messagesContainer.clientHeight <=
+      messagesContainer.scrollTop + 50
+    );
+  }
+
   // Scroll to bottom of messages
   function scrollToBottom() {
     if (messagesContainer) {
@@ -798,6 +1099,13 @@ document.addEventListener("DOMContentLoaded", function () {
   // Track if user is scrolling
   if (messagesContainer) {
     messagesContainer.addEventListener("scroll", function () {
+      // Fetch older history when the user scrolls up to the top
+      const scrollTop = messagesContainer.scrollTop;
+      if (scrollTop < lastScrollTop && scrollTop < 100) {
+        loadOlderMessages();
+      }
+      lastScrollTop = scrollTop;
+
       messagesContainer.classList.add("scrolling");
       clearTimeout(messagesContainer.scrollTimeout);
       messagesContainer.scrollTimeout = setTimeout(() => {
@@ -815,11 +1123,205 @@ document.addEventListener("DOMContentLoaded", function () {
     };
   }
 
-  // Initialize with first conversation if available
-  if (conversationItems.length > 0) {
+  // Open the server push channel, falling back to polling when unavailable
+  function connectPushChannel() {
+    if (!window.EventSource) return;
+
+    eventSource = new EventSource("stream/");
+
+    eventSource.addEventListener("open", function () {
+      pushConnected = true;
+      stopMessageUpdates();
+      clearInterval(pushSyncInterval);
+      pushSyncInterval = setInterval(syncChanges, PUSH_SYNC_INTERVAL);
+      // Catch up on anything that changed while we were disconnected
+      catchUp();
+    });
+
+    eventSource.addEventListener("message", function (e) {
+      // Same as a polled message: cache, sidebar preview and open thread
+      receiveMessage(JSON.parse(e.data));
+    });
+
+    eventSource.addEventListener("read", function (e) {
+      const data = JSON.parse(e.data);
+      applyPeerRead(data.reader_id, data.last_read);
+    });
+
+    eventSource.addEventListener("typing", function (e) {
+      const data = JSON.parse(e.data);
+      if (!currentChatUserId || String(data.user_id) !== String(currentChatUserId)) return;
+
+      clearTimeout(typingHideTimeout);
+      if (data.is_typing) {
+        showTypingIndicator();
+        // Don't get stuck showing the indicator if the stop event is lost
+        typingHideTimeout = setTimeout(hideTypingIndicator, 5000);
+      } else {
+        hideTypingIndicator();
+      }
+    });
+
+    eventSource.addEventListener("error", function () {
+      pushConnected = false;
+      clearInterval(pushSyncInterval);
+      pushSyncInterval = null;
+      if (eventSource.readyState === EventSource.CLOSED) {
+        // The server declined the stream (e.g. not running under ASGI)
+        eventSource = null;
+      }
+      if (currentChatUserId) {
+        startMessageUpdates();
+      }
+    });
+  }
+
+  function handlePushedMessage(message) {
+    if (!message || !message.id || !currentChatUserId) return;
+
+    const peerId = message.is_me ? message.recipient_id : message.sender_id;
+    if (String(peerId) !== String(currentChatUserId)) return;
+
+    if (document.querySelector(`[data-message-id="${message.id}"]`)) return;
+
+    // Our own sends from this tab are confirmed by the send/ response
+    if (
+      message.is_me &&
+      Array.from(pendingMessages.values()).some(
+        (msg) => msg.content === message.content
+      )
+    ) {
+      return;
+    }
+
+    if (!message.is_me) {
+      hideTypingIndicator();
+    }
+
+    appendMessage(message);
+    if (!lastMessageId || Number(message.id) > Number(lastMessageId)) {
+      lastMessageId = String(message.id);
+    }
+
+    if (!messagesContainer.classList.contains("scrolling")) {
+      scrollToBottom();
+    }
+
+    // The conversation is open, so the message has been seen
+    if (!message.is_me) {
+      markRead(
+        conversationCache.get(String(currentChatUserId)) || { readUpTo: 0 },
+        message.id
+      );
+    }
+  }
+
+  function markOwnMessagesAsRead() {
+    messagesContainer
+      .querySelectorAll(".message-status-container .message-status")
+      .forEach((status) => {
+        status.innerHTML = `
+                <span class="message-status flex">
+                    <svg xmlns="http://www.w3.org/2000/svg" class="h-3 w-3 text-green-500" viewBox="0 0 20 20" fill="currentColor">
+                        <path fill-rule="evenodd" d="M16.707 5.293a1 1 0 010 1.414l-8 8a1 1 0 01-1.414 0l-4-4a1 1 0 011.414-1.414L8 12.586l7.293-7.293a1 1 0 011.414 0z" clip-rule="evenodd" />
+                    </svg>
+                    <svg xmlns="http://www.w3.org/2000/svg" class="h-3 w-3 text-green-500 -ml-1" viewBox="0 0 20 20" fill="currentColor">
+                        <path fill-rule="evenodd" d="M16.707 5.293a1 1 0 010 1.414l-8 8a1 1 0 01-1.414 0l-4-4a1 1 0 011.414-1.414L8 12.586l7.293-7.293a1 1 0 011.414 0z" clip-rule="evenodd" />
+                    </svg>
+                </span>
+            `;
+      });
+  }
+
+  // Presence: a heartbeat while the page is visible, answered with the
+  // status of every contact in the sidebar
+  let presenceInterval = null;
+
+  function presenceTitle(status) {
+    if (status.online) return "Online";
+    if (status.last_seen) return `Last seen ${new Date(status.last_seen).toLocaleString()}`;
+    return "Offline";
+  }
+
+  function applyPresence(statuses) {
+    Object.entries(statuses).forEach(([userId, status]) => {
+      const dot = document.querySelector(
+        `.conversation-item[data-user-id="${userId}"] .presence-dot`
+      );
+      if (!dot) return;
+      dot.classList.toggle("bg-green-500", status.online);
+      dot.classList.toggle("bg-gray-300", !status.online);
+      dot.dataset.lastSeen = status.last_seen || "";
+      dot.title = presenceTitle(status);
+    });
+  }
+
+  function sendHeartbeat() {
+    const userIds = Array.from(
+      document.querySelectorAll(".conversation-item"),
+      (item) => item.getAttribute("data-user-id")
+    );
+    fetch("presence/", {
+      method: "POST",
+      headers: {
+        "Content-Type": "application/json",
+        "X-CSRFToken": getCookie("csrftoken"),
+      },
+      body: JSON.stringify({ user_ids: userIds }),
+    })
+      .then((response) => (response.ok ? response.json() : null))
+      .then((data) => {
+        if (data) applyPresence(data.presence);
+      })
+      .catch((error) => {
+        console.error("Error sending heartbeat:", error);
+      });
+  }
+
+  function startHeartbeat() {
+    stopHeartbeat();
+    presenceInterval = setInterval(sendHeartbeat, 30000);
+  }
+
+  function stopHeartbeat() {
+    clearInterval(presenceInterval);
+    presenceInterval = null;
+  }
+
+  // Rendered by the server; only the "last seen" wording is local
+  document.querySelectorAll(".presence-dot").forEach((dot) => {
+    const online = dot.classList.contains("bg-green-500");
+    dot.title = presenceTitle({ online, last_seen: dot.dataset.lastSeen });
+  });
+
+  connectPushChannel();
+
+  const restoredChatUserId = restoreState();
+  const restoredItem = restoredChatUserId &&
+    document.querySelector(`.conversation-item[data-user-id="${restoredChatUserId}"]`);
+
+  // Initialize with the conversation open before a reload, or the first one
+  if (restoredItem) {
+    restoredItem.click();
+  } else if (conversationItems.length > 0) {
     conversationItems[0].click();
   }
 
   // Connect to server when page loads
-  checkForNewMessages();
+  catchUp();
+  syncChanges();
+  // Loading the page was the first heartbeat
+  startHeartbeat();
+
+  window.addEventListener("pagehide", saveState);
+  document.addEventListener("visibilitychange", function () {
+    if (document.visibilityState === "hidden") {
+      saveState();
+      stopHeartbeat();
+    } else {
+      catchUp();
+      sendHeartbeat();
+      startHeartbeat();
+    }
+  });
 });
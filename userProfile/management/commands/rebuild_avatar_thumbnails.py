@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from userProfile import thumbnails
+from userProfile.models import Profile
+
+
+class Command(BaseCommand):
+    help = 'Generate the pre-sized avatar variants for profiles that do not have them yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Regenerate variants for every avatar')
+
+    def handle(self, *args, **options):
+        profiles = Profile.objects.exclude(avatar='').exclude(avatar__isnull=True)
+        if not options['all']:
+            profiles = profiles.filter(avatar_thumbnails_ready=False)
+
+        generated = failed = 0
+        for profile_id, name in profiles.values_list('id', 'avatar').iterator():
+            if thumbnails.generate(profile_id, name):
+                generated += 1
+            else:
+                failed += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Generated thumbnails for {generated} avatars'))
+        if failed:
+            self.stdout.write(self.style.WARNING(f'Skipped {failed} avatars that could not be read'))
@@ -3,6 +3,8 @@ from django.contrib.auth.models import User
 from django.dispatch import receiver
 from django.db.models.signals import post_save
 
+from .thumbnails import variant_name
+
 def user_avatar_path(instance, filename):
     # file will be uploaded to MEDIA_ROOT/avatars/user_<id>/<filename>
     return f'avatars/user_{instance.user.id}/{filename}'
@@ -10,11 +12,36 @@ def user_avatar_path(instance, filename):
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, unique=True)
     avatar = models.ImageField(upload_to=user_avatar_path, null=True, blank=True)
+    # Set once the pre-sized variants of the current avatar have been written
+    avatar_thumbnails_ready = models.BooleanField(default=False)
     bio = models.TextField(max_length=500, blank=True)
     
     def __str__(self):
         return f'{self.user.username} Profile'
 
+    def avatar_variant_url(self, size):
+        # Falls back to the original until the thumbnails are ready
+        if not self.avatar:
+            return None
+        if self.avatar_thumbnails_ready:
+            return self.avatar.storage.url(variant_name(self.avatar.name, size))
+        try:
+            return self.avatar.url
+        except ValueError:
+            return None
+
+    @property
+    def avatar_small_url(self):
+        return self.avatar_variant_url(48)
+
+    @property
+    def avatar_medium_url(self):
+        return self.avatar_variant_url(128)
+
+    @property
+    def avatar_large_url(self):
+        return self.avatar_variant_url(512)
+
 @receiver(post_save, sender=User)
 def manage_user_profile(sender, instance, created, **kwargs):
     if created:
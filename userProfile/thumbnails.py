@@ -0,0 +1,101 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from contacts import graph
+
+logger = logging.getLogger(__name__)
+
+# Square avatar variants, in pixels. Lists use the small ones, profile pages
+# the large one; the original upload is kept for reference only.
+AVATAR_SIZES = (48, 128, 512)
+AVATAR_QUALITY = 85
+
+# Resizing is CPU bound but short, two workers keep uploads off the request
+# thread without letting a burst of uploads starve the web process.
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='avatar-thumbnails')
+
+
+def variant_name(name, size):
+    # avatars/user_<id>/me.png -> avatars/user_<id>/me_128.jpg
+    root, _ = os.path.splitext(name)
+    return f'{root}_{size}.jpg'
+
+
+def render_variants(source):
+    """Return ``{size: jpeg bytes}`` for an open image file."""
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        else:
+            image = image.convert('RGB')
+
+        variants = {}
+        for size in AVATAR_SIZES:
+            thumbnail = ImageOps.fit(image, (size, size), Image.LANCZOS)
+            buffer = BytesIO()
+            thumbnail.save(buffer, 'JPEG', quality=AVATAR_QUALITY, optimize=True, progressive=True)
+            variants[size] = buffer.getvalue()
+        return variants
+
+
+def generate(profile_id, name):
+    """Write the variants for ``name`` and flag the profile if it still uses it."""
+    from .models import Profile
+
+    storage = Profile._meta.get_field('avatar').storage
+    try:
+        with storage.open(name) as source:
+            variants = render_variants(source)
+    except (FileNotFoundError, UnidentifiedImageError, OSError):
+        logger.warning('Could not create avatar thumbnails for %s', name, exc_info=True)
+        return False
+
+    for size, content in variants.items():
+        path = variant_name(name, size)
+        if storage.exists(path):
+            storage.delete(path)
+        storage.save(path, ContentFile(content))
+
+    # The user may have uploaded another avatar while we were working
+    profiles = Profile.objects.filter(pk=profile_id, avatar=name)
+    user_id = profiles.values_list('user_id', flat=True).first()
+    if user_id is None or not profiles.update(avatar_thumbnails_ready=True):
+        return False
+    # Contacts have the original URL cached in their graph records
+    graph.invalidate(*graph.contact_ids(user_id))
+    return True
+
+
+def _run(profile_id, name):
+    try:
+        generate(profile_id, name)
+    except Exception:
+        logger.exception('Avatar thumbnail job failed for %s', name)
+    finally:
+        # Worker threads outlive requests, never leave a connection behind
+        connections.close_all()
+
+
+def schedule(profile):
+    """Queue thumbnail generation for the profile's current avatar after commit."""
+    if not profile.avatar:
+        return
+    profile_id, name = profile.pk, profile.avatar.name
+    transaction.on_commit(lambda: _executor.submit(_run, profile_id, name))
+
+
+def delete_variants(storage, name):
+    for size in AVATAR_SIZES:
+        path = variant_name(name, size)
+        if storage.exists(path):
+            storage.delete(path)
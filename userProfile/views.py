@@ -3,11 +3,12 @@ from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.contrib.auth import update_session_auth_hash
 from django.contrib.auth.models import User
-from django.db.models import Max, Q
+from django.db.models import Max
 from django.db.models.functions import Greatest
 from django.utils import timezone
 from .models import Profile
-from contacts.models import Contact
+from . import thumbnails
+from contacts import graph
 import os
 
 
@@ -15,19 +16,7 @@ import os
 
 @login_required
 def user_profile(request):
-    # Get active contacts (where status is 'accepted' and user is either requester or recipient)
-    active_contacts = Contact.objects.filter(
-        (Q(requester=request.user) | Q(recipient=request.user)),
-        status='accepted'
-    ).select_related('requester', 'recipient')
-    
-    # Extract the other user for each contact
-    contact_users = []
-    for contact in active_contacts:
-        if contact.requester == request.user:
-            contact_users.append(contact.recipient)
-        else:
-            contact_users.append(contact.requester)
+    contact_users = graph.contact_users(request.user)
     
     # Get other profile data
     total_messages = request.user.sent_messages.count() + request.user.received_messages.count()
@@ -51,6 +40,7 @@ def edit_profile(request):
         
         if form_type == 'personal_info':
             # Handle avatar upload
+            avatar_changed = False
             if 'avatar' in request.FILES:
                 avatar = request.FILES['avatar']
                 # Validate file size (2MB max)
@@ -62,7 +52,10 @@ def edit_profile(request):
                         old_avatar_path = profile.avatar.path
                         if os.path.exists(old_avatar_path):
                             os.remove(old_avatar_path)
+                        thumbnails.delete_variants(profile.avatar.storage, profile.avatar.name)
                     profile.avatar = avatar
+                    profile.avatar_thumbnails_ready = False
+                    avatar_changed = True
             
             # Update profile fields
             profile.bio = request.POST.get('bio', '')
@@ -81,6 +74,11 @@ def edit_profile(request):
                     request.user.email = new_email
             
             request.user.save()
+            if avatar_changed:
+                # Queued last, saving the user above re-saves the profile row too
+                thumbnails.schedule(profile)
+            # Contacts cache this user's name and avatar in their graph
+            graph.invalidate(*graph.contact_ids(request.user))
             messages.success(request, 'Profile updated successfully!')
             return redirect('edit_profile')
         